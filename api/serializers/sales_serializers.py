@@ -1,7 +1,11 @@
+from decimal import Decimal
+from django.db import transaction
 from rest_framework import serializers
 from sales.models import Sale, SaleItem
+from sales.services import CheckoutError, checkout
 from products.models import Product
 from customers.models import Customer
+from superadmin.middleware import get_current_business
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -33,12 +37,54 @@ class SaleSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class SaleItemCreateSerializer(serializers.Serializer):
+    # Pass the manager so the queryset is evaluated in the request's business context
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects)
+    quantity = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+
 class SaleCreateUpdateSerializer(serializers.ModelSerializer):
+    items = SaleItemCreateSerializer(many=True, write_only=True, required=False)
+    
     class Meta:
         model = Sale
         fields = [
-            'customer', 'payment_method', 'discount', 'notes'
+            'customer', 'payment_method', 'discount', 'notes', 'items'
+        ]
+    
+    def create(self, validated_data):
+        items = validated_data.pop('items', [])
+        business = get_current_business()
+        
+        if not items:
+            return Sale.objects.create(business=business, **validated_data)
+        
+        # Locks the products, checks their stock and takes it off in one UPDATE
+        lines = [
+            {
+                'product_id': item['product'].pk,
+                'quantity': item['quantity'],
+                'unit_price': item.get('unit_price', item['product'].selling_price),
+            }
+            for item in items
         ]
+        try:
+            with transaction.atomic():
+                sale = checkout(
+                    business,
+                    lines,
+                    customer=validated_data.get('customer'),
+                    payment_method=validated_data.get('payment_method', 'cash'),
+                    discount=validated_data.get('discount', 0),
+                )
+                if validated_data.get('notes'):
+                    sale.notes = validated_data['notes']
+                    Sale.objects.for_business(business).filter(pk=sale.pk).update(notes=sale.notes)
+        except CheckoutError as e:
+            raise serializers.ValidationError({'items': [str(e)]})
+        
+        return sale
 
 
 class SaleListSerializer(serializers.ModelSerializer):
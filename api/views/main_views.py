@@ -5,7 +5,9 @@ from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from django.utils import timezone
+from utils.dates import on_day
 
+from api.pagination import KeysetPagination
 from api.serializers.product_serializers import (
     ProductSerializer, ProductCreateUpdateSerializer, ProductListSerializer
 )
@@ -25,6 +27,11 @@ class ProductListView(generics.ListAPIView):
     search_fields = ['name', 'sku', 'barcode']
     ordering_fields = ['name', 'sku', 'quantity', 'selling_price']
     ordering = ['name']
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        # Resolved per request: the class-level queryset was built without a business context
+        return Product.objects.business_specific().select_related('category', 'unit')
 
 
 class ProductDetailView(generics.RetrieveAPIView):
@@ -60,6 +67,11 @@ class SaleListView(generics.ListAPIView):
     search_fields = ['id', 'customer__full_name']
     ordering_fields = ['sale_date', 'total_amount']
     ordering = ['-sale_date']
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        # Resolved per request: the class-level queryset was built without a business context
+        return Sale.objects.business_specific()
 
 
 class SaleDetailView(generics.RetrieveAPIView):
@@ -83,6 +95,6 @@ def dashboard_stats(request):
         'total_products': Product.objects.count(),
         'low_stock_products': Product.objects.filter(is_low_stock=True).count(),
         'total_sales': Sale.objects.count(),
-        'today_sales': Sale.objects.filter(sale_date__date=timezone.now().date()).count(),
+        'today_sales': Sale.objects.filter(**on_day('sale_date', timezone.localdate())).count(),
     }
     return Response(stats)
\ No newline at end of file
@@ -32,7 +32,7 @@ def login_view(request):
                     # Set the first business as the current business in session
                     first_business = user_businesses.first()
                     request.session['current_business_id'] = first_business.id
-                    # Also set in middleware thread-local storage
+                    # Also set as the current business context
                     from superadmin.middleware import set_current_business
                     set_current_business(first_business)
                     return redirect('dashboard:index')
@@ -96,7 +96,7 @@ def business_details_view(request):
             # Set the business in session
             request.session['current_business_id'] = business.id
             
-            # Also set in middleware thread-local storage
+            # Also set as the current business context
             from superadmin.middleware import set_current_business
             set_current_business(business)
             
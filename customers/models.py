@@ -33,6 +33,10 @@ class Customer(models.Model):
         ordering = ['first_name', 'last_name']
         # Ensure customer email is unique per business
         unique_together = ('business', 'email')
+        indexes = [
+            # Keyset pagination of the customer list walks this ordering
+            models.Index(fields=['business', 'first_name', 'last_name', 'id']),
+        ]
 
     def __str__(self) -> str:  # type: ignore
         return f"{self.first_name} {self.last_name}"  # type: ignore
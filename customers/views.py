@@ -4,11 +4,13 @@ from django.contrib import messages
 from .models import Customer
 from .forms import CustomerForm
 from superadmin.middleware import get_current_business
+from utils.pagination import paginate_request
 
 @login_required
 def customer_list(request):
     customers = Customer.objects.business_specific().filter(is_active=True)
-    return render(request, 'customers/list.html', {'customers': customers})
+    page = paginate_request(request, customers)
+    return render(request, 'customers/list.html', {'customers': page, 'page': page})
 
 @login_required
 def customer_create(request):
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from customers.models import Customer
+from products.models import Product
+from purchases.models import PurchaseOrder
+from sales.models import Sale
+from .stats import invalidate_dashboard_stats
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=PurchaseOrder)
+@receiver(post_delete, sender=Sale)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=PurchaseOrder)
+def invalidate_dashboard_stats_on_write(sender, instance, **kwargs):
+    """Drop the cached dashboard statistics of the business/branch a row belongs to"""
+    try:
+        invalidate_dashboard_stats(instance.business_id, instance.branch_id)
+    except Exception as e:
+        logger.error(f"Error invalidating dashboard stats for {sender.__name__} {instance.pk}: {e}")
@@ -0,0 +1,99 @@
+"""
+Dashboard statistics.
+
+Each model is counted with a single conditional-aggregate query and the result
+is cached per business/branch for a short time. Writes to the underlying models
+invalidate the cached entry (see dashboard.signals).
+"""
+from dataclasses import dataclass, asdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from customers.models import Customer
+from products.models import Product
+from purchases.models import PurchaseOrder
+from sales.models import Sale
+from utils.dates import on_day
+
+# Seconds a computed set of statistics is reused
+DASHBOARD_STATS_TIMEOUT = getattr(settings, 'DASHBOARD_STATS_TIMEOUT', 30)
+
+
+@dataclass(frozen=True)
+class DashboardStats:
+    total_products: int = 0
+    low_stock_count: int = 0
+    out_of_stock_count: int = 0
+    total_sales: int = 0
+    today_sales: int = 0
+    today_revenue: Decimal = Decimal('0')
+    total_customers: int = 0
+    total_purchases: int = 0
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def _queryset(model, business, branch):
+    queryset = model.objects.for_business(business)
+    if branch is not None:
+        queryset = queryset.filter(branch=branch)
+    return queryset
+
+
+def compute_dashboard_stats(business, branch=None):
+    """Compute the dashboard statistics with one aggregate query per model"""
+    today = on_day('sale_date', timezone.localdate())
+
+    products = _queryset(Product, business, branch).aggregate(
+        total=Count('id'),
+        low_stock=Count('id', filter=Q(quantity__lte=F('reorder_level'))),
+        out_of_stock=Count('id', filter=Q(quantity=0)),
+    )
+    sales = _queryset(Sale, business, branch).aggregate(
+        total=Count('id'),
+        today=Count('id', filter=Q(**today)),
+        today_revenue=Sum('total_amount', filter=Q(**today)),
+    )
+
+    return DashboardStats(
+        total_products=products['total'],
+        low_stock_count=products['low_stock'],
+        out_of_stock_count=products['out_of_stock'],
+        total_sales=sales['total'],
+        today_sales=sales['today'],
+        today_revenue=sales['today_revenue'] or Decimal('0'),
+        total_customers=_queryset(Customer, business, branch).count(),
+        total_purchases=_queryset(PurchaseOrder, business, branch).count(),
+    )
+
+
+def stats_cache_key(business_id, branch_id=None):
+    return f"dashboard_stats:{business_id}:{branch_id or 'all'}"
+
+
+def get_dashboard_stats(business, branch=None):
+    """Return cached dashboard statistics for a business (and optionally a branch)"""
+    key = stats_cache_key(business.pk, branch.pk if branch is not None else None)
+    cached = cache.get(key)
+    # "Today" figures must not survive midnight
+    if cached is not None and cached[0] == timezone.localdate():
+        return cached[1]
+
+    stats = compute_dashboard_stats(business, branch)
+    cache.set(key, (timezone.localdate(), stats), DASHBOARD_STATS_TIMEOUT)
+    return stats
+
+
+def invalidate_dashboard_stats(business_id, branch_id=None):
+    """Drop the cached statistics a write to this business/branch may have changed"""
+    if not business_id:
+        return
+    keys = [stats_cache_key(business_id)]
+    if branch_id:
+        keys.append(stats_cache_key(business_id, branch_id))
+    cache.delete_many(keys)
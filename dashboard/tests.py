@@ -1,3 +1,86 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from products.models import Product, Category, Unit
+from sales.models import Sale
+from superadmin.middleware import set_current_business, clear_current_business
+from superadmin.models import Business, Branch
+from dashboard.stats import get_dashboard_stats
+
+User = get_user_model()
+
+
+class DashboardStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(
+            company_name='Test Shop',
+            owner=self.user,
+            email='shop@example.com'
+        )
+        self.branch = Branch.objects.create(business=self.business, name='Main', address='1 Street')
+        set_current_business(self.business)
+
+        category = Category.objects.create(business=self.business, name='Drinks')
+        unit = Unit.objects.create(business=self.business, name='Bottle', symbol='btl')
+        for index, quantity in enumerate([0, 2, 50]):
+            Product.objects.create(
+                business=self.business,
+                name=f'Product {index}',
+                sku=f'SKU{index}',
+                category=category,
+                unit=unit,
+                cost_price=Decimal('1.00'),
+                selling_price=Decimal('2.00'),
+                quantity=quantity,
+                reorder_level=5
+            )
+
+    def tearDown(self):
+        clear_current_business()
+        cache.clear()
+
+    def test_stats_use_one_query_per_model_and_are_cached(self):
+        Sale.objects.create(business=self.business, total_amount=Decimal('12.50'))
+        Sale.objects.create(business=self.business, branch=self.branch, total_amount=Decimal('7.50'))
+
+        # Products, sales, customers and purchase orders
+        with self.assertNumQueries(4):
+            stats = get_dashboard_stats(self.business)
+        with self.assertNumQueries(0):
+            get_dashboard_stats(self.business)
+
+        self.assertEqual(stats.total_products, 3)
+        self.assertEqual(stats.low_stock_count, 2)
+        self.assertEqual(stats.out_of_stock_count, 1)
+        self.assertEqual(stats.total_sales, 2)
+        self.assertEqual(stats.today_sales, 2)
+        self.assertEqual(stats.today_revenue, Decimal('20.00'))
+
+        branch_stats = get_dashboard_stats(self.business, self.branch)
+        self.assertEqual(branch_stats.total_sales, 1)
+        self.assertEqual(branch_stats.total_products, 0)
+
+    def test_writes_invalidate_cached_stats(self):
+        self.assertEqual(get_dashboard_stats(self.business).total_sales, 0)
+        self.assertEqual(get_dashboard_stats(self.business, self.branch).total_sales, 0)
+
+        Sale.objects.create(business=self.business, branch=self.branch, total_amount=Decimal('5.00'))
+
+        self.assertEqual(get_dashboard_stats(self.business).total_sales, 1)
+        self.assertEqual(get_dashboard_stats(self.business, self.branch).total_sales, 1)
+
+    def test_dashboard_view(self):
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+
+        response = self.client.get('/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_products'], 3)
+        self.assertEqual(response.context['low_stock_count'], 2)
@@ -1,15 +1,12 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from products.models import Product
-from sales.models import Sale
-from customers.models import Customer
-from purchases.models import PurchaseOrder
-from expenses.models import Expense
-from django.db.models import Sum, Count, F
-from decimal import Decimal
+from django.db.models import F
 from superadmin.models import Business, Branch
+from superadmin.tenant_cache import session_business
 from superadmin.middleware import set_current_business  # Import the middleware function
 from settings.models import BusinessSettings
+from .stats import get_dashboard_stats
 import logging
 
 # Set up logging
@@ -25,7 +22,7 @@ def dashboard_view(request):
     current_business = None
     if 'current_business_id' in request.session:
         try:
-            current_business = Business.objects.get(id=request.session['current_business_id'])
+            current_business = session_business(request)
             logger.info(f"Found business in session: {current_business}")
         except Business.DoesNotExist:
             # If the business doesn't exist, remove it from session
@@ -69,60 +66,16 @@ def dashboard_view(request):
             del request.session['current_branch_id']
             current_branch = None
     
-    # Get data - either business-wide or branch-specific
+    # Dashboard statistics: one aggregate query per model, cached per business/branch
+    stats = get_dashboard_stats(current_business, current_branch)
+    logger.info(f"Dashboard stats: {stats}")
+    
+    # Low stock products shown on the dashboard
     if current_branch:
-        # Get branch-specific data
-        logger.info(f"Fetching branch-specific data for branch: {current_branch}")
         products = Product.objects.for_branch(current_branch)
-        sales = Sale.objects.for_branch(current_branch)
-        customers = Customer.objects.for_branch(current_branch)
-        purchases = PurchaseOrder.objects.for_branch(current_branch)
-        expenses = Expense.objects.for_branch(current_branch)
     else:
-        # Get business-wide data
-        logger.info(f"Fetching business-wide data for business: {current_business}")
         products = Product.objects.business_specific()
-        sales = Sale.objects.business_specific()
-        customers = Customer.objects.business_specific()
-        purchases = PurchaseOrder.objects.business_specific()
-        expenses = Expense.objects.business_specific()
-    
-    logger.info(f"Products count: {products.count()}")
-    logger.info(f"Sales count: {sales.count()}")
-    logger.info(f"Customers count: {customers.count()}")
-    logger.info(f"Purchases count: {purchases.count()}")
-    logger.info(f"Expenses count: {expenses.count()}")
-    
-    # Calculate dashboard statistics
-    total_products = products.count()
-    total_sales = sales.count()
-    total_customers = customers.count()
-    total_purchases = purchases.count()
-    
-    # Calculate today's sales
-    from django.utils import timezone
-    today = timezone.now().date()
-    today_sales_queryset = sales.filter(sale_date__date=today)
-    today_sales = today_sales_queryset.count()
-    logger.info(f"Today's sales count: {today_sales}")
-    
-    # Calculate low stock products
     low_stock_products = products.filter(quantity__lte=F('reorder_level'))
-    low_stock_count = low_stock_products.count()
-    logger.info(f"Low stock products count: {low_stock_count}")
-    
-    # Calculate out of stock products
-    out_of_stock_count = products.filter(quantity=0).count()
-    logger.info(f"Out of stock products count: {out_of_stock_count}")
-    
-    # Calculate today's profit
-    today_profit = Decimal('0.00')
-    today_sales_objects = today_sales_queryset
-    for sale in today_sales_objects:
-        today_profit += sale.total_amount  # Using total_amount instead of total_profit
-        logger.info(f"Sale {sale.id} amount: {sale.total_amount}")
-    
-    logger.info(f"Today's total profit: {today_profit}")
     
     # Get all branches for the current business for branch switching
     branches = Branch.objects.filter(business=current_business, is_active=True)
@@ -139,14 +92,14 @@ def dashboard_view(request):
         )
     
     context = {
-        'total_products': total_products,
-        'total_sales': total_sales,
-        'total_customers': total_customers,
-        'total_purchases': total_purchases,
-        'today_sales': today_sales,
-        'low_stock_count': low_stock_count,
-        'out_of_stock_count': out_of_stock_count,
-        'today_profit': today_profit,
+        'total_products': stats.total_products,
+        'total_sales': stats.total_sales,
+        'total_customers': stats.total_customers,
+        'total_purchases': stats.total_purchases,
+        'today_sales': stats.today_sales,
+        'low_stock_count': stats.low_stock_count,
+        'out_of_stock_count': stats.out_of_stock_count,
+        'today_profit': stats.today_revenue,  # Using total_amount instead of total_profit
         'low_stock_products': low_stock_products[:5],  # Limit to 5 for display
         'current_business': current_business,
         'current_branch': current_branch,
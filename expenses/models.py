@@ -40,6 +40,9 @@ class Expense(models.Model):
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['business', 'date']),
+        ]
 
     def __str__(self):
         return f"{self.category.name} - ${self.amount}"
\ No newline at end of file
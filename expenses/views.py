@@ -4,11 +4,13 @@ from django.contrib import messages
 from .models import Expense, ExpenseCategory
 from .forms import ExpenseForm, ExpenseCategoryForm
 from superadmin.middleware import get_current_business
+from utils.pagination import paginate_request
 
 @login_required
 def expense_list(request):
-    expenses = Expense.objects.business_specific().all()
-    return render(request, 'expenses/list.html', {'expenses': expenses})
+    expenses = Expense.objects.business_specific().select_related('category')
+    page = paginate_request(request, expenses)
+    return render(request, 'expenses/list.html', {'expenses': page, 'page': page})
 
 @login_required
 def expense_create(request):
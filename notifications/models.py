@@ -26,6 +26,12 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Deduplication looks up unread alerts of a type for a set of products
+            models.Index(fields=['notification_type', 'related_product', 'is_read']),
+            # Keyset pagination of a user's notification list
+            models.Index(fields=['recipient', 'created_at', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.recipient.username}"
@@ -48,22 +54,82 @@ class Notification(models.Model):
             users = User.objects.filter(owned_businesses=business)
         else:
             # Fallback to all users if no product or business context
+            business = None
             users = User.objects.all()
         
-        notifications = []
-        for user in users:
-            notification = cls(
+        return cls.objects.bulk_create([
+            cls(
                 recipient=user,
-                business=related_product.business if related_product and hasattr(related_product, 'business') else None,
+                business=business,
                 title=title,
                 message=message,
                 notification_type=notification_type,
                 related_product=related_product
             )
-            notification.save()
-            notifications.append(notification)
+            for user in users
+        ])
+    
+    @classmethod
+    def plan_for_products(cls, notification_type, alerts, title_contains=None):
+        """
+        Build (without saving) the notifications that notify the users of each
+        product's business, skipping users who still have an unread
+        notification of this type (and title, if given) for the product.
+        
+        ``alerts`` is an iterable of (product, title, message). Uses one query
+        for the recipients and one for deduplication, however many products
+        and users are involved.
+        """
+        from django.contrib.auth import get_user_model
+        User = get_user_model()
+        
+        alerts = [alert for alert in alerts if alert[0] is not None and alert[0].business_id]
+        if not alerts:
+            return []
+        
+        recipients = {}
+        for user_id, business_id in User.objects.filter(
+            owned_businesses__in={product.business_id for product, _, _ in alerts}
+        ).values_list('id', 'owned_businesses'):
+            recipients.setdefault(business_id, []).append(user_id)
         
+        unread = cls.objects.filter(
+            notification_type=notification_type,
+            related_product__in=[product.pk for product, _, _ in alerts],
+            is_read=False
+        )
+        if title_contains:
+            unread = unread.filter(title__icontains=title_contains)
+        existing = set(unread.values_list('recipient_id', 'related_product_id'))
+        
+        notifications = []
+        for product, title, message in alerts:
+            for user_id in recipients.get(product.business_id, []):
+                if (user_id, product.pk) in existing:
+                    continue
+                existing.add((user_id, product.pk))
+                notifications.append(cls(
+                    recipient_id=user_id,
+                    business_id=product.business_id,
+                    title=title,
+                    message=message,
+                    notification_type=notification_type,
+                    related_product=product
+                ))
         return notifications
+    
+    @classmethod
+    def create_for_products(cls, notification_type, alerts, title_contains=None):
+        """Create the notifications planned by plan_for_products with one bulk insert"""
+        return cls.objects.bulk_create(cls.plan_for_products(notification_type, alerts, title_contains))
+    
+    @classmethod
+    def create_for_products_on_commit(cls, notification_type, alerts):
+        """Defer create_for_products until the current transaction commits"""
+        from django.db import transaction
+        alerts = list(alerts)
+        if alerts:
+            transaction.on_commit(lambda: cls.create_for_products(notification_type, alerts))
         
     @classmethod
     def create_for_user(cls, user, title, message, notification_type, related_product=None):
@@ -1,3 +1,76 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+from notifications.models import Notification
+from products.models import Product, Category, Unit
+from superadmin.middleware import set_current_business, clear_current_business
+from superadmin.models import Business
+
+User = get_user_model()
+
+
+class LowStockFanOutTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.other_owner = User.objects.create_user(username='other', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        self.other_business = Business.objects.create(company_name='Other Shop', owner=self.other_owner, email='other@example.com')
+        set_current_business(self.business)
+
+        self.products = [self.create_product(self.business, index) for index in range(3)]
+        self.other_product = self.create_product(self.other_business, 9)
+
+    def tearDown(self):
+        clear_current_business()
+
+    def create_product(self, business, index):
+        category, _ = Category.objects.get_or_create(business=business, name='Drinks')
+        unit, _ = Unit.objects.get_or_create(business=business, name='Bottle', symbol='btl')
+        return Product.objects.create(
+            business=business,
+            name=f'Product {index}',
+            sku=f'SKU{index}',
+            category=category,
+            unit=unit,
+            cost_price=Decimal('1.00'),
+            selling_price=Decimal('2.00'),
+            quantity=1,
+            reorder_level=5
+        )
+
+    def alerts(self, products):
+        return [(product, f'Low Stock Alert: {product.name}', 'Low on stock') for product in products]
+
+    def test_bulk_fan_out_is_deduplicated(self):
+        with self.assertNumQueries(3):
+            created = Notification.create_for_products('low_stock', self.alerts(self.products + [self.other_product]))
+        self.assertEqual(len(created), 4)
+        self.assertEqual(Notification.objects.filter(recipient=self.owner).count(), 3)
+        self.assertEqual(Notification.objects.filter(recipient=self.other_owner).count(), 1)
+
+        # Unread alerts are not repeated, read ones are
+        Notification.objects.filter(related_product=self.products[0]).update(is_read=True)
+        created = Notification.create_for_products('low_stock', self.alerts(self.products))
+        self.assertEqual([notification.related_product for notification in created], [self.products[0]])
+
+    def test_on_commit_defers_fan_out(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Notification.create_for_products_on_commit('low_stock', self.alerts(self.products[:1]))
+            self.assertEqual(Notification.objects.count(), 0)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_checkout_notifies_after_commit(self):
+        from sales.services import checkout
+
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(quantity=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout(self.business, [{'product_id': product.pk, 'quantity': 6, 'unit_price': '2.00'}])
+            self.assertFalse(Notification.objects.exists())
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.recipient, self.owner)
+        self.assertEqual(notification.related_product, product)
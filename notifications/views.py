@@ -6,6 +6,7 @@ from django.utils.timesince import timesince
 from django.http import JsonResponse
 from .models import Notification
 from superadmin.middleware import get_current_business
+from utils.pagination import paginate_request
 
 @login_required
 def notification_list(request):
@@ -21,8 +22,11 @@ def notification_list(request):
     
     unread_count = notifications.filter(is_read=False).count()
     
+    page = paginate_request(request, notifications)
+    
     return render(request, 'notifications/list.html', {
-        'notifications': notifications,
+        'notifications': page,
+        'page': page,
         'unread_count': unread_count
     })
 
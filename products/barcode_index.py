@@ -0,0 +1,182 @@
+"""
+Per-business barcode/SKU index for the scanner endpoints.
+
+Product summaries are kept in the shared cache under one key per barcode and
+one per SKU, so a scan costs a single cache round trip instead of a database
+query. The first lookup for a business warms its whole index with one query;
+the Product signals and the checkout service refresh the entries of changed
+products once their transaction has committed. Keys missing from the cache
+(evicted, or never seen) fall back to the database, so the index never reports
+an existing product as unknown.
+
+The index is only used with a cache every worker shares. With a per-process
+cache (Django's local-memory default) a refresh would only reach the worker
+that made the write, and the others would serve old prices and stock, so
+lookups go to the database instead.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from utils.cache import is_shared_cache
+from .models import Product
+
+# Seconds product summaries and the warm marker stay in the cache
+PRODUCT_INDEX_TIMEOUT = getattr(settings, 'PRODUCT_INDEX_TIMEOUT', 3600)
+# Seconds an unknown barcode/SKU is remembered as missing
+PRODUCT_INDEX_MISS_TIMEOUT = getattr(settings, 'PRODUCT_INDEX_MISS_TIMEOUT', 60)
+
+# Cache marker for barcodes/SKUs that match no product
+MISSING = 'missing'
+
+SUMMARY_FIELDS = (
+    'id', 'name', 'sku', 'barcode', 'selling_price', 'quantity', 'is_active', 'unit__symbol', 'category__name',
+)
+
+
+def _digest(value):
+    # Barcodes come straight from the URL; hash them into cache-safe keys
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def barcode_key(business_id, barcode):
+    return f'products:index:{business_id}:barcode:{_digest(barcode)}'
+
+
+def sku_key(business_id, sku):
+    return f'products:index:{business_id}:sku:{_digest(sku.lower())}'
+
+
+def product_key(business_id, product_id):
+    """Barcode and SKU a product was last indexed under, to drop stale keys"""
+    return f'products:index:{business_id}:product:{product_id}'
+
+
+def warm_key(business_id):
+    return f'products:index:{business_id}:warm'
+
+
+def summarize(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'sku': row['sku'],
+        'barcode': row['barcode'],
+        'price': row['selling_price'],
+        'stock': row['quantity'],
+        'is_active': row['is_active'],
+        'unit': row['unit__symbol'] or '',
+        'category': row['category__name'] or '',
+    }
+
+
+def _entries(business_id, summary):
+    entries = {
+        sku_key(business_id, summary['sku']): summary,
+        product_key(business_id, summary['id']): (summary['barcode'], summary['sku']),
+    }
+    if summary['barcode']:
+        entries[barcode_key(business_id, summary['barcode'])] = summary
+    return entries
+
+
+def _query(business_id, **filters):
+    row = Product.objects.for_business(business_id).filter(**filters).order_by('pk').values(*SUMMARY_FIELDS).first()
+    return summarize(row) if row else None
+
+
+def warm_index(business_id):
+    """
+    Load the summaries of every product of the business into the cache, unless
+    another request already did. Returns the cache entries written, if any.
+    """
+    if not is_shared_cache() or not cache.add(warm_key(business_id), True, PRODUCT_INDEX_TIMEOUT):
+        return {}
+    entries = {}
+    for row in Product.objects.for_business(business_id).order_by('pk').values(*SUMMARY_FIELDS).iterator():
+        entries.update(_entries(business_id, summarize(row)))
+    cache.set_many(entries, PRODUCT_INDEX_TIMEOUT)
+    return entries
+
+
+def _lookup(business_id, key, matches, fallback=True, **filters):
+    if not is_shared_cache():
+        return _query(business_id, **filters)
+
+    cached = cache.get_many([warm_key(business_id), key])
+    if warm_key(business_id) not in cached:
+        cached.update(warm_index(business_id))
+
+    summary = cached.get(key)
+    if summary == MISSING:
+        return None
+    if summary is not None and matches(summary):
+        return summary
+    if not fallback:
+        return None
+
+    # Not cached, or indexed under a value the product no longer has
+    summary = _query(business_id, **filters)
+    if summary is None:
+        cache.set(key, MISSING, PRODUCT_INDEX_MISS_TIMEOUT)
+        return None
+    cache.set(key, summary, PRODUCT_INDEX_TIMEOUT)
+    return summary
+
+
+def lookup_barcode(business_id, barcode, fallback=True):
+    """
+    Summary of the product with this barcode, or None. With ``fallback=False``
+    only the cache is consulted.
+    """
+    return _lookup(
+        business_id, barcode_key(business_id, barcode),
+        lambda summary: summary['barcode'] == barcode,
+        fallback=fallback,
+        barcode=barcode,
+    )
+
+
+def lookup_sku(business_id, sku):
+    """Summary of the product with this SKU (case-insensitive), or None"""
+    return _lookup(
+        business_id, sku_key(business_id, sku),
+        lambda summary: summary['sku'].lower() == sku.lower(),
+        sku__iexact=sku,
+    )
+
+
+def refresh_products(business_id, product_ids):
+    """Re-index these products from the database, dropping deleted ones"""
+    product_ids = set(product_ids)
+    if not product_ids or not is_shared_cache():
+        return
+    previous = cache.get_many([product_key(business_id, product_id) for product_id in product_ids])
+    rows = Product.objects.for_business(business_id).filter(pk__in=product_ids).values(*SUMMARY_FIELDS)
+
+    entries = {}
+    for row in rows:
+        entries.update(_entries(business_id, summarize(row)))
+
+    stale = []
+    for product_id in product_ids:
+        indexed = previous.get(product_key(business_id, product_id))
+        if indexed is None:
+            continue
+        barcode, sku = indexed
+        stale.append(sku_key(business_id, sku))
+        if barcode:
+            stale.append(barcode_key(business_id, barcode))
+        if product_key(business_id, product_id) not in entries:
+            stale.append(product_key(business_id, product_id))
+
+    cache.delete_many([key for key in stale if key not in entries])
+    cache.set_many(entries, PRODUCT_INDEX_TIMEOUT)
+
+
+def refresh_products_on_commit(business_id, product_ids):
+    """Re-index these products once the current transaction has committed"""
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: refresh_products(business_id, product_ids))
@@ -0,0 +1,75 @@
+"""
+Barcode allocation.
+
+Barcodes generated for products are numbered by a per-business counter
+(BarcodeSequence) rather than derived from the SKU and probed with an
+exists() query per candidate. The counter is advanced with an atomic
+increment, so concurrent creates and bulk imports never receive the same
+number, and the unique (business, barcode) constraint on Product backs this
+up at the database level.
+
+Generated codes start with the GS1 prefix 2, which is set aside for numbers
+assigned inside a store, so they cannot clash with manufacturer barcodes:
+
+- EAN-13 and Code 128: 2, an 11 digit sequence number and the EAN-13 check digit
+- UPC-A: 2, a 10 digit sequence number and the UPC-A check digit
+
+A barcode typed in by hand can still take a number the counter reaches
+later, so the codes handed out are checked with one query per allocation
+and taken ones are skipped.
+"""
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import BarcodeSequence, Product
+
+# GS1 prefix for restricted circulation (in-store) numbers
+IN_STORE_PREFIX = '2'
+
+
+def reserve_barcode_numbers(business_id, count):
+    """Advance the barcode counter of this business by ``count`` and return the first number reserved"""
+    with transaction.atomic():
+        if not BarcodeSequence.objects.filter(business_id=business_id).update(last_value=F('last_value') + count):
+            try:
+                with transaction.atomic():
+                    BarcodeSequence.objects.create(business_id=business_id, last_value=count)
+                return 1
+            except IntegrityError:
+                # Another transaction created the counter first
+                BarcodeSequence.objects.filter(business_id=business_id).update(last_value=F('last_value') + count)
+        last_value = BarcodeSequence.objects.filter(business_id=business_id).values_list('last_value', flat=True).get()
+    return last_value - count + 1
+
+
+def format_barcode(number, barcode_format):
+    """The in-store barcode for a sequence number, with its check digit"""
+    if barcode_format == 'upca':
+        return Product._generate_upca(f'{IN_STORE_PREFIX}{number:010d}')
+    return Product._generate_ean13(f'{IN_STORE_PREFIX}{number:011d}')
+
+
+def allocate_barcodes(business_id, barcode_formats, exclude=()):
+    """
+    One new barcode for each format in ``barcode_formats``, unique within the
+    business and not in ``exclude`` (codes about to be saved with them).
+    Products without a business get random numbers.
+    """
+    barcodes = [None] * len(barcode_formats)
+    pending = list(range(len(barcode_formats)))
+    while pending:
+        if business_id:
+            first = reserve_barcode_numbers(business_id, len(pending))
+            numbers = range(first, first + len(pending))
+        else:
+            numbers = [uuid.uuid4().int % 10 ** 10 for _ in pending]
+        for index, number in zip(pending, numbers):
+            barcodes[index] = format_barcode(number, barcode_formats[index])
+
+        taken = set(Product.objects.all_businesses().filter(
+            business_id=business_id, barcode__in=[barcodes[index] for index in pending]
+        ).values_list('barcode', flat=True))
+        pending = [index for index in pending if barcodes[index] in taken or barcodes[index] in exclude]
+    return barcodes
@@ -0,0 +1,110 @@
+"""
+Versioned POS catalog.
+
+Each business has a catalog version counter (CatalogVersion). Every product
+change stamps the product with a freshly bumped version and every deletion
+leaves a CatalogTombstone, so a till that has synced up to version N only
+needs the products and tombstones with a version above N.
+
+The counter row is updated inside the writing transaction, so concurrent
+writers of one business commit in version order and a client can never skip
+a change by syncing from a version that was handed out to a later commit.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import CatalogTombstone, CatalogVersion, Product
+
+# Products per catalog page when the client does not ask for a size
+CATALOG_PAGE_SIZE = getattr(settings, 'CATALOG_PAGE_SIZE', 500)
+# Upper bound for the ``limit`` a client may ask for
+CATALOG_MAX_PAGE_SIZE = getattr(settings, 'CATALOG_MAX_PAGE_SIZE', 2000)
+
+CATALOG_FIELDS = ('id', 'name', 'sku', 'barcode', 'selling_price', 'quantity', 'is_active', 'catalog_version')
+
+
+def current_catalog_version(business_id):
+    """The latest catalog version of this business, 0 if nothing changed yet"""
+    return CatalogVersion.objects.filter(business_id=business_id).values_list('version', flat=True).first() or 0
+
+
+def bump_catalog_version(business_id):
+    """Increment the catalog version of this business and return the new value"""
+    with transaction.atomic():
+        if not CatalogVersion.objects.filter(business_id=business_id).update(version=F('version') + 1):
+            try:
+                with transaction.atomic():
+                    CatalogVersion.objects.create(business_id=business_id, version=1)
+                return 1
+            except IntegrityError:
+                # Another transaction created the counter first
+                CatalogVersion.objects.filter(business_id=business_id).update(version=F('version') + 1)
+        return current_catalog_version(business_id)
+
+
+def record_tombstone(business_id, product_id):
+    CatalogTombstone.objects.create(
+        business_id=business_id,
+        product_id=product_id,
+        version=bump_catalog_version(business_id),
+    )
+
+
+def serialize_product(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'sku': row['sku'],
+        'barcode': row['barcode'],
+        'price': str(row['selling_price']),
+        'stock': str(row['quantity']),
+    }
+
+
+def catalog_page(business, after=0, limit=CATALOG_PAGE_SIZE):
+    """
+    One page of the full catalog: active products with an id above ``after``,
+    in id order. ``next`` is the cursor of the following page or None.
+    """
+    rows = list(
+        Product.objects.for_business(business)
+        .filter(is_active=True, pk__gt=after)
+        .order_by('pk')
+        .values(*CATALOG_FIELDS)[:limit + 1]
+    )
+    next_after = rows[limit - 1]['id'] if len(rows) > limit else None
+    return {
+        'products': [serialize_product(row) for row in rows[:limit]],
+        'deleted': [],
+        'next': next_after,
+    }
+
+
+def catalog_changes(business, since, after=0, limit=CATALOG_PAGE_SIZE):
+    """
+    Products changed after version ``since``, in id order and paginated like
+    catalog_page. Deactivated products are listed under ``deleted`` together
+    with the ids of deleted products, which are only sent with the first page.
+    """
+    rows = list(
+        Product.objects.for_business(business)
+        .filter(catalog_version__gt=since, pk__gt=after)
+        .order_by('pk')
+        .values(*CATALOG_FIELDS)[:limit + 1]
+    )
+    next_after = rows[limit - 1]['id'] if len(rows) > limit else None
+    rows = rows[:limit]
+
+    deleted = [row['id'] for row in rows if not row['is_active']]
+    if not after:
+        deleted.extend(
+            CatalogTombstone.objects.filter(business=business, version__gt=since)
+            .order_by('version')
+            .values_list('product_id', flat=True)
+        )
+    return {
+        'products': [serialize_product(row) for row in rows if row['is_active']],
+        'deleted': deleted,
+        'next': next_after,
+    }
@@ -0,0 +1,255 @@
+"""
+Lazily rendered, disk-cached barcode and QR code images.
+
+Images are rendered the first time they are asked for, not when a product is
+saved, and cached on disk under a name hashed from what they depict: the
+symbology, the encoded value and the rendering options. The same image is
+therefore rendered once however many products, labels or requests use it,
+and an edited barcode simply gets a new file.
+
+Every cache hit refreshes the file's modification time, and the least
+recently used files are deleted once the cache outgrows
+CODE_IMAGE_CACHE_MAX_BYTES. Each process checks the cache size after it
+has written a tenth of the cap, so the cap is approximate.
+"""
+from io import BytesIO
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+
+# Where rendered images are cached; not served directly, see the image views
+CODE_IMAGE_CACHE_DIR = getattr(
+    settings, 'CODE_IMAGE_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'code_cache')
+)
+# Size the image cache is pruned back under
+CODE_IMAGE_CACHE_MAX_BYTES = getattr(settings, 'CODE_IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+# Browser cache lifetime of an image URL carrying its version
+CODE_IMAGE_MAX_AGE = getattr(settings, 'CODE_IMAGE_MAX_AGE', 365 * 24 * 60 * 60)
+
+BARCODE_KINDS = ('code128', 'ean13', 'upca')
+QR_KIND = 'qr'
+
+DEFAULT_OPTIONS = {
+    'barcode': {
+        'module_width': 0.2,
+        # Taller bars and a wide quiet zone scan more reliably
+        'module_height': 15.0,
+        'quiet_zone': 6.5,
+        'font_size': 10,
+        'text_distance': 5.0,
+        'write_text': True,
+    },
+    QR_KIND: {
+        'box_size': 10,
+        'border': 4,
+    },
+}
+
+# Options a request may override, with their bounds
+OPTION_LIMITS = {
+    'module_width': (0.1, 1.0),
+    'module_height': (5.0, 50.0),
+    'quiet_zone': (1.0, 20.0),
+    'font_size': (0, 30),
+    'box_size': (1, 20),
+    'border': (0, 10),
+}
+
+_written_bytes = 0
+_prune_lock = threading.Lock()
+
+
+class CodeImageError(ValueError):
+    """The value cannot be encoded, or the options are not supported"""
+
+
+def normalize_options(kind, overrides=None):
+    """The rendering options for ``kind``, with validated ``overrides`` applied"""
+    if kind != QR_KIND and kind not in BARCODE_KINDS:
+        raise CodeImageError(f'Unsupported code format: {kind}')
+    options = dict(DEFAULT_OPTIONS[QR_KIND if kind == QR_KIND else 'barcode'])
+    for name, value in (overrides or {}).items():
+        if name not in options:
+            raise CodeImageError(f'Unsupported option: {name}')
+        if name == 'write_text':
+            options[name] = str(value).lower() not in ('0', 'false', 'no', 'off')
+            continue
+        low, high = OPTION_LIMITS[name]
+        try:
+            number = type(low)(value)
+        except (TypeError, ValueError):
+            raise CodeImageError(f'Invalid {name}: {value}')
+        if not low <= number <= high:
+            raise CodeImageError(f'{name} must be between {low} and {high}')
+        options[name] = number
+    return options
+
+
+def code_image_key(kind, value, options):
+    """Cache key of an image, hashed from everything that affects its pixels"""
+    payload = json.dumps([kind, value, options], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def code_image_version(key):
+    """Short form of a key, added to image URLs so each version has its own URL"""
+    return key[:16]
+
+
+def _cache_path(key):
+    return os.path.join(CODE_IMAGE_CACHE_DIR, key[:2], f'{key}.png')
+
+
+def render_code(kind, value, options):
+    """Rasterize a barcode or QR code to PNG bytes"""
+    buffer = BytesIO()
+    if kind == QR_KIND:
+        import qrcode
+        import qrcode.constants
+
+        qr = qrcode.QRCode(
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=options['box_size'],
+            border=options['border'],
+        )
+        qr.add_data(value)
+        qr.make(fit=True)
+        qr.make_image(fill_color='black', back_color='white').save(buffer, 'PNG')
+    else:
+        from barcode import get_barcode_class
+        from barcode.errors import BarcodeError
+        from barcode.writer import ImageWriter
+
+        try:
+            code = get_barcode_class(kind)(value, writer=ImageWriter())
+        except (BarcodeError, ValueError) as e:
+            raise CodeImageError(f'Cannot encode {value!r} as {kind}: {e}')
+        # Print the value as stored under the bars, not python-barcode's reformatting
+        code.write(
+            buffer,
+            {**options, 'background': 'white', 'foreground': 'black'},
+            text=value if options['write_text'] else None,
+        )
+    return buffer.getvalue()
+
+
+def get_code_image(kind, value, overrides=None):
+    """
+    Return ``(key, png bytes)`` of an image, rendering it into the cache on a
+    miss. Raises CodeImageError for values or options that cannot be rendered.
+    """
+    options = normalize_options(kind, overrides)
+    key = code_image_key(kind, value, options)
+    path = _cache_path(key)
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        # Mark as recently used for pruning
+        os.utime(path)
+        return key, data
+    except FileNotFoundError:
+        pass
+
+    data = render_code(kind, value, options)
+    _store(path, data)
+    return key, data
+
+
+def get_code_images(specs):
+    """
+    ``get_code_image`` for many ``(kind, value, overrides)`` specs at once,
+    rendering each distinct image once. Returns ``(key, png bytes)`` in order,
+    or None for a value that cannot be encoded, such as a barcode typed in
+    by hand that does not fit its format.
+    """
+    images = {}
+    results = []
+    for kind, value, overrides in specs:
+        memo_key = (kind, value, json.dumps(overrides or {}, sort_keys=True))
+        if memo_key not in images:
+            try:
+                images[memo_key] = get_code_image(kind, value, overrides)
+            except CodeImageError:
+                images[memo_key] = None
+        results.append(images[memo_key])
+    return results
+
+
+def _store(path, data):
+    global _written_bytes
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so readers never see a partial file
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, path)
+
+    _written_bytes += len(data)
+    if _written_bytes >= CODE_IMAGE_CACHE_MAX_BYTES // 10:
+        _written_bytes = 0
+        prune_code_image_cache()
+
+
+def prune_code_image_cache(max_bytes=None):
+    """
+    Delete the least recently used images until the cache is below 90% of
+    ``max_bytes`` (CODE_IMAGE_CACHE_MAX_BYTES by default). Returns the
+    number of files deleted.
+    """
+    max_bytes = CODE_IMAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not _prune_lock.acquire(blocking=False):
+        # Another thread of this process is already pruning
+        return 0
+    try:
+        files = []
+        if os.path.isdir(CODE_IMAGE_CACHE_DIR):
+            for directory in os.scandir(CODE_IMAGE_CACHE_DIR):
+                if not directory.is_dir():
+                    continue
+                for entry in os.scandir(directory.path):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        if total <= max_bytes:
+            return 0
+
+        deleted = 0
+        files.sort()
+        for _, size, path in files:
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                # Pruned by another process
+                pass
+            total -= size
+        return deleted
+    finally:
+        _prune_lock.release()
+
+
+def product_qr_value(product):
+    """What a product's QR code encodes: the link to the product page"""
+    from django.urls import reverse
+    return reverse('products:detail', kwargs={'pk': product.pk})
+
+
+def product_code_spec(product, kind='barcode', overrides=None):
+    """The ``(kind, value, overrides)`` spec of a product's barcode or QR code"""
+    if kind == QR_KIND:
+        return QR_KIND, product_qr_value(product), overrides
+    return product.barcode_format, product.barcode, overrides
+
+
+def product_code_version(product, kind='barcode', overrides=None):
+    """Short version of a product's image, added to its URL so it can be cached for good"""
+    kind, value, overrides = product_code_spec(product, kind, overrides)
+    return code_image_version(code_image_key(kind, value, normalize_options(kind, overrides)))
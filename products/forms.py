@@ -52,6 +52,18 @@ class ProductForm(forms.ModelForm):
                 raise ValidationError(f'A product with SKU "{sku}" already exists for your business. Please use a different SKU.')
         return sku
 
+    def clean_barcode(self):
+        barcode = self.cleaned_data.get('barcode') or None
+        # Barcodes are unique per business; blank ones are generated on save
+        if barcode and self.business:
+            queryset = Product.objects.filter(business=self.business, barcode=barcode)
+            if self.instance and self.instance.pk:
+                queryset = queryset.exclude(pk=self.instance.pk)
+                
+            if queryset.exists():
+                raise ValidationError(f'A product with barcode "{barcode}" already exists for your business. Please use a different barcode.')
+        return barcode
+
 class CategoryForm(forms.ModelForm):
     class Meta:
         model = Category
@@ -0,0 +1,315 @@
+"""
+Bulk product CSV import.
+
+An upload is saved as a ProductImportJob and imported by ``run_import_job``
+outside the request, in a background thread started once the job is
+committed (or by the process_product_imports command):
+
+- rows are parsed from the stored file as it is read, in batches of
+  PRODUCT_IMPORT_BATCH_SIZE;
+- categories and units are loaded once, and the ones a batch is missing
+  are created with one bulk_create each;
+- SKUs and barcodes are checked with one query each per batch, barcodes
+  for the rows without one allocated together, and the products of a batch
+  inserted with one bulk_create;
+- barcode images are not rendered: products.code_images renders them when
+  first viewed or printed.
+
+bulk_create skips the product signals, so each batch stamps the catalog
+version and refreshes the barcode index itself. Progress and row errors are
+saved on the job as the import goes, for the job status endpoint.
+
+A thread dies with its worker process, so process_product_imports also
+fails running jobs that made no progress for PRODUCT_IMPORT_STALE_AFTER
+seconds (see ``fail_stale_import_jobs``).
+"""
+import codecs
+import csv
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from dashboard.stats import invalidate_dashboard_stats
+
+from .barcode_index import refresh_products_on_commit
+from .barcodes import allocate_barcodes
+from .catalog import bump_catalog_version
+from .models import Category, Product, ProductImportJob, Unit
+
+logger = logging.getLogger(__name__)
+
+# Rows parsed, checked and inserted together
+PRODUCT_IMPORT_BATCH_SIZE = getattr(settings, 'PRODUCT_IMPORT_BATCH_SIZE', 500)
+
+# Row errors kept on a job for display; the rest are only counted
+PRODUCT_IMPORT_MAX_ERRORS = getattr(settings, 'PRODUCT_IMPORT_MAX_ERRORS', 200)
+
+# Start imports in a background thread; when False they wait for process_product_imports
+PRODUCT_IMPORT_IN_BACKGROUND = getattr(settings, 'PRODUCT_IMPORT_IN_BACKGROUND', True)
+
+# Seconds without progress after which a running import is taken for dead
+PRODUCT_IMPORT_STALE_AFTER = getattr(settings, 'PRODUCT_IMPORT_STALE_AFTER', 15 * 60)
+
+# Columns of an upload, in the order of the download template
+IMPORT_COLUMNS = [
+    'name', 'sku', 'barcode', 'category', 'unit', 'description',
+    'cost_price', 'selling_price', 'quantity', 'reorder_level', 'expiry_date'
+]
+DECIMAL_COLUMNS = ['cost_price', 'selling_price', 'quantity', 'reorder_level']
+
+
+class ImportRowError(ValueError):
+    """A row of an upload that cannot be imported"""
+
+
+def read_rows(file):
+    """``(line number, row)`` of the data rows of an uploaded CSV, read incrementally"""
+    reader = csv.reader(codecs.iterdecode(file, 'utf-8-sig'))
+    # Skip header row
+    next(reader, None)
+    for row in reader:
+        if any(value.strip() for value in row):
+            yield reader.line_num, row
+
+
+def parse_decimal(value, column):
+    if not value:
+        return Decimal('0')
+    try:
+        number = Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ImportRowError(f'Invalid {column.replace("_", " ")}: {value}')
+    # The product columns hold 10 digits, 2 of them decimals
+    if abs(number) >= Decimal('1e8'):
+        raise ImportRowError(f'{column.replace("_", " ").capitalize()} is too large: {value}')
+    return number
+
+
+def parse_row(row):
+    """The values of a CSV row, checked and converted for a Product"""
+    if len(row) < len(IMPORT_COLUMNS):
+        raise ImportRowError('Insufficient columns')
+    values = dict(zip(IMPORT_COLUMNS, (value.strip() for value in row)))
+
+    if not values['name'] or not values['sku'] or not values['category'] or not values['unit']:
+        raise ImportRowError('Missing required fields (name, sku, category, unit)')
+    for column, model, field in [
+        ('name', Product, 'name'), ('sku', Product, 'sku'), ('barcode', Product, 'barcode'),
+        ('category', Category, 'name'), ('unit', Unit, 'name'),
+    ]:
+        max_length = model._meta.get_field(field).max_length
+        if len(values[column]) > max_length:
+            raise ImportRowError(f'{column.capitalize()} is longer than {max_length} characters')
+
+    for column in DECIMAL_COLUMNS:
+        values[column] = parse_decimal(values[column], column)
+    if values['expiry_date']:
+        try:
+            values['expiry_date'] = date.fromisoformat(values['expiry_date'])
+        except ValueError:
+            raise ImportRowError(f'Invalid expiry date: {values["expiry_date"]} (expected YYYY-MM-DD)')
+    else:
+        values['expiry_date'] = None
+    return values
+
+
+class ProductImporter:
+    """Imports batches of parsed rows into one business"""
+
+    def __init__(self, business):
+        self.business = business
+        self.products = Product.objects.for_business(business)
+        self.categories = dict(Category.objects.for_business(business).values_list('name', 'id'))
+        units = list(Unit.objects.for_business(business).values_list('name', 'id', 'symbol'))
+        self.units = {name: unit_id for name, unit_id, _ in units}
+        self.unit_symbols = {symbol for _, _, symbol in units}
+
+    def import_batch(self, rows):
+        """Import ``(line number, row)`` pairs; returns the products created and the row errors"""
+        errors = []
+        parsed = []
+        for line, row in rows:
+            try:
+                parsed.append((line, parse_row(row)))
+            except ImportRowError as e:
+                errors.append({'row': line, 'error': str(e)})
+
+        # Earlier batches are already in the database, so one query each covers the whole file so far
+        taken_skus = set(self.products.filter(
+            sku__in={values['sku'] for _, values in parsed}
+        ).values_list('sku', flat=True))
+        taken_barcodes = set(self.products.filter(
+            barcode__in={values['barcode'] for _, values in parsed if values['barcode']}
+        ).values_list('barcode', flat=True))
+        accepted = []
+        for line, values in parsed:
+            if values['sku'] in taken_skus:
+                errors.append({'row': line, 'error': f'A product with SKU {values["sku"]} already exists'})
+                continue
+            if values['barcode'] in taken_barcodes:
+                errors.append({'row': line, 'error': f'A product with barcode {values["barcode"]} already exists'})
+                continue
+            taken_skus.add(values['sku'])
+            if values['barcode']:
+                taken_barcodes.add(values['barcode'])
+            accepted.append(values)
+
+        self.resolve_categories({values['category'] for values in accepted})
+        self.resolve_units({values['unit'] for values in accepted})
+        products = [
+            Product(
+                business=self.business,
+                name=values['name'],
+                sku=values['sku'],
+                barcode=values['barcode'] or None,
+                category_id=self.categories[values['category']],
+                unit_id=self.units[values['unit']],
+                description=values['description'],
+                cost_price=values['cost_price'],
+                selling_price=values['selling_price'],
+                quantity=values['quantity'],
+                reorder_level=values['reorder_level'],
+                expiry_date=values['expiry_date'],
+            )
+            for values in accepted
+        ]
+        self.assign_barcodes(products)
+
+        if products:
+            with transaction.atomic():
+                version = bump_catalog_version(self.business.pk)
+                for product in products:
+                    product.catalog_version = version
+                Product.objects.bulk_create(products)
+                refresh_products_on_commit(self.business.pk, [product.pk for product in products])
+        errors.sort(key=lambda error: error['row'])
+        return len(products), errors
+
+    def resolve_categories(self, names):
+        missing = [name for name in names if name not in self.categories]
+        if not missing:
+            return
+        # ignore_conflicts: another upload may have created one meanwhile
+        Category.objects.bulk_create([
+            Category(business=self.business, name=name, description=f'Category for {name}')
+            for name in missing
+        ], ignore_conflicts=True)
+        self.categories.update(
+            Category.objects.for_business(self.business).filter(name__in=missing).values_list('name', 'id')
+        )
+
+    def resolve_units(self, names):
+        missing = [name for name in names if name not in self.units]
+        if not missing:
+            return
+        units = []
+        for name in missing:
+            symbol = name[:3].upper()
+            suffix = 1
+            while symbol in self.unit_symbols:
+                symbol = f'{name[:3].upper()}{suffix}'
+                suffix += 1
+            self.unit_symbols.add(symbol)
+            units.append(Unit(business=self.business, name=name, symbol=symbol))
+        Unit.objects.bulk_create(units, ignore_conflicts=True)
+        self.units.update(
+            Unit.objects.for_business(self.business).filter(name__in=missing).values_list('name', 'id')
+        )
+
+    def assign_barcodes(self, products):
+        """Allocate barcodes for the products without one, for the whole batch at once"""
+        explicit = {product.barcode for product in products if product.barcode}
+        pending = [product for product in products if not product.barcode]
+        barcodes = allocate_barcodes(
+            self.business.pk, [product.barcode_format for product in pending], exclude=explicit
+        )
+        for product, barcode in zip(pending, barcodes):
+            product.barcode = barcode
+
+
+def run_import_job(job_id):
+    """
+    Import a pending job. Returns False when the job was not pending, for
+    example because another worker already took it.
+    """
+    now = timezone.now()
+    claimed = ProductImportJob.objects.all_businesses().filter(pk=job_id, status='pending').update(
+        status='running', started_at=now, heartbeat_at=now
+    )
+    if not claimed:
+        return False
+    job = ProductImportJob.objects.all_businesses().select_related('business').get(pk=job_id)
+    # A job failed as stale meanwhile is left alone
+    jobs = ProductImportJob.objects.all_businesses().filter(pk=job_id, status='running')
+
+    try:
+        # A first pass counts the rows so progress can be reported
+        with job.file.open('rb') as file:
+            total_rows = sum(1 for _ in read_rows(file))
+        jobs.update(total_rows=total_rows, heartbeat_at=timezone.now())
+
+        importer = ProductImporter(job.business)
+        processed = created = error_count = 0
+        errors = []
+        with job.file.open('rb') as file:
+            rows = read_rows(file)
+            while batch := list(islice(rows, PRODUCT_IMPORT_BATCH_SIZE)):
+                batch_created, batch_errors = importer.import_batch(batch)
+                processed += len(batch)
+                created += batch_created
+                error_count += len(batch_errors)
+                errors.extend(batch_errors[:PRODUCT_IMPORT_MAX_ERRORS - len(errors)])
+                jobs.update(
+                    processed_rows=processed, created_count=created, error_count=error_count, errors=errors,
+                    heartbeat_at=timezone.now()
+                )
+        invalidate_dashboard_stats(job.business_id)
+
+        jobs.update(status='completed', finished_at=timezone.now())
+    except Exception as e:
+        logger.exception(f"Product import {job_id} failed")
+        jobs.update(status='failed', message=str(e), finished_at=timezone.now())
+    return True
+
+
+def fail_stale_import_jobs():
+    """
+    Fail the running jobs that made no progress for PRODUCT_IMPORT_STALE_AFTER
+    seconds, whose worker was killed mid-import. Returns how many there were.
+
+    They are not rerun: the batches imported before the worker died are
+    kept, and uploading the file again skips their SKUs as duplicates.
+    """
+    cutoff = timezone.now() - timedelta(seconds=PRODUCT_IMPORT_STALE_AFTER)
+    return ProductImportJob.objects.all_businesses().filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+        status='running'
+    ).update(
+        status='failed',
+        message='The import stopped before it finished. Products imported so far were kept; '
+                'upload the file again to import the rest.',
+        finished_at=timezone.now()
+    )
+
+
+def _run_in_thread(job_id):
+    try:
+        run_import_job(job_id)
+    finally:
+        # The thread's connections are not closed by the request cycle
+        connections.close_all()
+
+
+def start_import_job(job):
+    """Import ``job`` in a background thread once the transaction creating it commits"""
+    if PRODUCT_IMPORT_IN_BACKGROUND:
+        transaction.on_commit(
+            lambda: threading.Thread(target=_run_in_thread, args=(job.pk,), daemon=True).start()
+        )
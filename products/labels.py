@@ -0,0 +1,235 @@
+"""
+Label sheets rendered to PDF or PNG.
+
+A sheet is built from ``(product, copies)`` entries laid out on a grid of
+labels (see LABEL_LAYOUTS), page after page, in one pass. Work is done once
+per distinct thing rather than once per label: each distinct barcode is
+fetched from the code image cache (and rendered on a miss) once, each
+product's label is drawn once, and every copy is pasted from that tile.
+
+Rendering barcodes is what dominates large runs, so the distinct barcodes
+can be rendered by a pool of worker processes (``processes``,
+LABEL_SHEET_PROCESSES by default). Pages are drawn in greyscale and kept as
+1-bit images, which is what label printers print anyway, so a thousand
+labels fit in a few MB of memory.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+import math
+
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from .code_images import CodeImageError, get_code_image, product_code_spec
+
+# Resolution sheets are rendered at
+LABEL_SHEET_DPI = getattr(settings, 'LABEL_SHEET_DPI', 200)
+# Worker processes rendering barcodes; 0 or 1 renders them in the calling process
+LABEL_SHEET_PROCESSES = getattr(settings, 'LABEL_SHEET_PROCESSES', 0)
+# Fewer distinct barcodes than this are not worth starting the pool for
+LABEL_SHEET_POOL_MIN_CODES = getattr(settings, 'LABEL_SHEET_POOL_MIN_CODES', 200)
+# TrueType font of the product name and price; Pillow's own font if it cannot be loaded
+LABEL_SHEET_FONT = getattr(settings, 'LABEL_SHEET_FONT', 'DejaVuSans.ttf')
+
+SHEET_FORMATS = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+}
+
+
+@dataclass(frozen=True)
+class LabelLayout:
+    """A grid of labels centred on a page; sizes in millimetres"""
+    description: str
+    page_width: float
+    page_height: float
+    columns: int
+    rows: int
+    label_width: float
+    label_height: float
+    column_gap: float = 0
+    row_gap: float = 0
+
+    @property
+    def per_page(self):
+        return self.columns * self.rows
+
+    @property
+    def left_margin(self):
+        return (self.page_width - self.columns * self.label_width - (self.columns - 1) * self.column_gap) / 2
+
+    @property
+    def top_margin(self):
+        return (self.page_height - self.rows * self.label_height - (self.rows - 1) * self.row_gap) / 2
+
+
+LABEL_LAYOUTS = {
+    'a4-24': LabelLayout('A4, 24 labels of 70 x 37 mm', 210, 297, 3, 8, 70, 37),
+    'a4-65': LabelLayout('A4, 65 labels of 38.1 x 21.2 mm', 210, 297, 5, 13, 38.1, 21.2, column_gap=2.5),
+    'letter-30': LabelLayout('Letter, 30 labels of 66.7 x 25.4 mm', 215.9, 279.4, 3, 10, 66.7, 25.4, column_gap=3.2),
+}
+DEFAULT_LABEL_LAYOUT = 'a4-24'
+
+
+def _px(mm, dpi):
+    return round(mm / 25.4 * dpi)
+
+
+def _setup_worker():
+    # Spawned workers (the default outside Linux) start without the app registry
+    import django
+    django.setup()
+
+
+def _render_code(code):
+    kind, value = code
+    try:
+        return get_code_image(kind, value)[1]
+    except CodeImageError:
+        # Labelled with the plain value instead
+        return None
+
+
+def render_distinct_codes(codes, processes=None):
+    """
+    PNG bytes of each distinct ``(kind, value)`` barcode in ``codes``, keyed
+    by it; None for values that cannot be encoded. With more than one
+    process and at least LABEL_SHEET_POOL_MIN_CODES distinct codes, they are
+    rendered by a process pool.
+    """
+    processes = LABEL_SHEET_PROCESSES if processes is None else processes
+    distinct = list(dict.fromkeys(codes))
+    if processes > 1 and len(distinct) >= LABEL_SHEET_POOL_MIN_CODES:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_setup_worker) as pool:
+            chunksize = max(1, len(distinct) // (processes * 4))
+            images = list(pool.map(_render_code, distinct, chunksize=chunksize))
+    else:
+        images = [_render_code(code) for code in distinct]
+    return dict(zip(distinct, images))
+
+
+def _font(size):
+    try:
+        return ImageFont.truetype(LABEL_SHEET_FONT, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _fit_text(draw, text, font, width):
+    """``text``, shortened with an ellipsis until it fits ``width``"""
+    if draw.textlength(text, font=font) <= width:
+        return text
+    while text and draw.textlength(text + '…', font=font) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def _fit_code(image, box):
+    """
+    Scale a barcode image to fit ``box``. Enlarging is by a whole factor
+    without smoothing, so every bar keeps the same width and sharp edges.
+    """
+    factor = min(box[0] / image.width, box[1] / image.height)
+    if factor >= 1:
+        factor = int(factor)
+        return image.resize((image.width * factor, image.height * factor), Image.Resampling.NEAREST)
+    return ImageOps.contain(image, box, Image.Resampling.LANCZOS)
+
+
+def draw_label(product, code_image, size, font):
+    """
+    One label as a greyscale image of ``size``: the product name, its
+    barcode scaled to fit (``code_image``, or the plain value when None) and
+    its price.
+    """
+    width, height = size
+    tile = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(tile)
+    padding = max(2, height // 20)
+    line = font.getbbox('Ag')[3]
+
+    draw.text((width // 2, padding), _fit_text(draw, product.name, font, width - 2 * padding),
+              font=font, fill=0, anchor='mt')
+    draw.text((width // 2, height - padding), str(product.selling_price), font=font, fill=0, anchor='mb')
+
+    top = padding * 2 + line
+    bottom = height - padding * 2 - line
+    if code_image is not None:
+        code = _fit_code(code_image, (width - 2 * padding, bottom - top))
+        tile.paste(code, ((width - code.width) // 2, top + (bottom - top - code.height) // 2))
+    else:
+        draw.text((width // 2, (top + bottom) // 2), product.barcode or '', font=font, fill=0, anchor='mm')
+    return tile
+
+
+def _label_products(entries):
+    return [product for product, copies in entries for _ in range(max(0, copies))]
+
+
+def sheet_page_count(entries, layout=DEFAULT_LABEL_LAYOUT):
+    """Pages needed for ``(product, copies)`` entries; at least one"""
+    labels = sum(max(0, copies) for _, copies in entries)
+    return max(1, math.ceil(labels / LABEL_LAYOUTS[layout].per_page))
+
+
+def render_label_pages(entries, layout=DEFAULT_LABEL_LAYOUT, processes=None, dpi=None, pages=None):
+    """
+    Render ``(product, copies)`` entries onto pages of ``layout`` labels and
+    return the pages as 1-bit images. ``pages`` is an optional range of page
+    indexes to render instead of all of them.
+    """
+    grid = LABEL_LAYOUTS[layout]
+    dpi = dpi or LABEL_SHEET_DPI
+    products = _label_products(entries)
+    if pages is None:
+        pages = range(max(1, math.ceil(len(products) / grid.per_page)))
+
+    size = (_px(grid.label_width, dpi), _px(grid.label_height, dpi))
+    font = _font(max(8, size[1] // 9))
+    page_products = [products[index * grid.per_page:(index + 1) * grid.per_page] for index in pages]
+
+    codes = {}
+    for product in {id(product): product for chunk in page_products for product in chunk}.values():
+        if product.barcode:
+            kind, value, _ = product_code_spec(product)
+            codes[id(product)] = (kind, value)
+    images = render_distinct_codes(codes.values(), processes)
+    # Decoded once per barcode; a tile drawn once per product
+    decoded = {code: Image.open(BytesIO(data)).convert('L') for code, data in images.items() if data}
+    tiles = {}
+
+    rendered = []
+    for chunk in page_products:
+        page = Image.new('L', (_px(grid.page_width, dpi), _px(grid.page_height, dpi)), 255)
+        for index, product in enumerate(chunk):
+            if id(product) not in tiles:
+                tiles[id(product)] = draw_label(product, decoded.get(codes.get(id(product))), size, font)
+            row, column = divmod(index, grid.columns)
+            page.paste(tiles[id(product)], (
+                _px(grid.left_margin + column * (grid.label_width + grid.column_gap), dpi),
+                _px(grid.top_margin + row * (grid.label_height + grid.row_gap), dpi),
+            ))
+        rendered.append(page.convert('1', dither=Image.Dither.NONE))
+    return rendered
+
+
+def render_label_sheet(entries, format='pdf', layout=DEFAULT_LABEL_LAYOUT, page=1, processes=None, dpi=None):
+    """
+    A sheet of labels for ``(product, copies)`` entries as file bytes: every
+    page in one PDF, or page ``page`` (1-based) alone as a PNG.
+    """
+    if format not in SHEET_FORMATS:
+        raise ValueError(f'Unsupported label sheet format: {format}')
+    if layout not in LABEL_LAYOUTS:
+        raise ValueError(f'Unknown label layout: {layout}')
+    dpi = dpi or LABEL_SHEET_DPI
+    buffer = BytesIO()
+    if format == 'png':
+        page = min(max(1, page), sheet_page_count(entries, layout))
+        image, = render_label_pages(entries, layout, processes, dpi, pages=[page - 1])
+        image.save(buffer, 'PNG', dpi=(dpi, dpi), optimize=True)
+    else:
+        first, *rest = render_label_pages(entries, layout, processes, dpi)
+        first.save(buffer, 'PDF', resolution=dpi, save_all=True, append_images=rest)
+    return buffer.getvalue()
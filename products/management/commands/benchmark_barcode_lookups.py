@@ -0,0 +1,98 @@
+import random
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from products.barcode_index import lookup_barcode, warm_key, warm_index
+from utils.cache import is_shared_cache
+from products.models import Product
+from superadmin.models import Business
+
+
+class Command(BaseCommand):
+    help = 'Compare scanner lookups per second through the ORM and through the cached barcode index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business to benchmark (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--lookups',
+            type=int,
+            default=2000,
+            help='Number of barcode lookups per run'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of runs per lookup path; the best run is reported'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            self.stdout.write(self.style.ERROR('No businesses found'))
+            return
+
+        barcodes = list(
+            Product.objects.for_business(business).exclude(barcode__isnull=True).exclude(barcode='')
+            .values_list('barcode', flat=True)
+        )
+        if not barcodes:
+            self.stdout.write(self.style.ERROR('The business has no products with barcodes'))
+            return
+        scans = [random.choice(barcodes) for _ in range(options['lookups'])]
+
+        def orm_lookup(barcode):
+            # What the scan endpoint did before the index: one query for the
+            # product and one for its unit
+            product = Product.objects.for_business(business).filter(barcode=barcode).first()
+            return product.unit.symbol if product else None
+
+        def index_lookup(barcode):
+            return lookup_barcode(business.pk, barcode)
+
+        self.stdout.write(f'Benchmarking barcode lookups for business: {business.company_name}')
+        self.stdout.write(f'Products with barcodes: {len(barcodes)}, lookups per run: {len(scans)}')
+        self.stdout.write('=' * 60)
+        if not is_shared_cache():
+            self.stdout.write(self.style.WARNING(
+                'The default cache is local to this process, so the index is bypassed; configure a shared CACHES backend'
+            ))
+
+        cache.delete(warm_key(business.pk))
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            warm_index(business.pk)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(f'Warming the index: {elapsed:.1f} ms, {len(queries)} queries')
+
+        for label, lookup in [('ORM', orm_lookup), ('Barcode index', index_lookup)]:
+            best = None
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for barcode in scans:
+                        lookup(barcode)
+                    elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{label}: {len(scans) / best:,.0f} lookups/s '
+                f'({best / len(scans) * 1000:.3f} ms per lookup, '
+                f'{len(queries) / len(scans):.2f} queries per lookup)'
+            ))
+
+        self.stdout.write('=' * 60)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed!'))
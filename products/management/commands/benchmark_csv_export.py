@@ -0,0 +1,97 @@
+import csv
+import resource
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+
+from products.models import Product
+from products.views import PRODUCT_EXPORT_HEADER, product_csv_rows
+from superadmin.models import Business
+from utils.csv_export import streaming_csv_response
+
+
+class Command(BaseCommand):
+    help = 'Compare memory use of the buffered and the streamed product CSV export as the row count grows'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business to benchmark (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--rows',
+            type=int,
+            action='append',
+            help='Number of products to export per run; may be repeated (defaults to 1000, 10000 and all)'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            self.stdout.write(self.style.ERROR('No businesses found'))
+            return
+
+        products = Product.objects.for_business(business)
+        total = products.count()
+        sizes = sorted({min(size, total) for size in options['rows'] or [1000, 10000, total]})
+
+        self.stdout.write(f'Benchmarking product CSV export for business: {business.company_name}')
+        self.stdout.write(f'Products: {total} (seed more with benchmark_product_search --seed)')
+        self.stdout.write('=' * 60)
+
+        # Streamed runs first: the RSS high-water mark only ever grows, so the
+        # buffered runs must not have raised it yet
+        for label, export in [('Streamed', self.streamed), ('Buffered', self.buffered)]:
+            for size in sizes:
+                queryset = products.order_by('pk')[:size]
+                tracemalloc.start()
+                started = time.perf_counter()
+                written = export(queryset)
+                elapsed = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f'{label}: {size} rows, {written / 1024:,.0f} KB in {elapsed * 1000:.0f} ms, '
+                    f'peak heap {peak / 1024 / 1024:.1f} MB, max RSS {self.max_rss():.1f} MB'
+                ))
+
+        self.stdout.write('=' * 60)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed!'))
+
+    def streamed(self, queryset):
+        """The export as served now; the chunks are dropped as a client would read them"""
+        response = streaming_csv_response(product_csv_rows(queryset), 'products.csv')
+        return sum(len(chunk) for chunk in response.streaming_content)
+
+    def buffered(self, queryset):
+        """What the export did before: model instances written into one HttpResponse"""
+        response = HttpResponse(content_type='text/csv')
+        writer = csv.writer(response)
+        writer.writerow(PRODUCT_EXPORT_HEADER)
+        for product in queryset.select_related('category', 'unit'):
+            writer.writerow([
+                product.name,
+                product.sku,
+                product.barcode or '',
+                product.category.name,
+                product.unit.name,
+                product.description or '',
+                product.cost_price,
+                product.selling_price,
+                product.quantity,
+                product.reorder_level,
+                product.expiry_date or ''
+            ])
+        return len(response.content)
+
+    def max_rss(self):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
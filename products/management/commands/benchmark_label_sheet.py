@@ -0,0 +1,111 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import code_images
+from products.code_images import normalize_options, product_code_spec, render_code
+from products.labels import DEFAULT_LABEL_LAYOUT, LABEL_LAYOUTS, render_label_sheet
+from products.models import Product
+from superadmin.models import Business
+
+
+class Command(BaseCommand):
+    help = 'Measure labels per second when rendering PDF label sheets, with a cold and a warm image cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business to benchmark (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=500,
+            help='Number of distinct products on the sheet'
+        )
+        parser.add_argument(
+            '--copies',
+            type=int,
+            default=4,
+            help='Labels per product'
+        )
+        parser.add_argument(
+            '--layout',
+            choices=sorted(LABEL_LAYOUTS),
+            default=DEFAULT_LABEL_LAYOUT,
+            help='Label stock to lay the labels out for'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            action='append',
+            help='Worker processes to compare; may be repeated (defaults to 0 and the CPU count)'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            self.stdout.write(self.style.ERROR('No businesses found'))
+            return
+
+        products = list(
+            Product.objects.for_business(business).exclude(barcode__isnull=True).exclude(barcode='')
+            .only('pk', 'name', 'barcode', 'barcode_format', 'selling_price')
+            .order_by('pk')[:options['products']]
+        )
+        if not products:
+            self.stdout.write(self.style.ERROR(
+                'The business has no products with barcodes; seed some with benchmark_product_search --seed'
+            ))
+            return
+
+        entries = [(product, options['copies']) for product in products]
+        labels = len(products) * options['copies']
+        processes = options['processes'] or [0, os.cpu_count() or 1]
+
+        self.stdout.write(f'Benchmarking label sheets for business: {business.company_name}')
+        self.stdout.write(
+            f'{len(products)} products x {options["copies"]} copies = {labels} labels, '
+            f'layout {options["layout"]}'
+        )
+        self.stdout.write('=' * 60)
+
+        # A barcode rendered for every label, as when each label fetched its own image
+        started = time.perf_counter()
+        for product, copies in entries:
+            kind, value, _ = product_code_spec(product)
+            for _ in range(copies):
+                render_code(kind, value, normalize_options(kind))
+        self.report('Barcode per label, no sheet', labels, time.perf_counter() - started)
+
+        original_cache_dir = code_images.CODE_IMAGE_CACHE_DIR
+        try:
+            for count in processes:
+                with tempfile.TemporaryDirectory() as cache_dir:
+                    code_images.CODE_IMAGE_CACHE_DIR = cache_dir
+                    for label in ['cold cache', 'warm cache']:
+                        started = time.perf_counter()
+                        data = render_label_sheet(entries, 'pdf', options['layout'], processes=count)
+                        self.report(
+                            f'Sheet, {count or 1} process{"es" if count > 1 else ""}, {label}',
+                            labels, time.perf_counter() - started, len(data)
+                        )
+        finally:
+            code_images.CODE_IMAGE_CACHE_DIR = original_cache_dir
+
+        self.stdout.write('=' * 60)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed!'))
+
+    def report(self, label, labels, elapsed, size=None):
+        output = f' → {size / 1024:,.0f} KB PDF' if size is not None else ''
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{label}: {labels / elapsed:,.0f} labels/s ({elapsed * 1000:,.0f} ms){output}'
+        ))
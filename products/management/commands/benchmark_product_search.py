@@ -0,0 +1,126 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from products.models import Category, Product, Unit
+from products.search import BACKENDS, get_search_backend
+from superadmin.models import Business
+
+# SKU prefix marking the synthetic products created by --seed
+BENCHMARK_SKU_PREFIX = 'BENCH-'
+
+WORDS = [
+    'apple', 'banana', 'cola', 'coffee', 'cheese', 'bread', 'butter', 'milk', 'yogurt', 'water',
+    'orange', 'lemon', 'tea', 'rice', 'pasta', 'sugar', 'salt', 'pepper', 'chicken', 'beef',
+    'soap', 'shampoo', 'tissue', 'battery', 'charger', 'cable', 'notebook', 'pencil', 'glue', 'tape',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare product search latency of the icontains scan and the configured search backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business to benchmark (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Insert this many synthetic products before benchmarking (e.g. 100000)'
+        )
+        parser.add_argument(
+            '--query',
+            action='append',
+            dest='queries',
+            help='Search term to benchmark; may be repeated'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of times each search is run; the best time is reported'
+        )
+        parser.add_argument(
+            '--cleanup',
+            action='store_true',
+            help='Delete the synthetic products created by --seed and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            self.stdout.write(self.style.ERROR('No businesses found'))
+            return
+
+        if options['cleanup']:
+            # Raw delete: the synthetic products have no sales and never reached the caches
+            deleted = Product.objects.for_business(business).filter(
+                sku__startswith=BENCHMARK_SKU_PREFIX
+            )._raw_delete(connection.alias)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} synthetic products'))
+            return
+
+        if options['seed']:
+            self.seed(business, options['seed'])
+
+        queries = options['queries'] or ['co', 'cola', 'chicken bread', 'BENCH-0001', '400000']
+        products = Product.objects.for_business(business).filter(is_active=True)
+        backends = [BACKENDS['icontains'](), get_search_backend()]
+
+        self.stdout.write(f'Benchmarking product search for business: {business.company_name}')
+        self.stdout.write(f'Active products: {products.count()}, search backend: {backends[1].name}')
+        self.stdout.write('=' * 60)
+
+        for query in queries:
+            for backend in backends:
+                best = None
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    # First page of results, as the POS search box asks for
+                    rows = len(backend.search(products, query)[:10])
+                    elapsed = (time.perf_counter() - started) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+                self.stdout.write(
+                    f'{query!r} via {backend.name}: {rows} results, best of {options["repeat"]}: {best:.1f} ms'
+                )
+
+        self.stdout.write('=' * 60)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed!'))
+
+    def seed(self, business, count):
+        """Bulk insert synthetic products; bulk_create skips the catalog and index signals"""
+        category, _ = Category.objects.get_or_create(business=business, name='Benchmark')
+        unit, _ = Unit.objects.get_or_create(business=business, name='Benchmark', symbol='bm')
+        start = Product.objects.for_business(business).filter(sku__startswith=BENCHMARK_SKU_PREFIX).count()
+        self.stdout.write(f'Seeding {count} synthetic products...')
+        batch = []
+        for number in range(start, start + count):
+            name = ' '.join(random.sample(WORDS, 3)).title()
+            batch.append(Product(
+                business=business,
+                name=name,
+                sku=f'{BENCHMARK_SKU_PREFIX}{number:07d}',
+                barcode=f'4{number:011d}',
+                category=category,
+                unit=unit,
+                description=f'Synthetic {name.lower()} for search benchmarks',
+                cost_price=1,
+                selling_price=2,
+                quantity=random.randint(0, 100),
+            ))
+            if len(batch) >= 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_create(batch)
+        self.stdout.write(self.style.SUCCESS(f'Seeded {count} products'))
@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.labels import DEFAULT_LABEL_LAYOUT, LABEL_LAYOUTS, SHEET_FORMATS, render_label_sheet, sheet_page_count
+from products.models import Product
+from superadmin.models import Business
+
+
+class Command(BaseCommand):
+    help = 'Render a PDF or PNG sheet of barcode labels for products or a purchase order'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--product',
+            type=int,
+            action='append',
+            help='ID of a product to label; may be repeated (defaults to every product with a barcode)'
+        )
+        parser.add_argument(
+            '--purchase-order',
+            type=int,
+            help='ID of a purchase order to label, one label per unit ordered'
+        )
+        parser.add_argument(
+            '--copies',
+            type=int,
+            default=1,
+            help='Labels per product when labelling products'
+        )
+        parser.add_argument(
+            '--layout',
+            choices=sorted(LABEL_LAYOUTS),
+            default=DEFAULT_LABEL_LAYOUT,
+            help='Label stock to lay the labels out for'
+        )
+        parser.add_argument(
+            '--format',
+            choices=sorted(SHEET_FORMATS),
+            default='pdf',
+            help='PDF with every page, or PNG of one page'
+        )
+        parser.add_argument(
+            '--page',
+            type=int,
+            default=1,
+            help='Page to render as PNG'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            help='Worker processes rendering the barcodes (defaults to LABEL_SHEET_PROCESSES)'
+        )
+        parser.add_argument(
+            '--output',
+            required=True,
+            help='File to write the sheet to'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            raise CommandError('No businesses found')
+
+        if options['purchase_order']:
+            from purchases.models import PurchaseOrder
+
+            purchase_order = PurchaseOrder.objects.for_business(business).filter(pk=options['purchase_order']).first()
+            if not purchase_order:
+                raise CommandError(f'Purchase order {options["purchase_order"]} not found in {business.company_name}')
+            entries = purchase_order.label_entries()
+        else:
+            products = Product.objects.for_business(business).exclude(barcode__isnull=True).exclude(barcode='')
+            if options['product']:
+                products = products.filter(pk__in=options['product'])
+            entries = [(product, options['copies']) for product in products.order_by('name', 'pk')]
+
+        data = render_label_sheet(
+            entries, options['format'], options['layout'], options['page'], processes=options['processes']
+        )
+        with open(options['output'], 'wb') as file:
+            file.write(data)
+
+        labels = sum(copies for _, copies in entries)
+        pages = sheet_page_count(entries, options['layout'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {labels} labels on {pages} pages ({len(data) / 1024:,.0f} KB) to {options["output"]}'
+        ))
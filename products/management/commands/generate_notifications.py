@@ -1,14 +1,33 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.contrib.auth import get_user_model
-from django.db.models import F
+from django.db import connection
+from django.db.models import Exists, F, OuterRef
 from products.models import Product
 from notifications.models import Notification
 from settings.models import BusinessSettings
+from superadmin.models import Business
 from datetime import timedelta
+import time
 
 class Command(BaseCommand):
-    help = 'Generate automatic notifications for low stock, expired products, and near expiry products'
+    help = 'Generate automatic notifications for low stock, expired, and near expiry products'
+
+    # Candidate products are processed in chunks of this size; each chunk costs
+    # one recipient query, one deduplication query and one bulk insert
+    chunk_size = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='Only generate notifications for this business ID',
+            required=False
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many notifications would be created without creating them'
+        )
 
     def handle(self, *args, **options):
         # Get business settings for alert thresholds
@@ -20,121 +39,139 @@ class Command(BaseCommand):
             # Use default values if settings don't exist
             expiry_alert_days = 7
             near_expiry_alert_days = 30
-        
-        # Generate low stock notifications
-        self.generate_low_stock_notifications()
-        
-        # Generate expired product notifications
-        self.generate_expired_product_notifications()
-        
-        # Generate near expiry notifications with configurable thresholds
-        self.generate_near_expiry_notifications(near_expiry_alert_days)
-        
-        # Generate urgent expiry notifications (closer to expiry)
-        self.generate_urgent_expiry_notifications(expiry_alert_days)
-        
-        self.stdout.write(
-            self.style.SUCCESS('Successfully generated automatic notifications')
-        )
 
-    def generate_low_stock_notifications(self):
-        """Generate notifications for products with low stock"""
-        low_stock_products = Product.objects.filter(
-            is_active=True,
-            quantity__lte=F('reorder_level')
+        self.business = None
+        if options.get('business'):
+            self.business = Business.objects.filter(id=options['business']).first()
+            if not self.business:
+                self.stdout.write(self.style.ERROR(f"Business {options['business']} does not exist"))
+                return
+        self.dry_run = options.get('dry_run', False)
+
+        today = timezone.localdate()
+        for label, pipeline in [
+            ('Low stock', self.low_stock_pipeline()),
+            ('Expired', self.expired_pipeline(today)),
+            ('Near expiry', self.near_expiry_pipeline(today, near_expiry_alert_days)),
+            ('Urgent expiry', self.urgent_expiry_pipeline(today, expiry_alert_days)),
+        ]:
+            self.run_pipeline(label, *pipeline)
+
+        if self.dry_run:
+            self.stdout.write(self.style.WARNING('Dry run: no notifications were created'))
+        else:
+            self.stdout.write(
+                self.style.SUCCESS('Successfully generated automatic notifications')
+            )
+
+    def candidates(self, notification_type, title_contains=None, **filters):
+        """
+        Active products matching ``filters`` that have no unread notification
+        of ``notification_type`` yet, in a single anti-joined query.
+        """
+        unread = Notification.objects.filter(
+            notification_type=notification_type,
+            related_product=OuterRef('pk'),
+            is_read=False
         )
-        
-        for product in low_stock_products:
-            # Check if notification already exists for this product
-            existing_notification = Notification.objects.filter(
-                notification_type='low_stock',
-                related_product=product,
-                is_read=False
-            ).exists()
-            
-            if not existing_notification:
-                Notification.create_for_all_users(
-                    title=f'Low Stock Alert: {product.name}',
-                    message=f'The product "{product.name}" is low on stock. Current quantity: {product.quantity}, Reorder level: {product.reorder_level}',
-                    notification_type='low_stock',
-                    related_product=product
-                )
-
-    def generate_expired_product_notifications(self):
-        """Generate notifications for expired products"""
-        today = timezone.now().date()
-        expired_products = Product.objects.filter(
-            is_active=True,
-            expiry_date__lt=today
+        if title_contains:
+            unread = unread.filter(title__icontains=title_contains)
+
+        products = Product.objects.all_businesses().filter(business__isnull=False, is_active=True, **filters)
+        if self.business:
+            products = products.filter(business=self.business)
+        return products.filter(~Exists(unread)).only(
+            'id', 'name', 'business_id', 'quantity', 'reorder_level', 'expiry_date'
+        ).order_by('pk')
+
+    def run_pipeline(self, label, notification_type, products, describe, title_contains=None):
+        """Plan and bulk-insert the notifications of one pipeline, chunk by chunk"""
+        started = time.perf_counter()
+        candidates = 0
+        created = 0
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            chunk = []
+            for product in products.iterator(chunk_size=self.chunk_size):
+                candidates += 1
+                chunk.append(product)
+                if len(chunk) >= self.chunk_size:
+                    created += self.notify(notification_type, chunk, describe, title_contains)
+                    chunk = []
+            if chunk:
+                created += self.notify(notification_type, chunk, describe, title_contains)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        verb = 'would create' if self.dry_run else 'created'
+        self.stdout.write(
+            f'{label}: {candidates} products, {verb} {created} notifications '
+            f'({queries} queries, {elapsed:.1f} ms)'
         )
-        
-        for product in expired_products:
-            # Check if notification already exists for this product
-            existing_notification = Notification.objects.filter(
-                notification_type='expired_product',
-                related_product=product,
-                is_read=False
-            ).exists()
-            
-            if not existing_notification:
-                Notification.create_for_all_users(
-                    title=f'Expired Product: {product.name}',
-                    message=f'The product "{product.name}" has expired. Expiry date: {product.expiry_date}',
-                    notification_type='expired_product',
-                    related_product=product
-                )
-
-    def generate_near_expiry_notifications(self, days_threshold):
-        """Generate notifications for products nearing expiry (early warning)"""
-        today = timezone.now().date()
-        near_expiry_date = today + timedelta(days=days_threshold)
-        near_expiry_products = Product.objects.filter(
-            is_active=True,
+
+    def notify(self, notification_type, products, describe, title_contains):
+        alerts = [(product, *describe(product)) for product in products]
+        notifications = Notification.plan_for_products(notification_type, alerts, title_contains)
+        if not self.dry_run:
+            Notification.objects.bulk_create(notifications, batch_size=self.chunk_size)
+        return len(notifications)
+
+    def low_stock_pipeline(self):
+        """Products with low stock"""
+        products = self.candidates('low_stock', quantity__lte=F('reorder_level'))
+
+        def describe(product):
+            return (
+                f'Low Stock Alert: {product.name}',
+                f'The product "{product.name}" is low on stock. Current quantity: {product.quantity}, Reorder level: {product.reorder_level}'
+            )
+        return 'low_stock', products, describe
+
+    def expired_pipeline(self, today):
+        """Expired products"""
+        products = self.candidates('expired_product', expiry_date__lt=today)
+
+        def describe(product):
+            return (
+                f'Expired Product: {product.name}',
+                f'The product "{product.name}" has expired. Expiry date: {product.expiry_date}'
+            )
+        return 'expired_product', products, describe
+
+    def near_expiry_pipeline(self, today, days_threshold):
+        """Products nearing expiry (early warning)"""
+        products = self.candidates(
+            'near_expiry',
             expiry_date__gte=today,
-            expiry_date__lte=near_expiry_date
+            expiry_date__lte=today + timedelta(days=days_threshold)
         )
-        
-        for product in near_expiry_products:
-            # Check if notification already exists for this product
-            existing_notification = Notification.objects.filter(
-                notification_type='near_expiry',
-                related_product=product,
-                is_read=False
-            ).exists()
-            
-            if not existing_notification:
-                days_until_expiry = (product.expiry_date - today).days
-                Notification.create_for_all_users(
-                    title=f'Product Nearing Expiry: {product.name}',
-                    message=f'The product "{product.name}" will expire in {days_until_expiry} days. Expiry date: {product.expiry_date}',
-                    notification_type='near_expiry',
-                    related_product=product
-                )
-
-    def generate_urgent_expiry_notifications(self, days_threshold):
-        """Generate urgent notifications for products very close to expiry"""
-        today = timezone.now().date()
-        urgent_expiry_date = today + timedelta(days=days_threshold)
-        urgent_expiry_products = Product.objects.filter(
-            is_active=True,
+
+        def describe(product):
+            days_until_expiry = (product.expiry_date - today).days
+            return (
+                f'Product Nearing Expiry: {product.name}',
+                f'The product "{product.name}" will expire in {days_until_expiry} days. Expiry date: {product.expiry_date}'
+            )
+        return 'near_expiry', products, describe
+
+    def urgent_expiry_pipeline(self, today, days_threshold):
+        """Products very close to expiry; deduplicated against urgent notifications only"""
+        products = self.candidates(
+            'near_expiry',
+            title_contains='Urgent',
             expiry_date__gte=today,
-            expiry_date__lte=urgent_expiry_date
+            expiry_date__lte=today + timedelta(days=days_threshold)
         )
-        
-        for product in urgent_expiry_products:
-            # Check if urgent notification already exists for this product
-            existing_notification = Notification.objects.filter(
-                notification_type='near_expiry',  # Using same type but with urgent message
-                related_product=product,
-                is_read=False,
-                title__icontains='Urgent'  # Check if urgent notification exists
-            ).exists()
-            
-            if not existing_notification:
-                days_until_expiry = (product.expiry_date - today).days
-                Notification.create_for_all_users(
-                    title=f'Urgent: Product Expiring Soon: {product.name}',
-                    message=f'URGENT: The product "{product.name}" will expire in {days_until_expiry} days. Expiry date: {product.expiry_date}. Please take immediate action.',
-                    notification_type='near_expiry',
-                    related_product=product
-                )
\ No newline at end of file
+
+        def describe(product):
+            days_until_expiry = (product.expiry_date - today).days
+            return (
+                f'Urgent: Product Expiring Soon: {product.name}',
+                f'URGENT: The product "{product.name}" will expire in {days_until_expiry} days. Expiry date: {product.expiry_date}. Please take immediate action.'
+            )
+        return 'near_expiry', products, describe, 'Urgent'
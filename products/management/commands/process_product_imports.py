@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from products.imports import fail_stale_import_jobs, run_import_job
+from products.models import ProductImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Import pending bulk product uploads: those queued with PRODUCT_IMPORT_IN_BACKGROUND '
+        'off, or whose background thread never started. Running imports that stopped making '
+        'progress (their worker died) are failed first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--job',
+            type=int,
+            action='append',
+            dest='jobs',
+            help='ID of a pending import job to run; may be repeated (defaults to every pending job)'
+        )
+
+    def handle(self, *args, **options):
+        stale = fail_stale_import_jobs()
+        if stale:
+            self.stdout.write(self.style.WARNING(f'Failed {stale} import(s) that stopped making progress'))
+
+        jobs = ProductImportJob.objects.all_businesses().filter(status='pending')
+        if options['jobs']:
+            jobs = jobs.filter(pk__in=options['jobs'])
+
+        job_ids = list(jobs.order_by('created_at').values_list('pk', flat=True))
+        if not job_ids:
+            self.stdout.write('No pending product imports')
+            return
+
+        for job_id in job_ids:
+            if not run_import_job(job_id):
+                self.stdout.write(f'Import {job_id} was taken by another worker')
+                continue
+            job = ProductImportJob.objects.all_businesses().get(pk=job_id)
+            style = self.style.SUCCESS if job.status == 'completed' else self.style.ERROR
+            self.stdout.write(style(
+                f'Import {job_id} {job.status}: {job.created_count} products created, {job.error_count} errors'
+                + (f' ({job.message})' if job.message else '')
+            ))
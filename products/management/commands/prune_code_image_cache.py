@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from products.code_images import CODE_IMAGE_CACHE_DIR, CODE_IMAGE_CACHE_MAX_BYTES, prune_code_image_cache
+
+
+class Command(BaseCommand):
+    help = 'Delete the least recently used barcode and QR code images once the image cache outgrows its cap'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-mb',
+            type=float,
+            help=f'Size cap in MB (defaults to CODE_IMAGE_CACHE_MAX_BYTES, {CODE_IMAGE_CACHE_MAX_BYTES / 1024 / 1024:.0f} MB)'
+        )
+
+    def handle(self, *args, **options):
+        max_bytes = int(options['max_mb'] * 1024 * 1024) if options['max_mb'] is not None else None
+        deleted = prune_code_image_cache(max_bytes)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} cached images from {CODE_IMAGE_CACHE_DIR}'))
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Min, Q
+
+from products.barcode_index import refresh_products_on_commit
+from products.barcodes import allocate_barcodes
+from products.catalog import bump_catalog_version
+from products.models import BarcodeSequence, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Give new barcodes to products sharing a barcode with an older product of their business, '
+        'and to products without one. Duplicates block the unique (business, barcode) constraint: '
+        'if migrating fails on it, run this command, then migrate and run it again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the products that would get a new barcode'
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.all_businesses().exclude(business__isnull=True)
+        duplicates = (
+            products.exclude(Q(barcode__isnull=True) | Q(barcode=''))
+            .values('business_id', 'barcode')
+            .annotate(count=Count('id'), first=Min('id'))
+            .filter(count__gt=1)
+            .order_by()
+        )
+        targets = {}
+        for duplicate in duplicates:
+            ids = products.filter(
+                business_id=duplicate['business_id'], barcode=duplicate['barcode']
+            ).exclude(pk=duplicate['first']).values_list('pk', flat=True)
+            targets.setdefault(duplicate['business_id'], []).extend(ids)
+        for business_id, pk in products.filter(Q(barcode__isnull=True) | Q(barcode='')).values_list('business_id', 'pk'):
+            targets.setdefault(business_id, []).append(pk)
+
+        count = sum(len(ids) for ids in targets.values())
+        if not count:
+            self.stdout.write(self.style.SUCCESS('Every product has a unique barcode'))
+            return
+        if options['dry_run']:
+            self.stdout.write(f'{count} products in {len(targets)} businesses would get a new barcode')
+            return
+
+        if BarcodeSequence._meta.db_table not in connection.introspection.table_names():
+            # Not migrated yet: free the duplicate barcodes so the constraint can be added
+            cleared = products.filter(pk__in=[pk for ids in targets.values() for pk in ids]).update(barcode=None)
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'Cleared {cleared} duplicate barcodes; run migrate, then this command again to allocate new ones'
+            ))
+            return
+
+        for business_id, ids in targets.items():
+            with transaction.atomic():
+                formats = dict(products.filter(pk__in=ids).values_list('pk', 'barcode_format'))
+                # Clear first so the new codes are not checked against the duplicates they replace
+                products.filter(pk__in=ids).update(barcode=None)
+                barcodes = allocate_barcodes(business_id, [formats[pk] for pk in ids])
+                version = bump_catalog_version(business_id)
+                for pk, barcode in zip(ids, barcodes):
+                    products.filter(pk=pk).update(barcode=barcode, catalog_version=version)
+                refresh_products_on_commit(business_id, ids)
+        self.stdout.write(self.style.SUCCESS(f'Allocated new barcodes for {count} products'))
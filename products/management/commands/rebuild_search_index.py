@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Create the product search indexes if missing and rebuild them from the product table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database to rebuild the search index of'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        backend = get_search_backend(options['database'])
+        backend.install(connection)
+        backend.rebuild(connection)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the {backend.name} product search index'))
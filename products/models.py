@@ -1,11 +1,7 @@
+from django.conf import settings
 from django.db import models
 from django.urls import reverse
 from typing import TYPE_CHECKING
-import uuid
-import os
-from django.core.files.base import ContentFile
-from io import BytesIO
-import re
 
 # Import the Business model for multi-tenancy
 from superadmin.models import Business, Branch
@@ -90,93 +86,42 @@ class Product(models.Model):
     reorder_level = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     expiry_date = models.DateField(blank=True, null=True)
     is_active = models.BooleanField(default=True)  # type: ignore
+    # Business catalog version of the last change, see products.catalog
+    catalog_version = models.BigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
-        # Ensure SKU is unique per business
-        unique_together = ('business', 'sku')
+        # Ensure SKU and barcode are unique per business
+        unique_together = (('business', 'sku'), ('business', 'barcode'))
+        indexes = [
+            # Low/out of stock lookups filter active products of a business by quantity
+            models.Index(fields=['business', 'is_active', 'quantity']),
+            # POS catalog delta sync fetches the products changed after a version
+            models.Index(fields=['business', 'catalog_version']),
+            # Keyset pagination of the product list walks products by name
+            models.Index(fields=['business', 'name', 'id']),
+        ]
 
     def __str__(self) -> str:  # type: ignore
         return str(self.name)  # type: ignore
 
     def save(self, *args, **kwargs):
         # Auto-generate barcode if not provided
-        is_new = self.pk is None
         if not self.barcode:
             self.barcode = self.generate_barcode()
         
+        # The barcode image is rendered when first viewed, see products.code_images
         super().save(*args, **kwargs)
-        
-        # Generate barcode image after saving (so we have a pk)
-        if is_new:
-            self.generate_barcode_image()
 
     def generate_barcode(self):
-        """Generate a unique barcode for the product based on selected format"""
-        # Use SKU as base, or generate a unique identifier if SKU is not suitable
-        if self.sku:
-            # Create a simple numeric barcode from SKU
-            # Extract digits from SKU and ensure it's unique
-            sku_str = str(self.sku)  # Convert to string to ensure it's iterable
-            base_code = ''.join([char for char in sku_str if char.isdigit()])
-            
-            # If no digits in SKU, generate a unique code
-            if not base_code:
-                base_code = str(uuid.uuid4().int)[:12]
-        else:
-            # Generate a unique 12-digit code
-            base_code = str(uuid.uuid4().int)[:12]
-        
-        # Format the barcode according to the selected format
-        if self.barcode_format == 'ean13':
-            # EAN-13 requires 12 digits + 1 check digit = 13 total
-            base_code = re.sub(r'\D', '', base_code)[:12].ljust(12, '0')
-            barcode = self._generate_ean13(base_code)
-        elif self.barcode_format == 'upca':
-            # UPC-A requires 11 digits + 1 check digit = 12 total
-            base_code = re.sub(r'\D', '', base_code)[:11].ljust(11, '0')
-            barcode = self._generate_upca(base_code)
-        else:
-            # Code128 can handle variable length and alphanumeric
-            barcode = base_code[:20]  # Limit to 20 characters for Code128
-        
-        # Ensure the barcode is unique within the business
-        counter = 1
-        original_barcode = barcode
-        while Product.objects.filter(business=self.business, barcode=barcode).exclude(pk=self.pk).exists():
-            # If we've tried too many times, generate a completely new base
-            if counter > 100:
-                base_code = str(uuid.uuid4().int)[:12]
-                if self.barcode_format == 'ean13':
-                    base_code = re.sub(r'\D', '', base_code)[:12].ljust(12, '0')
-                    barcode = self._generate_ean13(base_code)
-                elif self.barcode_format == 'upca':
-                    base_code = re.sub(r'\D', '', base_code)[:11].ljust(11, '0')
-                    barcode = self._generate_upca(base_code)
-                else:
-                    barcode = base_code[:20]
-                counter = 1
-                original_barcode = barcode
-            else:
-                # Append counter to make it unique
-                if self.barcode_format == 'ean13':
-                    # For EAN-13, we need to regenerate with a different base
-                    modified_base = base_code[:-2] + str(counter).zfill(2)
-                    barcode = self._generate_ean13(re.sub(r'\D', '', modified_base)[:12].ljust(12, '0'))
-                elif self.barcode_format == 'upca':
-                    # For UPC-A, we need to regenerate with a different base
-                    modified_base = base_code[:-2] + str(counter).zfill(2)
-                    barcode = self._generate_upca(re.sub(r'\D', '', modified_base)[:11].ljust(11, '0'))
-                else:
-                    # For Code128, we can just append the counter
-                    barcode = original_barcode + str(counter)
-            counter += 1
-            
-        return barcode
-
-    def _generate_ean13(self, base_code):
+        """Allocate a unique barcode for the product in its selected format"""
+        from .barcodes import allocate_barcodes
+        return allocate_barcodes(self.business_id, [self.barcode_format])[0]
+
+    @staticmethod
+    def _generate_ean13(base_code):
         """Generate a valid EAN-13 barcode with check digit"""
         # Ensure base code is 12 digits
         base_code = base_code[:12].ljust(12, '0')
@@ -193,7 +138,8 @@ class Product(models.Model):
         
         return base_code + str(check_digit)
 
-    def _generate_upca(self, base_code):
+    @staticmethod
+    def _generate_upca(base_code):
         """Generate a valid UPC-A barcode with check digit"""
         # Ensure base code is 11 digits
         base_code = base_code[:11].ljust(11, '0')
@@ -210,35 +156,6 @@ class Product(models.Model):
         
         return base_code + str(check_digit)
 
-    def generate_barcode_image(self):
-        """Generate and save a barcode image for the product"""
-        if not self.barcode:
-            return None
-            
-        try:
-            from .utils import generate_product_barcode_image
-            barcode_buffer = generate_product_barcode_image(self)
-            
-            if barcode_buffer:
-                # Ensure the barcodes directory exists
-                from django.conf import settings
-                barcodes_dir = os.path.join(settings.MEDIA_ROOT, 'barcodes')
-                os.makedirs(barcodes_dir, exist_ok=True)
-                
-                # Save the barcode image to the media directory
-                filename = f'barcode_{self.pk}.png'
-                filepath = os.path.join('barcodes', filename)
-                
-                # Save the image file
-                from django.core.files.storage import default_storage
-                default_storage.save(filepath, ContentFile(barcode_buffer.getvalue()))
-                
-                return filepath
-        except Exception as e:
-            print(f"Error generating barcode image: {e}")
-            
-        return None
-
     def get_absolute_url(self):
         return reverse('products:detail', kwargs={'pk': self.pk})
 
@@ -260,4 +177,87 @@ class Product(models.Model):
     @property
     def total_profit(self):
         """Calculate total profit based on current quantity"""
-        return self.profit_per_unit * float(self.quantity)  # type: ignore
\ No newline at end of file
+        return self.profit_per_unit * float(self.quantity)  # type: ignore
+
+class CatalogVersion(models.Model):
+    """Per-business counter bumped on every change to the POS catalog"""
+    business = models.OneToOneField(Business, on_delete=models.CASCADE, related_name='catalog_version')
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:  # type: ignore
+        return f"{self.business} catalog v{self.version}"
+
+
+class BarcodeSequence(models.Model):
+    """Per-business counter numbering generated barcodes, see products.barcodes"""
+    business = models.OneToOneField(Business, on_delete=models.CASCADE, related_name='barcode_sequence')
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:  # type: ignore
+        return f"{self.business} barcodes up to {self.last_value}"
+
+
+class CatalogTombstone(models.Model):
+    """Records a deleted product so POS clients can drop it on their next delta sync"""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='catalog_tombstones')
+    product_id = models.BigIntegerField()
+    version = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'version']),
+        ]
+
+    def __str__(self) -> str:  # type: ignore
+        return f"Product {self.product_id} deleted at v{self.version}"
+
+
+class ProductImportJob(models.Model):
+    """A bulk product CSV upload, imported in the background; see products.imports"""
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Importing products'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    objects = BusinessSpecificManager()
+
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='product_imports')
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='product_imports'
+    )
+    file = models.FileField(upload_to='imports/products/')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total_rows = models.PositiveIntegerField(default=0)
+    processed_rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    # The first PRODUCT_IMPORT_MAX_ERRORS row errors as {'row': line number, 'error': message}
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Last progress of a running import, to tell a stalled one from a slow one
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self) -> str:  # type: ignore
+        return f"Product import {self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    @property
+    def progress(self):
+        """Percentage of the rows read so far"""
+        if self.is_finished:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(100, int(self.processed_rows * 100 / self.total_rows))
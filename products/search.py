@@ -0,0 +1,220 @@
+"""
+Pluggable product search.
+
+``get_search_backend()`` picks the backend for the default database unless
+PRODUCT_SEARCH_BACKEND names one ('postgres', 'sqlite' or 'icontains'):
+
+- PostgresSearchBackend matches names by trigram word similarity and
+  descriptions by full-text search, backed by GIN indexes.
+- SQLiteSearchBackend matches an FTS5 table kept in sync with the product
+  table by triggers, ranked with bm25.
+- IContainsSearchBackend is the plain ``icontains`` scan used before, for
+  any other database.
+
+Every backend matches SKU and barcode prefixes and orders the best matches
+first. The indexes, tables and triggers a backend needs are created after
+``migrate`` (see products.apps) and can be rebuilt with the
+rebuild_search_index command.
+"""
+import logging
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+
+logger = logging.getLogger(__name__)
+
+# Backend name forced by settings; detected from the database vendor when unset
+PRODUCT_SEARCH_BACKEND = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+
+PRODUCT_TABLE = 'products_product'
+
+
+class IContainsSearchBackend:
+    """Substring match on name, SKU and description; no index can serve it"""
+
+    name = 'icontains'
+
+    def install(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def search(self, queryset, query):
+        query = query.strip()
+        if not query:
+            return queryset.none()
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(sku__icontains=query) |
+            Q(barcode__startswith=query) |
+            Q(description__icontains=query)
+        ).annotate(
+            search_rank=Case(
+                When(Q(sku__istartswith=query) | Q(barcode__startswith=query), then=Value(2.0)),
+                When(name__istartswith=query, then=Value(1.0)),
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+        ).order_by('-search_rank', 'name')
+
+
+class PostgresSearchBackend:
+    """Trigram similarity on names plus full-text search on descriptions"""
+
+    name = 'postgres'
+    config = 'simple'
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS products_product_name_trgm '
+                f'ON {PRODUCT_TABLE} USING gin (name gin_trgm_ops)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS products_product_sku_trgm '
+                f'ON {PRODUCT_TABLE} USING gin (UPPER(sku) gin_trgm_ops)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS products_product_barcode_trgm '
+                f'ON {PRODUCT_TABLE} USING gin (barcode gin_trgm_ops)'
+            )
+            # Must match the expression SearchVector compiles to
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS products_product_description_fts "
+                f"ON {PRODUCT_TABLE} USING gin (to_tsvector('{self.config}'::regconfig, COALESCE(description, '')))"
+            )
+
+    def rebuild(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'REINDEX TABLE {PRODUCT_TABLE}')
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.lookups import SearchLookup, TrigramWordSimilar
+        from django.contrib.postgres.search import (
+            SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity,
+        )
+
+        query = query.strip()
+        if not query:
+            return queryset.none()
+        vector = SearchVector('description', config=self.config)
+        search_query = SearchQuery(query, config=self.config)
+        return queryset.filter(
+            TrigramWordSimilar(F('name'), Value(query)) |
+            Q(sku__istartswith=query) |
+            Q(barcode__startswith=query) |
+            SearchLookup(vector, search_query)
+        ).annotate(
+            search_rank=Greatest(
+                TrigramWordSimilarity(query, 'name'),
+                SearchRank(vector, search_query),
+                Case(
+                    When(Q(sku__istartswith=query) | Q(barcode__startswith=query), then=Value(2.0)),
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                ),
+            )
+        ).order_by('-search_rank', 'name')
+
+
+class SQLiteSearchBackend:
+    """FTS5 prefix search over name, SKU, barcode and description"""
+
+    name = 'sqlite'
+    table = 'products_product_fts'
+    columns = ('name', 'sku', 'barcode', 'description')
+    # bm25 weights per column: a SKU or barcode hit beats a name hit beats a description hit
+    weights = (5.0, 10.0, 10.0, 1.0)
+
+    def install(self, connection):
+        columns = ', '.join(self.columns)
+        new = ', '.join(f'new.{column}' for column in self.columns)
+        old = ', '.join(f'old.{column}' for column in self.columns)
+        statements = [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"{columns}, content='{PRODUCT_TABLE}', content_rowid='id', prefix='2 3')",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_insert AFTER INSERT ON {PRODUCT_TABLE} BEGIN "
+            f"INSERT INTO {self.table}(rowid, {columns}) VALUES (new.id, {new}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_delete AFTER DELETE ON {PRODUCT_TABLE} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, {columns}) VALUES ('delete', old.id, {old}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_update AFTER UPDATE OF {columns} ON {PRODUCT_TABLE} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {self.table}(rowid, {columns}) VALUES (new.id, {new}); END",
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+                [self.table, f'{self.table}_insert', f'{self.table}_delete', f'{self.table}_update']
+            )
+            installed = cursor.fetchone()[0] == 4
+            for statement in statements:
+                cursor.execute(statement)
+        # Rows written while the table or its triggers were missing (for
+        # example while a migration rebuilt the product table) are not indexed
+        if not installed:
+            self.rebuild(connection)
+
+    def rebuild(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def match_expression(self, query):
+        """
+        Every word of the query as a quoted prefix term, so user input is never
+        parsed as FTS syntax. Whole-word hits match twice and so rank higher.
+        """
+        terms = re.findall(r'\w+', query)
+        return ' AND '.join(f'("{term}" OR "{term}"*)' for term in terms)
+
+    def search(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in self.weights)
+        # An annotation rather than an extra select, so the rank can be
+        # filtered on by keyset pagination
+        return queryset.extra(
+            tables=[self.table],
+            where=[f'{self.table}.rowid = {PRODUCT_TABLE}.id', f'{self.table} MATCH %s'],
+            params=[match],
+        ).annotate(
+            search_rank=RawSQL(f'-bm25({self.table}, {weights})', [], output_field=FloatField())
+        ).order_by('-search_rank', 'name')
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (IContainsSearchBackend, PostgresSearchBackend, SQLiteSearchBackend)
+}
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend(using='default'):
+    """The search backend for this database connection"""
+    if PRODUCT_SEARCH_BACKEND:
+        return BACKENDS[PRODUCT_SEARCH_BACKEND]()
+    return VENDOR_BACKENDS.get(connections[using].vendor, IContainsSearchBackend)()
+
+
+def search_products(queryset, query):
+    """Filter ``queryset`` to the products matching ``query``, best matches first"""
+    return get_search_backend(queryset.db).search(queryset, query)
+
+
+def install_search_backend(using='default', **kwargs):
+    """post_migrate hook creating the indexes, tables and triggers of the search backend"""
+    backend = get_search_backend(using)
+    try:
+        backend.install(connections[using])
+    except Exception as e:
+        # Search still works, just without the index (or fails loudly for FTS5)
+        logger.warning(f"Could not install the {backend.name} product search backend: {e}")
@@ -50,13 +50,12 @@ def update_product_stock_on_sale(sender, instance, created, **kwargs):
                 
                 # Check if product is now low stock
                 if product.quantity <= product.reorder_level:
-                    # Create low stock notification for users in the same business
-                    Notification.create_for_all_users(
-                        title=f'Low Stock Alert: {product.name}',
-                        message=f'The product "{product.name}" is low on stock after a sale. Current quantity: {product.quantity}, Reorder level: {product.reorder_level}',
-                        notification_type='low_stock',
-                        related_product=product
-                    )
+                    # Notify users in the same business once the sale has committed
+                    Notification.create_for_products_on_commit('low_stock', [(
+                        product,
+                        f'Low Stock Alert: {product.name}',
+                        f'The product "{product.name}" is low on stock after a sale. Current quantity: {product.quantity}, Reorder level: {product.reorder_level}',
+                    )])
         except Exception as e:
             # Log the error or handle it appropriately
             logger.error(f"Error updating product stock: {str(e)}")
@@ -112,7 +111,11 @@ def handle_sale_item_update(sender, instance, **kwargs):
 def restore_product_stock_on_sale_delete(sender, instance, **kwargs):
     """
     Restore product stock when a sale item is deleted.
+    Items of a sale deleted through sales.services.delete_sale are restored there in bulk.
     """
+    from sales.services import reversed_in_bulk
+    if reversed_in_bulk(instance):
+        return
     try:
         with transaction.atomic():  # type: ignore
             product = instance.product
@@ -141,4 +144,40 @@ def set_default_values_for_product(sender, instance, created, **kwargs):
             instance.cost_price = 0
         if instance.selling_price is None:
             instance.selling_price = 0
-        instance.save()
\ No newline at end of file
+        instance.save()
+
+
+@receiver(pre_save, sender=Product)
+def stamp_catalog_version(sender, instance, **kwargs):
+    """
+    Stamp a changed product with a new catalog version so POS clients pick it
+    up on their next delta sync.
+    """
+    if instance.business_id:
+        from products.catalog import bump_catalog_version
+        instance.catalog_version = bump_catalog_version(instance.business_id)
+
+@receiver(post_delete, sender=Product)
+def record_catalog_tombstone(sender, instance, **kwargs):
+    """
+    Remember deleted products so POS clients drop them on their next delta sync.
+    Nothing is recorded when the whole business is being deleted.
+    """
+    from superadmin.models import Business
+    origin = kwargs.get('origin')
+    if isinstance(origin, Business) or getattr(origin, 'model', None) is Business:
+        return
+    if instance.business_id:
+        from products.catalog import record_tombstone
+        record_tombstone(instance.business_id, instance.pk)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_barcode_index(sender, instance, **kwargs):
+    """
+    Re-index a saved or deleted product for scanner lookups once its
+    transaction has committed.
+    """
+    if instance.business_id:
+        from products.barcode_index import refresh_products_on_commit
+        refresh_products_on_commit(instance.business_id, [instance.pk])
@@ -1,3 +1,5 @@
+from io import StringIO
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from products.models import Product, Category, Unit
@@ -146,4 +148,723 @@ class StockAutomationTest(TestCase):
         self.product.refresh_from_db()
         
         # Check that stock was restored
-        self.assertEqual(float(self.product.quantity), float(initial_quantity))
\ No newline at end of file
+        self.assertEqual(float(self.product.quantity), float(initial_quantity))
+
+class GenerateNotificationsCommandTest(TestCase):
+    def setUp(self):
+        from superadmin.models import Business
+        
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.other_owner = User.objects.create_user(username='other', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        self.other_business = Business.objects.create(company_name='Other Shop', owner=self.other_owner, email='other@example.com')
+        
+        from datetime import timedelta
+        from django.utils import timezone
+        today = timezone.localdate()
+        for business in (self.business, self.other_business):
+            category = Category.objects.create(business=business, name='Food')
+            unit = Unit.objects.create(business=business, name='Piece', symbol='pcs')
+            defaults = dict(business=business, category=category, unit=unit, cost_price=1, selling_price=2)
+            Product.objects.create(name='Low', sku='LOW', quantity=1, reorder_level=5, **defaults)
+            Product.objects.create(name='Expired', sku='EXP', quantity=50, expiry_date=today - timedelta(days=1), **defaults)
+            Product.objects.create(name='Yogurt', sku='YOG', quantity=50, expiry_date=today + timedelta(days=3), **defaults)
+            Product.objects.create(name='Fine', sku='OK', quantity=50, reorder_level=5, **defaults)
+    
+    def run_command(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('generate_notifications', *args, stdout=out)
+        return out.getvalue()
+    
+    def test_dry_run_writes_nothing(self):
+        from notifications.models import Notification
+        
+        output = self.run_command('--dry-run')
+        
+        self.assertEqual(Notification.objects.count(), 0)
+        self.assertIn('Low stock: 2 products, would create 2 notifications', output)
+    
+    def test_generates_once_per_product_and_type(self):
+        from notifications.models import Notification
+        
+        self.run_command()
+        # Low stock, expired, near expiry and urgent expiry for each business
+        self.assertEqual(Notification.objects.filter(recipient=self.owner).count(), 4)
+        self.assertEqual(Notification.objects.filter(recipient=self.other_owner).count(), 4)
+        self.assertTrue(Notification.objects.filter(recipient=self.owner, title__startswith='Urgent').exists())
+        
+        # Unread notifications are not repeated
+        output = self.run_command()
+        self.assertEqual(Notification.objects.count(), 8)
+        self.assertIn('Low stock: 0 products, created 0 notifications (1 queries', output)
+    
+    def test_business_option_limits_scope(self):
+        from notifications.models import Notification
+        
+        self.run_command('--business', str(self.business.id))
+        
+        self.assertEqual(Notification.objects.filter(recipient=self.owner).count(), 4)
+        self.assertFalse(Notification.objects.filter(recipient=self.other_owner).exists())
+
+
+class BarcodeIndexTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from superadmin.models import Business
+        from superadmin.middleware import set_current_business
+        
+        cache.clear()
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        set_current_business(self.business)
+        
+        self.category = Category.objects.create(business=self.business, name='Drinks')
+        self.unit = Unit.objects.create(business=self.business, name='Bottle', symbol='btl')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products = [self.create_product(index) for index in range(3)]
+    
+    def tearDown(self):
+        from django.core.cache import cache
+        from superadmin.middleware import clear_current_business
+        
+        cache.clear()
+        clear_current_business()
+    
+    def use_shared_cache(self):
+        # The test cache stands in for a cache every worker shares
+        from unittest import mock
+        
+        patcher = mock.patch('products.barcode_index.is_shared_cache', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def create_product(self, index):
+        return Product.objects.create(
+            business=self.business,
+            name=f'Product {index}',
+            sku=f'SKU{index}',
+            barcode=f'400000000{index}',
+            category=self.category,
+            unit=self.unit,
+            cost_price=1,
+            selling_price=2,
+            quantity=10
+        )
+    
+    def test_lookups_are_served_from_the_cache(self):
+        from django.core.cache import cache
+        from products.barcode_index import lookup_barcode, lookup_sku
+        
+        self.use_shared_cache()
+        cache.clear()
+        # The first lookup warms the whole index with one query
+        with self.assertNumQueries(1):
+            self.assertEqual(lookup_barcode(self.business.pk, '4000000000')['id'], self.products[0].pk)
+        with self.assertNumQueries(0):
+            summary = lookup_barcode(self.business.pk, '4000000001')
+            self.assertEqual(lookup_sku(self.business.pk, 'sku2')['id'], self.products[2].pk)
+        self.assertEqual(summary['name'], 'Product 1')
+        self.assertEqual(summary['unit'], 'btl')
+        
+        # Unknown barcodes are remembered as missing
+        with self.assertNumQueries(1):
+            self.assertIsNone(lookup_barcode(self.business.pk, '999'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(lookup_barcode(self.business.pk, '999'))
+    
+    def test_signals_and_checkout_refresh_the_index(self):
+        from products.barcode_index import lookup_barcode
+        from sales.services import checkout
+        
+        self.use_shared_cache()
+        product = self.products[0]
+        lookup_barcode(self.business.pk, '4000000000')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            product.barcode = '4000000099'
+            product.name = 'Renamed'
+            product.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_barcode(self.business.pk, '4000000099')['name'], 'Renamed')
+        self.assertIsNone(lookup_barcode(self.business.pk, '4000000000'))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout(self.business, [{'product_id': product.pk, 'quantity': 3, 'unit_price': '2.00'}])
+        self.assertEqual(lookup_barcode(self.business.pk, '4000000099')['stock'], 7)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].delete()
+        self.assertIsNone(lookup_barcode(self.business.pk, '4000000001'))
+    
+    def test_per_process_caches_are_bypassed(self):
+        from unittest import mock
+        from django.core.cache.backends.locmem import LocMemCache
+        from products.barcode_index import lookup_barcode
+        
+        # Two workers, each with its own local-memory cache
+        worker_a = LocMemCache('worker-a', {})
+        worker_b = LocMemCache('worker-b', {})
+        product = self.products[0]
+        
+        with mock.patch('products.barcode_index.cache', worker_b):
+            self.assertEqual(lookup_barcode(self.business.pk, '4000000000')['price'], 2)
+        with mock.patch('products.barcode_index.cache', worker_a), self.captureOnCommitCallbacks(execute=True):
+            product.selling_price = 5
+            product.save()
+        with mock.patch('products.barcode_index.cache', worker_b), self.assertNumQueries(1):
+            self.assertEqual(lookup_barcode(self.business.pk, '4000000000')['price'], 5)
+    
+    def test_scan_endpoint_uses_the_index(self):
+        from django.urls import reverse
+        
+        self.use_shared_cache()
+        self.client.force_login(self.owner)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+        
+        response = self.client.get(reverse('sales:get_product_by_barcode', kwargs={'barcode': '4000000002'}))
+        self.assertEqual(response.json(), {
+            'id': self.products[2].pk, 'name': 'Product 2', 'price': 2.0, 'stock': 10.0, 'unit': 'btl'
+        })
+        # Codes typed in by hand may be SKUs
+        response = self.client.get(reverse('sales:get_product_by_barcode', kwargs={'barcode': 'SKU1'}))
+        self.assertEqual(response.json()['id'], self.products[1].pk)
+        
+        response = self.client.get(reverse('sales:get_product_by_barcode', kwargs={'barcode': '123'}))
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        from superadmin.models import Business
+        from superadmin.middleware import set_current_business
+        
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        self.other_business = Business.objects.create(company_name='Other Shop', owner=self.owner, email='other@example.com')
+        set_current_business(self.business)
+        
+        self.cola = self.create_product(self.business, 'Cola Zero', 'DRK-100', '5000112637922', 'Sugar free soft drink')
+        self.water = self.create_product(self.business, 'Sparkling Water', 'DRK-200', '5000112637939', 'Mineral water with cola flavour')
+        self.colander = self.create_product(self.business, 'Colander', 'KIT-300', '7000000000001', 'Kitchen strainer')
+        self.other = self.create_product(self.other_business, 'Cola Classic', 'DRK-100', '5000112637946', '')
+    
+    def tearDown(self):
+        from superadmin.middleware import clear_current_business
+        clear_current_business()
+    
+    def create_product(self, business, name, sku, barcode, description):
+        category, _ = Category.objects.get_or_create(business=business, name='General')
+        unit, _ = Unit.objects.get_or_create(business=business, name='Piece', symbol='pcs')
+        return Product.objects.create(
+            business=business, name=name, sku=sku, barcode=barcode, description=description,
+            category=category, unit=unit, cost_price=1, selling_price=2, quantity=10
+        )
+    
+    def search(self, query, backend=None):
+        from products import search
+        
+        backend = search.BACKENDS[backend]() if backend else search.get_search_backend()
+        return list(backend.search(Product.objects.business_specific(), query))
+    
+    def test_sqlite_backend_ranks_prefix_matches(self):
+        from products.search import get_search_backend
+        
+        self.assertEqual(get_search_backend().name, 'sqlite')
+        # Name matches rank above description matches, other businesses never match
+        self.assertEqual(self.search('cola')[:2], [self.cola, self.colander])
+        self.assertIn(self.water, self.search('cola'))
+        self.assertEqual(self.search('drk-2'), [self.water])
+        self.assertEqual(self.search('50001126379'), [self.cola, self.water])
+        # FTS syntax in user input is matched literally
+        self.assertEqual(self.search('cola" OR *'), [])
+    
+    def test_fts_table_follows_product_changes(self):
+        self.cola.name = 'Lemonade'
+        self.cola.save()
+        self.assertEqual(self.search('lemon'), [self.cola])
+        self.assertNotIn(self.cola, self.search('cola'))
+        
+        self.colander.delete()
+        self.assertEqual(self.search('colander'), [])
+    
+    def test_icontains_backend(self):
+        self.assertEqual(self.search('DRK-1', backend='icontains'), [self.cola])
+        self.assertEqual(self.search('ander', backend='icontains'), [self.colander])
+    
+    def test_search_ajax_is_ranked(self):
+        from django.urls import reverse
+        
+        self.client.force_login(self.owner)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+        
+        response = self.client.get(reverse('products:search_ajax'), {'q': 'cola'})
+        self.assertEqual([product['id'] for product in response.json()['products']][:2], [self.cola.pk, self.colander.pk])
+    
+    def test_list_keeps_the_ranking(self):
+        from django.urls import reverse
+        
+        # Sorts first by name, but only its description matches
+        flavour = self.create_product(self.business, 'Apple Soda', 'DRK-300', '5000112637953', 'Tastes like cola')
+        self.client.force_login(self.owner)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+        
+        response = self.client.get(reverse('products:list'), {'search': 'cola'})
+        self.assertEqual(response.status_code, 200)
+        products = list(response.context['products'])
+        self.assertEqual(products[0], self.cola)
+        self.assertIn(flavour, products)
+    
+    def test_ranked_results_page_with_cursors(self):
+        from unittest import mock
+        from products.search import search_products
+        from utils.pagination import keyset_paginate
+        
+        for backend in ['sqlite', 'icontains']:
+            with self.subTest(backend=backend), mock.patch('products.search.PRODUCT_SEARCH_BACKEND', backend):
+                results = search_products(Product.objects.business_specific(), 'cola')
+                pages = [keyset_paginate(results, per_page=1)]
+                while pages[-1].has_next:
+                    pages.append(keyset_paginate(results, pages[-1].next_cursor, per_page=1))
+                self.assertEqual([page.object_list[0] for page in pages], list(results))
+                
+                previous = keyset_paginate(results, pages[-1].previous_cursor, per_page=1)
+                self.assertEqual(previous.object_list, pages[-2].object_list)
+
+
+class ProductApiPaginationTest(TestCase):
+    def setUp(self):
+        from superadmin.models import Business
+        
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        category = Category.objects.create(business=self.business, name='General')
+        unit = Unit.objects.create(business=self.business, name='Piece', symbol='pcs')
+        # Duplicate names must neither repeat nor skip products
+        self.products = [
+            Product.objects.create(
+                business=self.business, name=f'Product {index // 2}', sku=f'SKU{index}',
+                category=category, unit=unit, cost_price=1, selling_price=2
+            )
+            for index in range(5)
+        ]
+        
+        self.client.force_login(self.owner)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+    
+    def test_list_uses_cursors(self):
+        from django.urls import reverse
+        
+        data = self.client.get(reverse('api_product_list'), {'page_size': 3}).json()
+        self.assertEqual([product['id'] for product in data['results']], [product.pk for product in self.products[:3]])
+        self.assertIsNone(data['previous'])
+        
+        data = self.client.get(data['next']).json()
+        self.assertEqual([product['id'] for product in data['results']], [product.pk for product in self.products[3:]])
+        self.assertIsNone(data['next'])
+        
+        data = self.client.get(data['previous']).json()
+        self.assertEqual(len(data['results']), 3)
+        
+        response = self.client.get(reverse('api_product_list'), {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ProductImportTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from superadmin.models import Business
+        
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_override = self.settings(MEDIA_ROOT=media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        self.category = Category.objects.create(business=self.business, name='Drinks')
+        self.unit = Unit.objects.create(business=self.business, name='Bottle', symbol='BOT')
+        self.existing = Product.objects.create(
+            business=self.business, name='Juice', sku='JUICE001', barcode='001',
+            category=self.category, unit=self.unit, cost_price=1, selling_price=2
+        )
+        
+        self.client.force_login(self.owner)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+    
+    def csv_file(self, rows):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        
+        header = 'Name,SKU,Barcode,Category,Unit,Description,Cost Price,Selling Price,Quantity,Reorder Level,Expiry Date'
+        return SimpleUploadedFile('products.csv', '\n'.join([header] + rows).encode(), content_type='text/csv')
+    
+    def test_upload_is_imported_by_a_job(self):
+        from django.core.management import call_command
+        from django.urls import reverse
+        from products.models import ProductImportJob
+        
+        upload = self.csv_file([
+            'Cola,COLA001,,Drinks,Bottle,Sparkling,1.00,2.50,10,2,2030-01-31',
+            'Chips,CHIPS001,5000000000001,Snacks,Bag,,0.50,1.00,,,',
+            'Juice again,JUICE001,,Drinks,Bottle,,1,2,3,1,',
+            'Cola copy,COLA001,,Drinks,Bottle,,1,2,3,1,',
+            'Bad price,BAD001,,Drinks,Bottle,,abc,2,3,1,',
+            'Short row,SHORT001',
+            ',NONAME001,,Drinks,Bottle,,1,2,3,1,',
+            'Bad date,DATE001,,Drinks,Bottle,,1,2,3,1,31/01/2030',
+        ])
+        response = self.client.post(reverse('products:bulk_upload'), {'csv_file': upload})
+        job = ProductImportJob.objects.all_businesses().get()
+        self.assertRedirects(response, f"{reverse('products:bulk_upload')}?job={job.pk}")
+        self.assertEqual(job.status, 'pending')
+        
+        call_command('process_product_imports', stdout=StringIO())
+        
+        data = self.client.get(reverse('products:import_job_status', args=[job.pk])).json()
+        self.assertEqual(data['status'], 'completed')
+        self.assertEqual((data['total_rows'], data['processed_rows']), (8, 8))
+        self.assertEqual((data['created'], data['error_count']), (2, 6))
+        self.assertEqual([error['row'] for error in data['errors']], [4, 5, 6, 7, 8, 9])
+        self.assertIn('SKU JUICE001 already exists', data['errors'][0]['error'])
+        
+        cola = Product.objects.for_business(self.business).get(sku='COLA001')
+        self.assertEqual(cola.category, self.category)
+        self.assertEqual(cola.unit, self.unit)
+        self.assertEqual(str(cola.selling_price), '2.50')
+        self.assertEqual(cola.expiry_date.isoformat(), '2030-01-31')
+        self.assertTrue(cola.barcode)
+        self.assertNotEqual(cola.barcode, self.existing.barcode)
+        self.assertGreater(cola.catalog_version, self.existing.catalog_version)
+        
+        chips = Product.objects.for_business(self.business).select_related('category', 'unit').get(sku='CHIPS001')
+        self.assertEqual(chips.barcode, '5000000000001')
+        self.assertEqual((chips.category.name, chips.unit.name, chips.unit.symbol), ('Snacks', 'Bag', 'BAG'))
+        
+        # Only the business that uploaded the file can follow the job
+        other = get_user_model().objects.create_user(username='other', password='testpass123')
+        self.client.force_login(other)
+        response = self.client.get(reverse('products:import_job_status', args=[job.pk]))
+        self.assertEqual(response.status_code, 404)
+    
+    def test_stalled_running_jobs_are_failed(self):
+        from datetime import timedelta
+        from django.core.management import call_command
+        from django.utils import timezone
+        from products.imports import PRODUCT_IMPORT_STALE_AFTER
+        from products.models import ProductImportJob
+        
+        long_ago = timezone.now() - timedelta(seconds=PRODUCT_IMPORT_STALE_AFTER + 60)
+        jobs = ProductImportJob.objects.all_businesses()
+        stalled = jobs.create(
+            business=self.business, file=self.csv_file([]), status='running',
+            started_at=long_ago, heartbeat_at=long_ago
+        )
+        # Slow but still progressing
+        slow = jobs.create(
+            business=self.business, file=self.csv_file([]), status='running',
+            started_at=long_ago, heartbeat_at=timezone.now()
+        )
+        
+        output = StringIO()
+        call_command('process_product_imports', stdout=output)
+        
+        self.assertIn('Failed 1 import(s)', output.getvalue())
+        stalled.refresh_from_db()
+        slow.refresh_from_db()
+        self.assertEqual(stalled.status, 'failed')
+        self.assertTrue(stalled.message)
+        self.assertIsNotNone(stalled.finished_at)
+        self.assertEqual(slow.status, 'running')
+    
+    def test_batch_queries_do_not_grow_with_rows(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from products.barcodes import reserve_barcode_numbers
+        from products.imports import ProductImporter
+        
+        def import_rows(prefix, first_line, count):
+            importer = ProductImporter(self.business)
+            rows = [
+                (line, [f'{prefix} {line}', f'{prefix}-{line}', '', f'{prefix} category {line % 3}',
+                        f'{prefix} unit {line % 2}', '', '1', '2', '3', '1', ''])
+                for line in range(first_line, first_line + count)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                created, errors = importer.import_batch(rows)
+            self.assertEqual((created, errors), (count, []))
+            return len(queries)
+        
+        # Create the barcode counter first, that happens only once per business
+        reserve_barcode_numbers(self.business.pk, 1)
+        self.assertEqual(import_rows('Small', 2, 5), import_rows('Large', 1000, 50))
+        barcodes = Product.objects.for_business(self.business).values_list('barcode', flat=True)
+        self.assertEqual(len(set(barcodes)), len(barcodes))
+
+
+class BarcodeAllocationTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from superadmin.models import Business
+        
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_override = self.settings(MEDIA_ROOT=media.name)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
+        
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        self.category = Category.objects.create(business=self.business, name='Drinks')
+        self.unit = Unit.objects.create(business=self.business, name='Bottle', symbol='btl')
+    
+    def create_product(self, sku, **kwargs):
+        return Product.objects.create(
+            business=self.business, name=sku, sku=sku, category=self.category, unit=self.unit,
+            cost_price=1, selling_price=2, **kwargs
+        )
+    
+    def test_generated_barcodes_follow_the_business_counter(self):
+        from barcode import EAN13, UPCA
+        
+        ean = self.create_product('A1')
+        upca = self.create_product('A2', barcode_format='upca')
+        code128 = self.create_product('A3', barcode_format='code128')
+        
+        self.assertEqual(ean.barcode, '2000000000015')
+        self.assertEqual(upca.barcode, '200000000028')
+        self.assertEqual(code128.barcode, '2000000000039')
+        # The check digits are the ones scanners expect
+        self.assertEqual(EAN13(ean.barcode[:12]).get_fullcode(), ean.barcode)
+        self.assertEqual(UPCA(upca.barcode[:11]).get_fullcode(), upca.barcode)
+    
+    def test_allocation_skips_taken_codes_without_probing_each(self):
+        from django.db import IntegrityError, connection, transaction
+        from django.test.utils import CaptureQueriesContext
+        from products.barcodes import allocate_barcodes, format_barcode
+        
+        # A code typed in by hand that the counter reaches next
+        self.create_product('HAND', barcode=format_barcode(1, 'ean13'))
+        self.assertEqual(self.create_product('AUTO').barcode, format_barcode(2, 'ean13'))
+        
+        with CaptureQueriesContext(connection) as one:
+            allocate_barcodes(self.business.pk, ['ean13'])
+        with CaptureQueriesContext(connection) as many:
+            barcodes = allocate_barcodes(self.business.pk, ['ean13'] * 100)
+        self.assertEqual(len(one), len(many))
+        self.assertEqual(len(set(barcodes)), 100)
+        
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create_product('COPY', barcode=format_barcode(1, 'ean13'))
+    
+    def test_form_rejects_a_taken_barcode(self):
+        from products.forms import ProductForm
+        from superadmin.middleware import set_current_business, clear_current_business
+        
+        set_current_business(self.business)
+        self.addCleanup(clear_current_business)
+        existing = self.create_product('A1')
+        form = ProductForm({
+            'name': 'Copy', 'sku': 'A2', 'barcode': existing.barcode, 'barcode_format': 'ean13',
+            'category': self.category.pk, 'unit': self.unit.pk, 'cost_price': 1, 'selling_price': 2,
+            'quantity': 0, 'reorder_level': 0, 'is_active': True,
+        }, business=self.business)
+        self.assertIn('barcode', form.errors)
+
+
+class CodeImageTest(TestCase):
+    def setUp(self):
+        import tempfile
+        from unittest import mock
+        from superadmin.models import Business
+        
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        patcher = mock.patch('products.code_images.CODE_IMAGE_CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        User = get_user_model()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.owner, email='shop@example.com')
+        category = Category.objects.create(business=self.business, name='Drinks')
+        unit = Unit.objects.create(business=self.business, name='Bottle', symbol='btl')
+        self.products = [
+            Product.objects.create(
+                business=self.business, name=f'Product {index}', sku=f'SKU{index}',
+                category=category, unit=unit, cost_price=1, selling_price=2
+            )
+            for index in range(2)
+        ]
+        
+        self.client.force_login(self.owner)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+    
+    def cached_files(self):
+        import os
+        return [name for _, _, names in os.walk(self.cache_dir) for name in names]
+    
+    def count_renders(self):
+        from unittest import mock
+        from products import code_images
+        
+        return mock.patch('products.code_images.render_code', wraps=code_images.render_code)
+    
+    def test_images_are_rendered_on_first_request_and_cached(self):
+        from django.urls import reverse
+        from products.utils import get_product_barcode_url
+        
+        # Saving a product renders nothing
+        self.assertEqual(self.cached_files(), [])
+        
+        url = reverse('products:barcode_image', args=[self.products[0].pk])
+        with self.count_renders() as render:
+            first = self.client.get(url)
+            second = self.client.get(url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first['Content-Type'], 'image/png')
+        self.assertTrue(first.content.startswith(b'\x89PNG'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(self.cached_files()), 1)
+        self.assertIn('no-cache', first['Cache-Control'])
+        
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        
+        response = self.client.get(get_product_barcode_url(self.products[0]))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        
+        response = self.client.get(url, {'module_height': '500'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('products:qr_image', args=[self.products[0].pk]), {'box_size': 4})
+        self.assertEqual(response.status_code, 200)
+        
+        other = get_user_model().objects.create_user(username='other', password='testpass123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+    
+    def test_label_sheet_renders_each_barcode_once(self):
+        from django.urls import reverse
+        
+        with self.count_renders() as render:
+            response = self.client.get(reverse('products:label_sheet'), {
+                'ids': [product.pk for product in self.products], 'copies': 3
+            })
+        self.assertEqual(render.call_count, 2)
+        self.assertEqual(len(response.context['labels']), 6)
+        self.assertContains(response, 'data:image/png;base64,', count=6)
+    
+    def test_label_sheet_shows_barcodes_that_cannot_be_encoded_as_text(self):
+        from django.urls import reverse
+        
+        Product.objects.for_business(self.business).filter(pk=self.products[0].pk).update(barcode_format='ean13', barcode='ABC-123')
+        response = self.client.get(reverse('products:label_sheet'), {
+            'ids': [product.pk for product in self.products]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<div class="code">ABC-123</div>', html=True)
+        self.assertContains(response, 'data:image/png;base64,', count=1)
+    
+    def test_prune_deletes_least_recently_used_images(self):
+        import os
+        from products.code_images import get_code_image, prune_code_image_cache
+        
+        keys = [get_code_image('code128', f'CODE{index}')[0] for index in range(4)]
+        paths = {key: os.path.join(self.cache_dir, key[:2], f'{key}.png') for key in keys}
+        for age, key in enumerate(keys):
+            os.utime(paths[key], (1000 + age, 1000 + age))
+        # A cache hit makes the oldest image the most recently used
+        get_code_image('code128', 'CODE0')
+        
+        size = sum(os.path.getsize(path) for path in paths.values())
+        self.assertEqual(prune_code_image_cache(max_bytes=size - 1), 1)
+        self.assertFalse(os.path.exists(paths[keys[1]]))
+        self.assertTrue(os.path.exists(paths[keys[0]]))
+    
+    def test_pdf_label_sheet_renders_each_barcode_once(self):
+        from django.urls import reverse
+        
+        with self.count_renders() as render:
+            response = self.client.get(reverse('products:label_sheet'), {
+                'ids': [product.pk for product in self.products], 'copies': 30, 'format': 'pdf'
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        # 60 labels, 24 to an A4 sheet
+        self.assertEqual(response['X-Label-Pages'], '3')
+        self.assertEqual(render.call_count, 2)
+    
+    def test_png_label_sheet_renders_one_page(self):
+        from io import BytesIO
+        from django.urls import reverse
+        from PIL import Image
+        from products.labels import LABEL_SHEET_DPI
+        
+        response = self.client.get(reverse('products:label_sheet'), {
+            'ids': [self.products[0].pk], 'copies': 100, 'format': 'png', 'layout': 'a4-65', 'page': 2
+        })
+        self.assertEqual(response['Content-Type'], 'image/png')
+        image = Image.open(BytesIO(response.content))
+        self.assertEqual(image.mode, '1')
+        self.assertEqual(image.size, (round(210 / 25.4 * LABEL_SHEET_DPI), round(297 / 25.4 * LABEL_SHEET_DPI)))
+        
+        response = self.client.get(reverse('products:label_sheet'), {
+            'ids': [self.products[0].pk], 'format': 'pdf', 'layout': 'unknown'
+        })
+        self.assertEqual(response.status_code, 400)
+    
+    def test_purchase_order_labels_one_per_unit(self):
+        from decimal import Decimal
+        from django.urls import reverse
+        from suppliers.models import Supplier
+        
+        supplier = Supplier.objects.create(business=self.business, name='Supplier')
+        order = PurchaseOrder.objects.create(business=self.business, supplier=supplier, order_date='2024-01-01')
+        PurchaseItem.objects.create(purchase_order=order, product=self.products[0], quantity=Decimal('2'), unit_price=1)
+        PurchaseItem.objects.create(purchase_order=order, product=self.products[0], quantity=Decimal('1.5'), unit_price=1)
+        PurchaseItem.objects.create(purchase_order=order, product=self.products[1], quantity=Decimal('1'), unit_price=1)
+        
+        self.assertEqual(order.label_entries(), [(self.products[0], 4), (self.products[1], 1)])
+        response = self.client.get(reverse('purchases:labels', kwargs={'pk': order.pk}))
+        self.assertEqual(len(response.context['labels']), 5)
+    
+    def test_label_sheet_is_limited(self):
+        from products.views import limit_labels
+        
+        first, second = self.products
+        self.assertEqual(limit_labels([(first, 3), (second, 3)], 4), ([(first, 3), (second, 1)], True))
+        self.assertEqual(limit_labels([(first, 3), (second, 1)], 4), ([(first, 3), (second, 1)], False))
+    
+    def test_process_pool_renders_the_same_images(self):
+        from unittest import mock
+        from products.labels import render_distinct_codes
+        
+        codes = [('code128', 'CODE1'), ('code128', 'CODE2'), ('code128', 'CODE1'), ('ean13', 'not a number')]
+        in_process = render_distinct_codes(codes, processes=0)
+        self.assertEqual(list(in_process), codes[:2] + codes[3:])
+        self.assertIsNone(in_process[('ean13', 'not a number')])
+        
+        with mock.patch('products.labels.LABEL_SHEET_POOL_MIN_CODES', 1):
+            self.assertEqual(render_distinct_codes(codes, processes=2), in_process)
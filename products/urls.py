@@ -10,8 +10,13 @@ urlpatterns = [
     path('<int:pk>/update/', views.product_update, name='update'),
     path('<int:pk>/delete/', views.product_delete, name='delete'),
     path('<int:pk>/json/', views.product_json, name='json'),
+    path('<int:pk>/barcode.png', views.product_barcode_image, name='barcode_image'),
+    path('<int:pk>/qr.png', views.product_qr_image, name='qr_image'),
+    path('labels/', views.label_sheet, name='label_sheet'),
     path('bulk-upload/', views.bulk_upload, name='bulk_upload'),
+    path('bulk-upload/<int:pk>/status/', views.import_job_status, name='import_job_status'),
     path('download-template/', views.download_template, name='download_template'),
+    path('export/', views.export_products_csv, name='export_csv'),
     path('search/', views.product_search_ajax, name='search_ajax'),
     path('categories/', views.category_list, name='category_list'),
     path('categories/create/', views.category_create, name='category_create'),
@@ -1,22 +1,31 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, F, Value
+from django.db.models import F, Value
 from django.db.models.query import QuerySet
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.conf import settings
 from django.views.decorators.http import require_http_methods
 from django.db import IntegrityError
-import qrcode
+import base64
 import csv
-import io
-from decimal import Decimal
-from .models import Product, Category, Unit
+from .barcode_index import lookup_barcode
+from .code_images import (
+    CODE_IMAGE_MAX_AGE, QR_KIND, CodeImageError, code_image_key, code_image_version, get_code_image,
+    get_code_images, normalize_options, product_code_spec,
+)
+from .imports import start_import_job
+from .labels import DEFAULT_LABEL_LAYOUT, LABEL_LAYOUTS, SHEET_FORMATS, render_label_sheet, sheet_page_count
+from .models import Product, Category, ProductImportJob, Unit
+from .search import search_products
+from utils.csv_export import queryset_rows, streaming_csv_response
+from utils.pagination import paginate_request
 from .forms import ProductForm, CategoryForm, UnitForm
-from .utils import generate_product_qr_code
+from .utils import get_product_barcode_url, get_product_qr_code_url
 
 @login_required
 def test_business_context(request):
@@ -53,13 +62,8 @@ def product_list(request):
     
     # Apply search filter
     if search_query:
-        # Build a single Q object with all search conditions to avoid type checking issues
-        search_filter = (
-            Q(name__icontains=search_query) |
-            Q(sku__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
-        products = products.filter(search_filter)
+        # Ranked search through the configured search backend
+        products = search_products(products, search_query)
     
     # Apply category filter
     if category_id:
@@ -77,8 +81,14 @@ def product_list(request):
     # Get categories for filter dropdown, filtered by business context
     categories = Category.objects.business_specific().all()
     
+    # Keyset pages in name order; search results keep their best matches
+    # first, paged on (rank, name, id)
+    ordering = ('-search_rank', 'name') if search_query else ('name',)
+    page = paginate_request(request, products.order_by(*ordering))
+    
     context = {
-        'products': products,
+        'products': page,
+        'page': page,
         'categories': categories,
         'search_query': search_query,
         'selected_category': category_id,
@@ -99,15 +109,28 @@ def product_search_ajax(request):
     if len(search_query) < 1:
         return JsonResponse({'products': []})
     
-    # Build a single Q object with all search conditions to avoid type checking issues
-    search_filter = (
-        Q(name__icontains=search_query) |
-        Q(sku__icontains=search_query) |
-        Q(description__icontains=search_query)
-    )
-    
-    # Search for products matching the query, filtered by business context
-    products = Product.objects.business_specific().filter(search_filter).filter(is_active=True)[:10]  # Limit to 10 results for performance
+    # A scanned barcode resolves from the barcode index without a LIKE scan;
+    # partial input is not looked up in the database twice
+    from superadmin.middleware import get_current_business
+    current_business = get_current_business()
+    if current_business:
+        match = lookup_barcode(current_business.pk, search_query, fallback=False)
+        if match and match['is_active']:
+            return JsonResponse({'products': [{
+                'id': match['id'],
+                'name': match['name'],
+                'sku': match['sku'],
+                'selling_price': float(match['price']),
+                'quantity': float(match['stock']),
+                'unit': match['unit'],
+                'category': match['category'],
+            }]})
+    
+    # Search for products matching the query, filtered by business context, best matches first
+    products = search_products(
+        Product.objects.business_specific().filter(is_active=True).select_related('unit', 'category'),
+        search_query
+    )[:10]  # Limit to 10 results for performance
     
     # Format products for JSON response
     product_list = []
@@ -184,17 +207,127 @@ def product_create(request):
 def product_detail(request, pk):
     product = get_object_or_404(Product.objects.business_specific(), pk=pk)
     
-    # Generate QR code for the product
-    qr_buffer = generate_product_qr_code(product)
-    
+    # The barcode and QR code images are rendered when the browser asks for them
     context = {
         'product': product,
-        'qr_code_data': qr_buffer.getvalue() if qr_buffer else None,
-        'MEDIA_URL': settings.MEDIA_URL
+        'barcode_url': get_product_barcode_url(product),
+        'qr_code_url': get_product_qr_code_url(product),
     }
     
     return render(request, 'products/detail.html', context)
 
+def image_options(request):
+    """Rendering options overridden in the query string of an image URL"""
+    return {name: value for name, value in request.GET.items() if name != 'v'}
+
+def code_image_response(request, kind, value, overrides):
+    """
+    A cached barcode/QR image. URLs carrying the image's version (``?v=``)
+    never change content and may be cached for good; others are revalidated.
+    """
+    try:
+        key = code_image_key(kind, value, normalize_options(kind, overrides))
+        if f'"{key}"' in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            _, data = get_code_image(kind, value, overrides)
+            response = HttpResponse(data, content_type='image/png')
+    except CodeImageError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    response['ETag'] = f'"{key}"'
+    if request.GET.get('v') == code_image_version(key):
+        patch_cache_control(response, private=True, max_age=CODE_IMAGE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@login_required
+def product_barcode_image(request, pk):
+    """The product's barcode as PNG"""
+    product = get_object_or_404(Product.objects.business_specific(), pk=pk)
+    if not product.barcode:
+        raise Http404('The product has no barcode')
+    return code_image_response(request, *product_code_spec(product, overrides=image_options(request)))
+
+@login_required
+def product_qr_image(request, pk):
+    """The QR code linking to the product page, as PNG"""
+    product = get_object_or_404(Product.objects.business_specific(), pk=pk)
+    return code_image_response(request, *product_code_spec(product, QR_KIND, image_options(request)))
+
+# Labels one printable sheet may hold
+LABEL_SHEET_MAX_LABELS = getattr(settings, 'LABEL_SHEET_MAX_LABELS', 1000)
+
+def limit_labels(entries, max_labels=None):
+    """Cut ``(product, copies)`` entries down to ``max_labels`` labels; returns them and whether any were cut"""
+    remaining = LABEL_SHEET_MAX_LABELS if max_labels is None else max_labels
+    limited = []
+    for product, copies in entries:
+        if remaining <= 0:
+            return limited, True
+        limited.append((product, min(copies, remaining)))
+        remaining -= copies
+    return limited, remaining < 0
+
+def label_sheet_response(request, entries, filename='labels'):
+    """
+    Labels for ``(product, copies)`` entries: a printable page by default,
+    or with ``format=pdf``/``format=png`` a sheet of ``layout`` labels
+    rendered on the server (PNG sheets one ``page`` at a time).
+    """
+    entries, truncated = limit_labels(entries)
+    sheet_format = request.GET.get('format', 'html')
+    
+    if sheet_format in SHEET_FORMATS:
+        layout = request.GET.get('layout', DEFAULT_LABEL_LAYOUT)
+        if layout not in LABEL_LAYOUTS:
+            return JsonResponse({'error': f'Unknown label layout: {layout}'}, status=400)
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            page = 1
+        data = render_label_sheet(entries, sheet_format, layout, page)
+        response = HttpResponse(data, content_type=SHEET_FORMATS[sheet_format])
+        response['Content-Disposition'] = f'inline; filename="{filename}.{sheet_format}"'
+        response['X-Label-Pages'] = sheet_page_count(entries, layout)
+        return response
+    
+    # Every distinct barcode is rendered once and embedded in the page
+    images = get_code_images([product_code_spec(product) for product, _ in entries])
+    labels = []
+    for (product, copies), rendered in zip(entries, images):
+        # Labelled with the plain value when the barcode cannot be encoded
+        image = 'data:image/png;base64,' + base64.b64encode(rendered[1]).decode() if rendered else None
+        labels.extend([{'product': product, 'image': image}] * copies)
+    
+    return render(request, 'products/label_sheet.html', {
+        'labels': labels,
+        'truncated': truncated,
+        'max_labels': LABEL_SHEET_MAX_LABELS,
+        'layouts': LABEL_LAYOUTS,
+        'query': request.GET.urlencode(),
+    })
+
+@login_required
+def label_sheet(request):
+    """
+    Barcode labels for the products in ``ids``, each repeated ``copies``
+    times; see label_sheet_response for the formats.
+    """
+    ids = [pk for pk in request.GET.getlist('ids') if pk.isdigit()]
+    try:
+        copies = max(1, min(int(request.GET.get('copies', 1)), LABEL_SHEET_MAX_LABELS))
+    except ValueError:
+        copies = 1
+    
+    products = (
+        Product.objects.business_specific().filter(pk__in=ids).exclude(barcode__isnull=True).exclude(barcode='')
+        .only('pk', 'name', 'sku', 'barcode', 'barcode_format', 'selling_price')
+        .order_by('name', 'pk')
+    )
+    return label_sheet_response(request, [(product, copies) for product in products])
+
 @login_required
 def product_update(request, pk):
     product = get_object_or_404(Product.objects.business_specific(), pk=pk)
@@ -400,6 +533,9 @@ def unit_delete(request, pk):
 
 @login_required
 def bulk_upload(request):
+    from superadmin.middleware import get_current_business
+    current_business = get_current_business()
+    
     if request.method == 'POST':
         if 'csv_file' in request.FILES:
             csv_file = request.FILES['csv_file']
@@ -409,130 +545,80 @@ def bulk_upload(request):
                 messages.error(request, 'Please upload a CSV file.')
                 return redirect('products:bulk_upload')
             
-            # Process the CSV file
-            try:
-                decoded_file = csv_file.read().decode('utf-8')
-                io_string = io.StringIO(decoded_file)
-                reader = csv.reader(io_string, delimiter=',')
-                
-                # Skip header row
-                next(reader)
-                
-                success_count = 0
-                error_count = 0
-                errors = []
-                
-                for i, row in enumerate(reader):
-                    try:
-                        # Extract data from CSV row
-                        # Expected columns: name, sku, barcode, category_name, unit_name, 
-                        # description, cost_price, selling_price, quantity, reorder_level, expiry_date
-                        if len(row) < 11:
-                            errors.append(f"Row {i+2}: Insufficient columns")
-                            error_count += 1
-                            continue
-                            
-                        name, sku, barcode, category_name, unit_name, description, cost_price, selling_price, quantity, reorder_level, expiry_date = row
-                        
-                        # Validate required fields
-                        if not name or not sku or not category_name or not unit_name:
-                            errors.append(f"Row {i+2}: Missing required fields (name, sku, category, unit)")
-                            error_count += 1
-                            continue
-                        
-                        # Get the current business from the request
-                        from superadmin.middleware import get_current_business
-                        current_business = get_current_business()
-                        if not current_business:
-                            errors.append(f"Row {i+2}: No business context found")
-                            error_count += 1
-                            continue
-                        
-                        # Get or create category
-                        category, _ = Category.objects.get_or_create(
-                            business=current_business,
-                            name=category_name,
-                            defaults={'description': f'Category for {category_name}'}
-                        )
-                        
-                        # Get or create unit
-                        unit, _ = Unit.objects.get_or_create(
-                            business=current_business,
-                            name=unit_name,
-                            defaults={'symbol': unit_name[:3].upper()}
-                        )
-                        
-                        # Handle empty values
-                        barcode = barcode if barcode else None
-                        
-                        # Create product
-                        Product.objects.create(
-                            business=current_business,
-                            name=name,
-                            sku=sku,
-                            barcode=barcode,
-                            category=category,
-                            unit=unit,
-                            description=description or '',
-                            cost_price=Decimal(cost_price) if cost_price else Decimal('0'),
-                            selling_price=Decimal(selling_price) if selling_price else Decimal('0'),
-                            quantity=Decimal(quantity) if quantity else Decimal('0'),
-                            reorder_level=Decimal(reorder_level) if reorder_level else Decimal('0'),
-                            expiry_date=expiry_date if expiry_date else None
-                        )
-                        success_count += 1
-                        
-                    except Exception as e:
-                        errors.append(f"Row {i+2}: {str(e)}")
-                        error_count += 1
-                
-                if success_count > 0:
-                    messages.success(request, f'Successfully imported {success_count} products.')
-                if error_count > 0:
-                    messages.error(request, f'Failed to import {error_count} products. Errors: {" ".join(errors)}')
-                    
-            except Exception as e:
-                messages.error(request, f'Error processing CSV file: {str(e)}')
-                
+            if not current_business:
+                messages.error(request, 'No business context found.')
+                return redirect('products:bulk_upload')
+            
+            # The rows are imported in the background; the page follows the job's progress
+            job = ProductImportJob.objects.create(
+                business=current_business,
+                created_by=request.user,
+                file=csv_file
+            )
+            start_import_job(job)
+            messages.success(request, 'Your file was uploaded. Products are being imported.')
+            return redirect(f"{reverse('products:bulk_upload')}?job={job.pk}")
         else:
             messages.error(request, 'No file uploaded.')
             
         return redirect('products:bulk_upload')
     
-    return render(request, 'products/bulk_upload.html')
+    jobs = ProductImportJob.objects.business_specific()
+    job = None
+    if request.GET.get('job', '').isdigit():
+        job = jobs.filter(pk=request.GET['job']).first()
+    
+    context = {
+        'job': job,
+        'recent_jobs': jobs[:5],
+    }
+    return render(request, 'products/bulk_upload.html', context)
+
+def import_job_data(job):
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'finished': job.is_finished,
+        'progress': job.progress,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'created': job.created_count,
+        'error_count': job.error_count,
+        'errors': job.errors,
+        'message': job.message,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+@login_required
+def import_job_status(request, pk):
+    """Progress and row errors of a bulk upload, polled by the upload page"""
+    job = get_object_or_404(ProductImportJob.objects.business_specific(), pk=pk)
+    return JsonResponse(import_job_data(job))
+
+# Columns of the product export, matching the bulk upload template
+PRODUCT_EXPORT_HEADER = [
+    'Name', 'SKU', 'Barcode', 'Category', 'Unit', 'Description',
+    'Cost Price', 'Selling Price', 'Quantity', 'Reorder Level', 'Expiry Date'
+]
+PRODUCT_EXPORT_FIELDS = [
+    'name', 'sku', 'barcode', 'category__name', 'unit__name', 'description',
+    'cost_price', 'selling_price', 'quantity', 'reorder_level', 'expiry_date'
+]
+
+
+def product_csv_rows(queryset):
+    """Header and data rows of the product export, read in chunks as tuples"""
+    yield PRODUCT_EXPORT_HEADER
+    yield from queryset_rows(queryset, *PRODUCT_EXPORT_FIELDS)
+
 
 @login_required
 def export_products_csv(request):
-    # Create the HttpResponse object with the appropriate CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="products.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write header row
-    writer.writerow([
-        'Name', 'SKU', 'Barcode', 'Category', 'Unit', 'Description',
-        'Cost Price', 'Selling Price', 'Quantity', 'Reorder Level', 'Expiry Date'
-    ])
-    
-    # Write data rows
-    products = Product.objects.business_specific().select_related('category', 'unit')
-    for product in products:
-        writer.writerow([
-            product.name,
-            product.sku,
-            product.barcode or '',
-            product.category.name,
-            product.unit.name,
-            product.description or '',
-            product.cost_price,
-            product.selling_price,
-            product.quantity,
-            product.reorder_level,
-            product.expiry_date or ''
-        ])
-        
-    return response
+    # Streamed as the client reads it; the rows are never all in memory
+    products = Product.objects.business_specific()
+    return streaming_csv_response(product_csv_rows(products), 'products.csv')
 
 @login_required
 def download_template(request):
@@ -1,3 +1,5 @@
+import math
+
 from django.db import models
 from products.models import Product
 from suppliers.models import Supplier
@@ -29,6 +31,10 @@ class PurchaseOrder(models.Model):
 
     class Meta:
         ordering = ['-order_date']
+        indexes = [
+            # Keyset pagination of the purchase order list walks this ordering
+            models.Index(fields=['business', 'order_date', 'id']),
+        ]
 
     def __str__(self):
         return f"PO-{self.pk} - {self.supplier.name}"
@@ -41,6 +47,19 @@ class PurchaseOrder(models.Model):
             total += item.total_amount
         return total
 
+    def label_entries(self):
+        """``(product, copies)`` for a sheet of barcode labels: one per unit ordered, products with a barcode only"""
+        copies = {}
+        items = (
+            PurchaseItem.objects.all_businesses().filter(purchase_order=self)
+            .exclude(product__barcode__isnull=True).exclude(product__barcode='')
+            .select_related('product').order_by('product__name', 'product_id')
+        )
+        for item in items:
+            product, count = copies.get(item.product_id, (item.product, 0))
+            copies[item.product_id] = (product, count + math.ceil(item.quantity))
+        return list(copies.values())
+
 class PurchaseItem(models.Model):
     # Use business-specific manager
     objects = BusinessSpecificManager()
@@ -10,4 +10,5 @@ urlpatterns = [
     path('<int:pk>/update/', views.purchase_order_update, name='update'),
     path('<int:pk>/delete/', views.purchase_order_delete, name='delete'),
     path('<int:pk>/receive/', views.receive_items, name='receive_items'),
+    path('<int:pk>/labels/', views.purchase_order_labels, name='labels'),
 ]
\ No newline at end of file
@@ -5,11 +5,14 @@ from typing import TYPE_CHECKING
 from .models import PurchaseOrder, PurchaseItem
 from .forms import PurchaseOrderForm, PurchaseItemFormSet
 from products.models import Product
+from products.views import label_sheet_response
+from utils.pagination import paginate_request
 
 @login_required
 def purchase_order_list(request):
-    purchase_orders = PurchaseOrder.objects.business_specific().all()
-    return render(request, 'purchases/list.html', {'purchase_orders': purchase_orders})
+    purchase_orders = PurchaseOrder.objects.business_specific().select_related('supplier')
+    page = paginate_request(request, purchase_orders)
+    return render(request, 'purchases/list.html', {'purchase_orders': page, 'page': page})
 
 @login_required
 def purchase_order_create(request):
@@ -63,6 +66,12 @@ def purchase_order_detail(request, pk):
     purchase_order = get_object_or_404(PurchaseOrder.objects.business_specific(), pk=pk)
     return render(request, 'purchases/detail.html', {'purchase_order': purchase_order})
 
+@login_required
+def purchase_order_labels(request, pk):
+    """Barcode labels for the products of a purchase order, one per unit ordered"""
+    purchase_order = get_object_or_404(PurchaseOrder.objects.business_specific(), pk=pk)
+    return label_sheet_response(request, purchase_order.label_entries(), f'PO-{purchase_order.pk}-labels')
+
 @login_required
 def purchase_order_update(request, pk):
     purchase_order = get_object_or_404(PurchaseOrder.objects.business_specific(), pk=pk)
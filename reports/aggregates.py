@@ -0,0 +1,211 @@
+"""
+Set-based revenue / COGS / profit aggregation used by the reports.
+
+Figures are read from the pre-aggregated DailySalesRollup table (maintained by
+reports.rollups), so every function issues a single grouped query and its cost
+depends on the number of days in the range rather than the number of sales.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db.models import DateField, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import Coalesce, Trunc
+
+from .models import DailySalesRollup, ProductDailyRollup
+
+GRAINS = ('day', 'week', 'month')
+
+TOP_PRODUCT_ORDERINGS = ('units_sold', 'revenue', 'cost', 'refunds')
+
+TOTAL_FIELDS = ('orders', 'revenue', 'discount', 'cogs', 'refunds', 'expenses', 'items_sold')
+
+ZERO = Decimal('0')
+
+
+def cogs_expression():
+    """
+    Database expression for the cost of a single sale line.
+
+    Uses the unit cost captured on the sale line so later cost price changes
+    don't rewrite history. Lines recorded before costs were captured, and not
+    backfilled yet, fall back to the product's current cost price rather than
+    counting as free.
+    """
+    return ExpressionWrapper(
+        F('quantity') * Coalesce(F('unit_cost'), F('product__cost_price')),
+        output_field=DecimalField(max_digits=20, decimal_places=4)
+    )
+
+
+def scoped(model, business=None):
+    """Return the model queryset for an explicit business or the current context"""
+    if business is not None:
+        return model.objects.for_business(business)
+    return model.objects.business_specific()
+
+
+def period_start(value, grain):
+    """Return the first day of the period containing ``value``"""
+    if grain == 'week':
+        return value - timedelta(days=value.weekday())
+    if grain == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def iter_periods(start_date, end_date, grain):
+    """Yield the start date of every period overlapping the range"""
+    current = period_start(start_date, grain)
+    while current <= end_date:
+        yield current
+        if grain == 'day':
+            current += timedelta(days=1)
+        elif grain == 'week':
+            current += timedelta(days=7)
+        elif current.month == 12:
+            current = current.replace(year=current.year + 1, month=1)
+        else:
+            current = current.replace(month=current.month + 1)
+
+
+def as_date(value):
+    """Trunc returns strings on some backends when used inside values()"""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def rollups(start_date, end_date, business=None, branch=None):
+    """Rollup rows of a business (or the current one) between two dates (inclusive)"""
+    queryset = scoped(DailySalesRollup, business).filter(date__gte=start_date, date__lte=end_date)
+    if branch is not None:
+        queryset = queryset.filter(branch=branch)
+    return queryset
+
+
+def product_rollups(start_date, end_date, business=None, branch=None):
+    """Product rollup rows of a business (or the current one) between two dates (inclusive)"""
+    queryset = scoped(ProductDailyRollup, business).filter(date__gte=start_date, date__lte=end_date)
+    if branch is not None:
+        queryset = queryset.filter(branch=branch)
+    return queryset
+
+
+def top_products(start_date, end_date, limit=10, order_by='units_sold', business=None, branch=None):
+    """
+    Return the ``limit`` best products of a range ranked by ``order_by``
+    ('units_sold', 'revenue', 'cost' or 'refunds') in a single grouped query.
+
+    Rows keep the keys the report templates use (``product__name``,
+    ``total_sold``, ``total_revenue``) plus ``product_id``, ``total_cost``
+    and ``total_refunds``.
+    """
+    if order_by not in TOP_PRODUCT_ORDERINGS:
+        raise ValueError(f"Unsupported ordering '{order_by}'. Expected one of {', '.join(TOP_PRODUCT_ORDERINGS)}")
+
+    aliases = {
+        'units_sold': 'total_sold',
+        'revenue': 'total_revenue',
+        'cost': 'total_cost',
+        'refunds': 'total_refunds',
+    }
+    return list(
+        product_rollups(start_date, end_date, business, branch).values('product_id', 'product__name').annotate(
+            **{alias: Sum(field) for field, alias in aliases.items()}
+        ).order_by(f'-{aliases[order_by]}', 'product__name')[:limit]
+    )
+
+
+def _clean(values):
+    return {field: values.get(field) or (0 if field == 'orders' else ZERO) for field in TOTAL_FIELDS}
+
+
+def sales_totals(start_date, end_date, business=None, branch=None):
+    """Return orders, revenue, discount, COGS, refunds, expenses and items sold for a range"""
+    totals = rollups(start_date, end_date, business, branch).aggregate(
+        **{field: Sum(field) for field in TOTAL_FIELDS}
+    )
+    return _clean(totals)
+
+
+def totals_by_period(start_date, end_date, grain='day', business=None, branch=None):
+    """Return {period_start: totals} for each period of ``grain`` that has rollup rows"""
+    if grain not in GRAINS:
+        raise ValueError(f"Unsupported grain '{grain}'. Expected one of {', '.join(GRAINS)}")
+
+    rows = rollups(start_date, end_date, business, branch).annotate(
+        period=Trunc('date', grain, output_field=DateField())
+    ).values('period').annotate(
+        **{field: Sum(field) for field in TOTAL_FIELDS}
+    ).order_by('period')
+    return {as_date(row['period']): _clean(row) for row in rows}
+
+
+def _build_row(period, revenue, cogs, expenses):
+    gross_profit = revenue - cogs
+    return {
+        'period': period,
+        'revenue': revenue,
+        'cogs': cogs,
+        'expenses': expenses,
+        'gross_profit': gross_profit,
+        'net_profit': gross_profit - expenses,
+    }
+
+
+def profit_by_period(start_date, end_date, grain='day', business=None, branch=None, fill_gaps=False):
+    """
+    Return revenue, COGS, expenses, gross and net profit for each period of
+    ``grain`` ('day', 'week' or 'month') between two dates (inclusive).
+
+    A single query is issued regardless of the size of the range.
+    Periods without any activity are omitted unless ``fill_gaps`` is set.
+    """
+    totals = totals_by_period(start_date, end_date, grain, business, branch)
+
+    if fill_gaps:
+        periods = list(iter_periods(start_date, end_date, grain))
+    else:
+        periods = sorted(totals)
+
+    empty = _clean({})
+    return [
+        _build_row(
+            period,
+            totals.get(period, empty)['revenue'],
+            totals.get(period, empty)['cogs'],
+            totals.get(period, empty)['expenses']
+        )
+        for period in periods
+    ]
+
+
+def summarize(rows):
+    """Collapse period rows into range totals including profit margins"""
+    revenue = sum((row['revenue'] for row in rows), ZERO)
+    cogs = sum((row['cogs'] for row in rows), ZERO)
+    expenses = sum((row['expenses'] for row in rows), ZERO)
+    summary = _build_row(None, revenue, cogs, expenses)
+    del summary['period']
+
+    if revenue > 0:
+        summary['gross_profit_margin'] = float(summary['gross_profit']) / float(revenue) * 100
+        summary['net_profit_margin'] = float(summary['net_profit']) / float(revenue) * 100
+    else:
+        summary['gross_profit_margin'] = 0
+        summary['net_profit_margin'] = 0
+    return summary
+
+
+def profit_report(start_date, end_date, business=None):
+    """
+    Return the data needed by the profit & loss report and its CSV export:
+    range totals, a daily trend and a gap-free monthly summary.
+    """
+    daily = profit_by_period(start_date, end_date, 'day', business=business)
+    monthly = profit_by_period(start_date, end_date, 'month', business=business, fill_gaps=True)
+    return {
+        'summary': summarize(monthly),
+        'daily': daily,
+        'monthly': monthly,
+    }
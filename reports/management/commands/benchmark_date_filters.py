@@ -0,0 +1,126 @@
+from datetime import timedelta
+from decimal import Decimal
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+
+from products.models import Product
+from sales.models import Sale
+from superadmin.models import Business
+from utils.dates import date_range_filter, on_day
+
+# Notes value marking the synthetic sales created by --seed
+BENCHMARK_MARKER = 'benchmark_date_filters'
+
+
+class Command(BaseCommand):
+    help = 'Compare cast-based (__date) and half-open range date filters and show their query plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business to benchmark (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Insert this many synthetic sales spread over --days before benchmarking'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=730,
+            help='Number of days the seeded sales are spread over'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Number of times each query is run; the best time is reported'
+        )
+        parser.add_argument(
+            '--cleanup',
+            action='store_true',
+            help='Delete the synthetic sales created by --seed and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            self.stdout.write(self.style.ERROR('No businesses found'))
+            return
+
+        if options['cleanup']:
+            # Raw delete: the synthetic sales have no items and never reached the rollups
+            deleted = Sale.objects.all_businesses().filter(notes=BENCHMARK_MARKER)._raw_delete(connection.alias)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} synthetic sales'))
+            return
+
+        if options['seed']:
+            self.seed(business, options['seed'], options['days'])
+
+        today = timezone.localdate()
+        month_start = today - timedelta(days=30)
+        sales = Sale.objects.for_business(business)
+        products = Product.objects.for_business(business)
+
+        cases = [
+            ("Sales today (cast)", sales.filter(sale_date__date=today)),
+            ("Sales today (range)", sales.filter(**on_day('sale_date', today))),
+            ("Sales last 30 days (cast)", sales.filter(sale_date__date__gte=month_start, sale_date__date__lte=today)),
+            ("Sales last 30 days (range)", sales.filter(**date_range_filter('sale_date', month_start, today))),
+            ("Low stock products", products.filter(is_active=True, quantity__lte=F('reorder_level'))),
+            ("Out of stock products", products.filter(is_active=True, quantity=0)),
+        ]
+
+        self.stdout.write(f'Benchmarking date filters for business: {business.company_name}')
+        self.stdout.write(f'Sales rows for this business: {sales.count()}')
+        self.stdout.write('=' * 60)
+
+        for label, queryset in cases:
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                rows = queryset.count()
+                elapsed = (time.perf_counter() - started) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{label}: {rows} rows, best of {options["repeat"]}: {best:.1f} ms'))
+            for line in queryset.order_by().only('pk').explain().splitlines():
+                self.stdout.write(f'    {line}')
+
+        self.stdout.write('=' * 60)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed!'))
+
+    def seed(self, business, count, days):
+        """Bulk insert synthetic sales; bulk_create skips signals so rollups are untouched"""
+        now = timezone.now()
+        per_day = max(1, count // days)
+        self.stdout.write(f'Seeding {count} synthetic sales over {days} days...')
+        created = 0
+        for offset in range(days):
+            size = min(per_day, count - created)
+            if size <= 0:
+                break
+            batch = []
+            for _ in range(size):
+                amount = Decimal(random.randint(100, 50000)) / 100
+                batch.append(Sale(business=business, subtotal=amount, total_amount=amount, notes=BENCHMARK_MARKER))
+            batch = Sale.objects.bulk_create(batch)
+            # sale_date is auto_now_add, so move the batch to its day afterwards
+            Sale.objects.all_businesses().filter(pk__in=[sale.pk for sale in batch]).update(
+                sale_date=now - timedelta(days=offset)
+            )
+            created += size
+        self.stdout.write(self.style.SUCCESS(f'Seeded {created} sales'))
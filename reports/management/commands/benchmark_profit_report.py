@@ -0,0 +1,59 @@
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from reports.aggregates import profit_report
+from superadmin.middleware import business_context
+from superadmin.models import Business
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the profit & loss aggregation for growing date ranges'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business to benchmark (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            nargs='+',
+            default=[7, 30, 90, 365],
+            help='Range lengths (in days) to benchmark'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            self.stdout.write(self.style.ERROR('No businesses found'))
+            return
+
+        today = timezone.now().date()
+
+        self.stdout.write(f'Benchmarking profit report for business: {business.company_name}')
+        self.stdout.write('=' * 60)
+        self.stdout.write(f'{"Days":>6} {"Queries":>8} {"Time (ms)":>10} {"Revenue":>14}')
+
+        with business_context(business):
+            for days in options['days']:
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as queries:
+                    report = profit_report(today - timedelta(days=days), today)
+                elapsed = (time.perf_counter() - started) * 1000
+                self.stdout.write(
+                    f'{days:>6} {len(queries):>8} {elapsed:>10.1f} {float(report["summary"]["revenue"]):>14.2f}'
+                )
+
+        self.stdout.write('=' * 60)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed!'))
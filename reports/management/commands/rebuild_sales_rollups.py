@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from reports.rollups import rebuild_product_rollups, rebuild_rollups
+from superadmin.models import Business
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales and product rollup tables from raw sales, refunds and expenses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, help='Only rebuild rollups of this business ID', required=False)
+        parser.add_argument('--start-date', type=str, help='First day to rebuild (YYYY-MM-DD)', required=False)
+        parser.add_argument('--end-date', type=str, help='Last day to rebuild (YYYY-MM-DD)', required=False)
+
+    def handle(self, *args, **options):
+        business = None
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+            if not business:
+                self.stdout.write(self.style.ERROR(f"Business {options['business']} does not exist"))
+                return
+
+        try:
+            start_date = self.parse_date(options.get('start_date'))
+            end_date = self.parse_date(options.get('end_date'))
+        except ValueError:
+            self.stdout.write(self.style.ERROR('Dates must use the YYYY-MM-DD format'))
+            return
+
+        rows = rebuild_rollups(business=business, start_date=start_date, end_date=end_date)
+        product_rows = rebuild_product_rollups(business=business, start_date=start_date, end_date=end_date)
+
+        scope = business.company_name if business else 'all businesses'
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rows} daily sales rollup rows and {product_rows} product rollup rows for {scope}'
+        ))
+
+    def parse_date(self, value):
+        if not value:
+            return None
+        return datetime.strptime(value, '%Y-%m-%d').date()
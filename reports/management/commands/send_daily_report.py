@@ -31,7 +31,7 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         # Check if it's 11 PM or force flag is set
-        current_time = timezone.now()
+        current_time = timezone.localtime()
         is_scheduled_time = current_time.hour == 23 and current_time.minute == 0  # 11 PM
         force_send = options.get('force', False)
         
@@ -86,26 +86,15 @@ class Command(BaseCommand):
         # Generate report for each business
         for business in businesses:
             try:
-                # Get sales data for this business
-                from sales.models import Sale
-                from django.db.models import Sum, DecimalField
+                # Get sales and expenses data for this business from the daily rollup
+                from reports.aggregates import sales_totals
+                from reports.aggregates import top_products as top_products_for
                 from decimal import Decimal
                 
-                sales = Sale.objects.filter(business=business).filter(
-                    sale_date__date__gte=start_date, 
-                    sale_date__date__lte=end_date
-                )
-                
-                total_sales = sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-                total_orders = sales.count()
-                
-                # Get expenses data for this business
-                from expenses.models import Expense
-                expenses = Expense.objects.filter(business=business).filter(
-                    date__gte=start_date, 
-                    date__lte=end_date
-                )
-                total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+                totals = sales_totals(start_date, end_date, business=business)
+                total_sales = totals['revenue']
+                total_orders = totals['orders']
+                total_expenses = totals['expenses']
                 
                 # Calculate profit
                 estimated_cogs = total_sales * Decimal('0.6')
@@ -113,14 +102,7 @@ class Command(BaseCommand):
                 net_profit = gross_profit - total_expenses
                 
                 # Get top selling products for this business
-                from sales.models import SaleItem
-                top_products = SaleItem.objects.filter(sale__business=business).filter(
-                    sale__sale_date__date__gte=start_date,
-                    sale__sale_date__date__lte=end_date
-                ).values('product__name').annotate(
-                    total_sold=Sum('quantity'),
-                    total_revenue=Sum('total_price')
-                ).order_by('-total_sold')[:5]
+                top_products = top_products_for(start_date, end_date, limit=5, business=business)
                 
                 # Generate recommendations
                 from reports.views import generate_recommendations
@@ -1,4 +1,86 @@
 from django.db import models
+from django.db.models import Q
+from superadmin.models import Business, Branch
+from superadmin.managers import BusinessSpecificManager
 
-# The reports app will primarily use views and functions rather than models
-# Most reports will be generated from existing data in other models
\ No newline at end of file
+# The reports app primarily uses views and functions rather than models.
+# The models below are pre-aggregated facts derived from sales and expenses;
+# they are maintained by reports.signals and rebuilt by management commands.
+
+class DailySalesRollup(models.Model):
+    """Per business/branch/day totals so reports scale with days, not sales"""
+    # Use business-specific manager
+    objects = BusinessSpecificManager()
+
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='daily_sales_rollups')
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='daily_sales_rollups', null=True, blank=True)
+    date = models.DateField()
+    orders = models.IntegerField(default=0)  # type: ignore
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # type: ignore
+    discount = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # type: ignore
+    cogs = models.DecimalField(max_digits=16, decimal_places=4, default=0)  # type: ignore
+    refunds = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # type: ignore
+    expenses = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # type: ignore
+    items_sold = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # type: ignore
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        indexes = [
+            models.Index(fields=['business', 'date']),
+        ]
+        constraints = [
+            # NULL branches are distinct in unique indexes, so business-wide rows need their own constraint
+            models.UniqueConstraint(
+                fields=['business', 'branch', 'date'],
+                condition=Q(branch__isnull=False),
+                name='unique_daily_sales_rollup_branch'
+            ),
+            models.UniqueConstraint(
+                fields=['business', 'date'],
+                condition=Q(branch__isnull=True),
+                name='unique_daily_sales_rollup_business'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.business.company_name} - {self.date}"
+
+
+class ProductDailyRollup(models.Model):
+    """Per business/branch/product/day sales movement for top-products and performance charts"""
+    # Use business-specific manager
+    objects = BusinessSpecificManager()
+
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='product_daily_rollups')
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='product_daily_rollups', null=True, blank=True)
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+    units_sold = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # type: ignore
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # type: ignore
+    cost = models.DecimalField(max_digits=16, decimal_places=4, default=0)  # type: ignore
+    refunds = models.DecimalField(max_digits=16, decimal_places=4, default=0)  # type: ignore
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        indexes = [
+            # Top-N lookups filter on business and date, then group by product
+            models.Index(fields=['business', 'date', 'product']),
+            models.Index(fields=['product', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['business', 'branch', 'product', 'date'],
+                condition=Q(branch__isnull=False),
+                name='unique_product_daily_rollup_branch'
+            ),
+            models.UniqueConstraint(
+                fields=['business', 'product', 'date'],
+                condition=Q(branch__isnull=True),
+                name='unique_product_daily_rollup_business'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} - {self.date}"
@@ -0,0 +1,366 @@
+"""
+Maintenance of the pre-aggregated DailySalesRollup and ProductDailyRollup tables.
+
+Writes to sales, sale items, refunds and expenses are folded into the rollups
+as atomic F() deltas (see reports.signals), and ``rebuild_rollups`` /
+``rebuild_product_rollups`` recompute the tables from the raw rows for
+backfills or to repair drift.
+
+Every ``*_contribution`` function returns ``{bucket: values}`` describing what
+one row adds to a rollup table, where ``bucket`` is the positional arguments of
+the matching ``apply_*`` function.
+"""
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from expenses.models import Expense
+from sales.models import Refund, RefundItem, Sale, SaleItem
+from utils.dates import date_range_filter
+from .aggregates import as_date, cogs_expression
+from .models import DailySalesRollup, ProductDailyRollup
+
+ROLLUP_FIELDS = ('orders', 'revenue', 'discount', 'cogs', 'refunds', 'expenses', 'items_sold')
+
+PRODUCT_ROLLUP_FIELDS = ('units_sold', 'revenue', 'cost', 'refunds')
+
+
+def local_day(value):
+    """Return the business-local calendar day of a datetime or date"""
+    if isinstance(value, datetime):
+        return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value
+
+
+def _apply(model, lookup, deltas):
+    """Atomically add ``deltas`` to the ``model`` row matching ``lookup``, creating it if needed"""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not lookup['business_id'] or lookup['date'] is None or not deltas:
+        return
+
+    rows = model.objects.all_businesses()
+    updates = {field: F(field) + value for field, value in deltas.items()}
+
+    if rows.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Another writer created the row first
+        rows.filter(**lookup).update(**updates)
+
+
+def apply_delta(business_id, branch_id, day, **deltas):
+    """Atomically add ``deltas`` to the rollup row of a business/branch/day"""
+    _apply(DailySalesRollup, {'business_id': business_id, 'branch_id': branch_id, 'date': day}, deltas)
+
+
+def apply_product_delta(business_id, branch_id, product_id, day, **deltas):
+    """Atomically add ``deltas`` to the product rollup row of a business/branch/product/day"""
+    if not product_id:
+        return
+    _apply(
+        ProductDailyRollup,
+        {'business_id': business_id, 'branch_id': branch_id, 'product_id': product_id, 'date': day},
+        deltas
+    )
+
+
+def move(old, new, apply=apply_delta):
+    """
+    Replace the ``old`` contribution ({bucket: values}) with the ``new`` one,
+    writing only the net change of every bucket. Either side may be empty.
+    """
+    deltas = defaultdict(dict)
+    for bucket, values in old.items():
+        for field, value in values.items():
+            deltas[bucket][field] = deltas[bucket].get(field, 0) - value
+    for bucket, values in new.items():
+        for field, value in values.items():
+            deltas[bucket][field] = deltas[bucket].get(field, 0) + value
+    for bucket, values in deltas.items():
+        apply(*bucket, **values)
+
+
+def _decimal(value):
+    return Decimal(str(value or 0))
+
+
+def sale_contribution(sale):
+    bucket = (sale.business_id, sale.branch_id, local_day(sale.sale_date))
+    return {bucket: {
+        'orders': 1,
+        'revenue': _decimal(sale.total_amount),
+        'discount': _decimal(sale.discount),
+    }}
+
+
+def item_unit_cost(item):
+    """The cost of one unit of a sale line, as cogs_expression computes it"""
+    if item.unit_cost is not None:
+        return _decimal(item.unit_cost)
+    return _decimal(item.product.cost_price)
+
+
+def sale_item_contribution(item):
+    sale = item.sale
+    quantity = _decimal(item.quantity)
+    values = {'items_sold': quantity, 'cogs': quantity * item_unit_cost(item)}
+    return {(sale.business_id, sale.branch_id, local_day(sale.sale_date)): values}
+
+
+def refund_contribution(refund):
+    sale = refund.sale
+    bucket = (sale.business_id, sale.branch_id, local_day(refund.refund_date))
+    return {bucket: {'refunds': _decimal(refund.refund_amount)}}
+
+
+def expense_contribution(expense):
+    return {(expense.business_id, expense.branch_id, expense.date): {'expenses': _decimal(expense.amount)}}
+
+
+def product_sale_item_contribution(item):
+    sale = item.sale
+    quantity = _decimal(item.quantity)
+    values = {'units_sold': quantity, 'revenue': _decimal(item.total_price), 'cost': quantity * item_unit_cost(item)}
+    return {(sale.business_id, sale.branch_id, item.product_id, local_day(sale.sale_date)): values}
+
+
+def refund_shares(refund_amount, lines):
+    """
+    Split a sale-level refund across its lines ``[(product_id, total_price)]``
+    in proportion to each line's value. Returns {product_id: amount}.
+    """
+    lines = list(lines)
+    line_total = sum((_decimal(total) for _, total in lines), Decimal('0'))
+    if not line_total:
+        return {}
+    shares = defaultdict(Decimal)
+    for product_id, total in lines:
+        shares[product_id] += _decimal(refund_amount) * _decimal(total) / line_total
+    return shares
+
+
+def refund_line_shares(lines):
+    """The refunded amount per product of a refund's lines ``[(product_id, amount)]``"""
+    shares = defaultdict(Decimal)
+    for product_id, amount in lines:
+        shares[product_id] += _decimal(amount)
+    return shares
+
+
+def product_refund_contribution(refund):
+    sale = refund.sale
+    day = local_day(refund.refund_date)
+    # A refund of given lines is attributed to their products, one of the whole sale is split
+    shares = refund_line_shares(
+        RefundItem.objects.all_businesses().filter(refund_id=refund.pk).values_list('product_id', 'amount')
+    )
+    if not shares:
+        lines = SaleItem.objects.all_businesses().filter(sale_id=sale.pk).values_list('product_id', 'total_price')
+        shares = refund_shares(refund.refund_amount, lines)
+    return {
+        (sale.business_id, sale.branch_id, product_id, day): {'refunds': amount}
+        for product_id, amount in shares.items()
+    }
+
+
+def _scope(business, start_date, end_date, sales, items, refunds, expenses, existing):
+    """Restrict the raw and rollup querysets of a rebuild to a business and/or date range"""
+    if business is not None:
+        sales = sales.filter(business=business)
+        items = items.filter(sale__business=business)
+        refunds = refunds.filter(sale__business=business)
+        expenses = expenses.filter(business=business)
+        existing = existing.filter(business=business)
+    sales = sales.filter(**date_range_filter('sale_date', start_date, end_date))
+    items = items.filter(**date_range_filter('sale__sale_date', start_date, end_date))
+    refunds = refunds.filter(**date_range_filter('refund_date', start_date, end_date))
+    if start_date is not None:
+        expenses = expenses.filter(date__gte=start_date)
+        existing = existing.filter(date__gte=start_date)
+    if end_date is not None:
+        expenses = expenses.filter(date__lte=end_date)
+        existing = existing.filter(date__lte=end_date)
+    return sales, items, refunds, expenses, existing
+
+
+def _querysets(business, start_date, end_date, rollup_model):
+    return _scope(
+        business, start_date, end_date,
+        Sale.objects.all_businesses().filter(business__isnull=False),
+        SaleItem.objects.all_businesses().filter(sale__business__isnull=False),
+        Refund.objects.all_businesses().filter(sale__business__isnull=False),
+        Expense.objects.all_businesses().filter(business__isnull=False),
+        rollup_model.objects.all_businesses(),
+    )
+
+
+def _replace(model, existing, key_fields, buckets, batch_size):
+    rows = [model(**dict(zip(key_fields, key)), **values) for key, values in buckets.items()]
+    with transaction.atomic():
+        existing.delete()
+        model.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def _collect(buckets, rows, key_fields, fields):
+    for row in rows:
+        bucket = buckets[tuple(row[key] for key in key_fields) + (as_date(row['day']),)]
+        for field in fields:
+            bucket[field] = bucket.get(field, 0) + (row[field] or 0)
+
+
+def rebuild_rollups(business=None, start_date=None, end_date=None, batch_size=1000):
+    """
+    Recompute daily rollup rows from raw sales, sale items, refunds and expenses.
+    Optionally limited to one business and/or an inclusive date range.
+    Returns the number of rollup rows written.
+    """
+    sales, items, refunds, expenses, existing = _querysets(business, start_date, end_date, DailySalesRollup)
+    buckets = defaultdict(dict)
+
+    _collect(
+        buckets,
+        sales.annotate(day=TruncDate('sale_date')).values('business_id', 'branch_id', 'day').annotate(
+            orders=Count('id'), revenue=Sum('total_amount'), discount=Sum('discount')
+        ).order_by(),
+        ('business_id', 'branch_id'), ('orders', 'revenue', 'discount')
+    )
+    _collect(
+        buckets,
+        items.annotate(day=TruncDate('sale__sale_date')).values('sale__business_id', 'sale__branch_id', 'day').annotate(
+            cogs=Sum(cogs_expression()), items_sold=Sum('quantity')
+        ).order_by(),
+        ('sale__business_id', 'sale__branch_id'), ('cogs', 'items_sold')
+    )
+    _collect(
+        buckets,
+        refunds.annotate(day=TruncDate('refund_date')).values('sale__business_id', 'sale__branch_id', 'day').annotate(
+            refunds=Sum('refund_amount')
+        ).order_by(),
+        ('sale__business_id', 'sale__branch_id'), ('refunds',)
+    )
+    _collect(
+        buckets,
+        expenses.annotate(day=F('date')).values('business_id', 'branch_id', 'day').annotate(
+            expenses=Sum('amount')
+        ).order_by(),
+        ('business_id', 'branch_id'), ('expenses',)
+    )
+
+    return _replace(DailySalesRollup, existing, ('business_id', 'branch_id', 'date'), buckets, batch_size)
+
+
+def rebuild_product_rollups(business=None, start_date=None, end_date=None, batch_size=1000):
+    """
+    Recompute product rollup rows from raw sale items and refunds.
+    Optionally limited to one business and/or an inclusive date range.
+    Returns the number of rollup rows written.
+    """
+    _, items, refunds, _, existing = _querysets(business, start_date, end_date, ProductDailyRollup)
+    key_fields = ('sale__business_id', 'sale__branch_id', 'product_id')
+    buckets = defaultdict(dict)
+
+    _collect(
+        buckets,
+        items.annotate(day=TruncDate('sale__sale_date')).values(*key_fields, 'day').annotate(
+            units_sold=Sum('quantity'), revenue=Sum('total_price'), cost=Sum(cogs_expression())
+        ).order_by(),
+        key_fields, ('units_sold', 'revenue', 'cost')
+    )
+
+    # Refunds without lines are recorded per sale, so they are split across the sale's lines
+    refund_rows = list(
+        refunds.annotate(day=TruncDate('refund_date')).values(
+            'id', 'sale_id', 'sale__business_id', 'sale__branch_id', 'refund_amount', 'day'
+        ).order_by()
+    )
+    refund_lines = defaultdict(list)
+    for refund_id, product_id, amount in RefundItem.objects.all_businesses().filter(
+        refund_id__in=refunds.values('id')
+    ).values_list('refund_id', 'product_id', 'amount').iterator():
+        refund_lines[refund_id].append((product_id, amount))
+    lines = defaultdict(list)
+    refunded_items = SaleItem.objects.all_businesses().filter(
+        sale_id__in=refunds.values('sale_id')
+    ).values_list('sale_id', 'product_id', 'total_price')
+    for sale_id, product_id, total_price in refunded_items.iterator():
+        lines[sale_id].append((product_id, total_price))
+
+    for row in refund_rows:
+        if row['id'] in refund_lines:
+            shares = refund_line_shares(refund_lines[row['id']])
+        else:
+            shares = refund_shares(row['refund_amount'], lines[row['sale_id']])
+        for product_id, amount in shares.items():
+            bucket = buckets[(row['sale__business_id'], row['sale__branch_id'], product_id, as_date(row['day']))]
+            bucket['refunds'] = bucket.get('refunds', 0) + amount
+
+    return _replace(
+        ProductDailyRollup, existing, ('business_id', 'branch_id', 'product_id', 'date'), buckets, batch_size
+    )
+
+
+def merge_contributions(contributions):
+    """Sum several {bucket: values} contributions into one"""
+    merged = defaultdict(dict)
+    for contribution in contributions:
+        for bucket, values in contribution.items():
+            for field, value in values.items():
+                merged[bucket][field] = merged[bucket].get(field, 0) + value
+    return merged
+
+
+def record_sale_items(items, sign=1):
+    """
+    Fold sale items written without signals (bulk_create / bulk delete) into
+    both rollup tables, issuing one write per affected bucket.
+    Pass ``sign=-1`` to remove them instead.
+    """
+    items = list(items)
+    for contribution, apply in (
+        (sale_item_contribution, apply_delta),
+        (product_sale_item_contribution, apply_product_delta),
+    ):
+        merged = merge_contributions(contribution(item) for item in items)
+        if sign < 0:
+            move(merged, {}, apply)
+        else:
+            move({}, merged, apply)
+
+
+def record_sales(sales, sign=1):
+    """
+    Fold sales written without signals (bulk_create) into the daily
+    rollups, issuing one write per affected day. Pass ``sign=-1`` to remove
+    them instead.
+    """
+    merged = merge_contributions(sale_contribution(sale) for sale in sales)
+    if sign < 0:
+        move(merged, {})
+    else:
+        move({}, merged)
+
+
+def record_refunds(refunds, sign=1):
+    """
+    Fold refunds written without signals (bulk_create, after their lines)
+    into both rollup tables. Pass ``sign=-1`` to remove them instead.
+    """
+    refunds = list(refunds)
+    for contribution, apply in (
+        (refund_contribution, apply_delta),
+        (product_refund_contribution, apply_product_delta),
+    ):
+        merged = merge_contributions(contribution(refund) for refund in refunds)
+        if sign < 0:
+            move(merged, {}, apply)
+        else:
+            move({}, merged, apply)
@@ -0,0 +1,108 @@
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete
+from django.dispatch import receiver
+from sales.models import Sale, SaleItem, Refund
+from sales.services import reversed_in_bulk
+from expenses.models import Expense
+from . import rollups
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Each tracked model maps to the (contribution, apply) pairs of the rollup tables it feeds
+TRACKED_MODELS = {
+    Sale: [
+        (rollups.sale_contribution, rollups.apply_delta),
+    ],
+    SaleItem: [
+        (rollups.sale_item_contribution, rollups.apply_delta),
+        (rollups.product_sale_item_contribution, rollups.apply_product_delta),
+    ],
+    Refund: [
+        (rollups.refund_contribution, rollups.apply_delta),
+        (rollups.product_refund_contribution, rollups.apply_product_delta),
+    ],
+    Expense: [
+        (rollups.expense_contribution, rollups.apply_delta),
+    ],
+}
+
+
+def _contributions(sender, instance):
+    return [contribution(instance) for contribution, _ in TRACKED_MODELS[sender]]
+
+
+def _move(sender, old, new):
+    for (_, apply), old_part, new_part in zip(TRACKED_MODELS[sender], old, new):
+        rollups.move(old_part, new_part, apply)
+
+
+@receiver(pre_save, sender=Sale)
+@receiver(pre_save, sender=SaleItem)
+@receiver(pre_save, sender=Refund)
+@receiver(pre_save, sender=Expense)
+def remember_rollup_contribution(sender, instance, **kwargs):
+    """
+    Store what an existing row currently contributes to the rollups,
+    so the post_save handler can apply only the difference.
+    """
+    instance._rollup_previous = None
+    if not instance.pk:
+        return
+    try:
+        previous = sender._base_manager.filter(pk=instance.pk).first()
+        if previous is not None:
+            instance._rollup_previous = _contributions(sender, previous)
+    except Exception as e:
+        logger.error(f"Error reading rollup contribution of {sender.__name__} {instance.pk}: {e}")
+
+
+@receiver(post_save, sender=Sale)
+@receiver(post_save, sender=SaleItem)
+@receiver(post_save, sender=Refund)
+@receiver(post_save, sender=Expense)
+def update_rollup_on_save(sender, instance, created, **kwargs):
+    """Fold a created or updated sale, sale item, refund or expense into the rollups"""
+    try:
+        new = _contributions(sender, instance)
+        previous = None if created else getattr(instance, '_rollup_previous', None)
+        _move(sender, previous or [{} for _ in new], new)
+    except Exception as e:
+        # The rollups can always be repaired with the rebuild_sales_rollups command
+        logger.error(f"Error updating sales rollups for {sender.__name__} {instance.pk}: {e}")
+
+
+@receiver(pre_delete, sender=Sale)
+@receiver(pre_delete, sender=SaleItem)
+@receiver(pre_delete, sender=Refund)
+@receiver(pre_delete, sender=Expense)
+def remember_deleted_contribution(sender, instance, **kwargs):
+    """
+    Capture the contribution before cascades run: a refund is split across its
+    sale's items, which may already be gone by the time post_delete fires.
+    Items of a sale deleted through sales.services.delete_sale are removed
+    from the rollups there in bulk.
+    """
+    if sender is SaleItem and reversed_in_bulk(instance):
+        instance._rollup_deleted = None
+        return
+    try:
+        instance._rollup_deleted = _contributions(sender, instance)
+    except Exception as e:
+        instance._rollup_deleted = None
+        logger.error(f"Error reading rollup contribution of deleted {sender.__name__} {instance.pk}: {e}")
+
+
+@receiver(post_delete, sender=Sale)
+@receiver(post_delete, sender=SaleItem)
+@receiver(post_delete, sender=Refund)
+@receiver(post_delete, sender=Expense)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    """Remove a deleted sale, sale item, refund or expense from the rollups"""
+    try:
+        old = getattr(instance, '_rollup_deleted', None)
+        if old is None:
+            return
+        _move(sender, old, [{} for _ in old])
+    except Exception as e:
+        logger.error(f"Error updating sales rollups for deleted {sender.__name__} {instance.pk}: {e}")
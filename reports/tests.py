@@ -1,3 +1,394 @@
+import csv
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from expenses.models import Expense, ExpenseCategory
+from products.models import Product, Category, Unit
+from sales.models import Refund, Sale, SaleItem
+from superadmin.middleware import set_current_business, clear_current_business
+from superadmin.models import Business
+from reports.aggregates import profit_by_period, profit_report, sales_totals, top_products
+from reports.models import DailySalesRollup, ProductDailyRollup
+from reports.rollups import rebuild_product_rollups, rebuild_rollups
+from utils.dates import date_range_filter, day_start, on_day
+
+User = get_user_model()
+
+
+class ReportsTestBase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(
+            company_name='Test Shop',
+            owner=self.user,
+            email='shop@example.com'
+        )
+        set_current_business(self.business)
+
+        self.category = Category.objects.create(business=self.business, name='Drinks')
+        self.unit = Unit.objects.create(business=self.business, name='Bottle', symbol='btl')
+        self.product = Product.objects.create(
+            business=self.business,
+            name='Juice',
+            sku='JUICE001',
+            category=self.category,
+            unit=self.unit,
+            cost_price=Decimal('4.00'),
+            selling_price=Decimal('10.00'),
+            quantity=10000
+        )
+        self.expense_category = ExpenseCategory.objects.create(business=self.business, name='Rent')
+        self.today = timezone.now().date()
+
+    def tearDown(self):
+        clear_current_business()
+
+    def create_sale(self, days_ago, quantity):
+        """Create a sale; back-dated sales need rebuild_rollups() before reporting"""
+        total = self.product.selling_price * quantity
+        sale = Sale.objects.create(
+            business=self.business,
+            subtotal=total,
+            total_amount=total
+        )
+        SaleItem.objects.create(
+            business=self.business,
+            sale=sale,
+            product=self.product,
+            quantity=quantity,
+            unit_price=self.product.selling_price,
+            total_price=total
+        )
+        Sale.objects.filter(pk=sale.pk).update(sale_date=timezone.now() - timedelta(days=days_ago))
+        return sale
+
+
+class ProfitAggregationTest(ReportsTestBase):
+    def test_profit_report_totals(self):
+        self.create_sale(days_ago=0, quantity=2)
+        self.create_sale(days_ago=1, quantity=3)
+        Expense.objects.create(
+            business=self.business,
+            category=self.expense_category,
+            amount=Decimal('5.00'),
+            date=self.today
+        )
+        rebuild_rollups(business=self.business)
+
+        report = profit_report(self.today - timedelta(days=1), self.today)
+        summary = report['summary']
+
+        self.assertEqual(summary['revenue'], Decimal('50.00'))
+        self.assertEqual(summary['cogs'], Decimal('20.00'))
+        self.assertEqual(summary['expenses'], Decimal('5.00'))
+        self.assertEqual(summary['gross_profit'], Decimal('30.00'))
+        self.assertEqual(summary['net_profit'], Decimal('25.00'))
+        self.assertEqual(len(report['daily']), 2)
+
+    def test_cogs_uses_cost_at_time_of_sale(self):
+        self.create_sale(days_ago=0, quantity=2)
+        Product.objects.filter(pk=self.product.pk).update(cost_price=Decimal('9.00'))
+        rebuild_rollups(business=self.business)
+
+        report = profit_report(self.today, self.today)
+
+        self.assertEqual(report['summary']['cogs'], Decimal('8.00'))
+
+    def test_lines_without_a_captured_cost_use_the_product_cost(self):
+        sale = self.create_sale(days_ago=0, quantity=2)
+        # A line recorded before costs were captured, not backfilled yet
+        SaleItem.objects.filter(sale=sale).update(unit_cost=None)
+        rebuild_rollups(business=self.business)
+        self.assertEqual(profit_report(self.today, self.today)['summary']['cogs'], Decimal('8.00'))
+
+        rebuild_product_rollups(business=self.business)
+        self.assertEqual(top_products(self.today, self.today)[0]['total_cost'], Decimal('8.00'))
+
+    def test_profit_by_period_rejects_unknown_grain(self):
+        with self.assertRaises(ValueError):
+            profit_by_period(self.today, self.today, grain='quarter')
+
+    def test_query_count_independent_of_range(self):
+        """The number of queries must not grow with the number of days or sales"""
+        for days_ago in range(0, 365, 7):
+            self.create_sale(days_ago=days_ago, quantity=1)
+        rebuild_rollups(business=self.business)
+
+        with CaptureQueriesContext(connection) as short_range:
+            profit_report(self.today - timedelta(days=7), self.today)
+        with CaptureQueriesContext(connection) as long_range:
+            report = profit_report(self.today - timedelta(days=365), self.today)
+
+        self.assertEqual(len(short_range), len(long_range))
+        self.assertEqual(report['summary']['revenue'], Decimal('10.00') * 53)
+
+    def test_profit_loss_views(self):
+        self.create_sale(days_ago=0, quantity=2)
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+
+        response = self.client.get('/reports/profit-loss/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cogs'], 8.0)
+
+        response = self.client.get('/reports/profit-loss/', {'export': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cost of Goods Sold (COGS),$8.00', b''.join(response.streaming_content).decode())
+
+
+class DailySalesRollupTest(ReportsTestBase):
+    def rollup_snapshot(self):
+        return list(
+            DailySalesRollup.objects.business_specific().order_by('date', 'branch_id').values(
+                'date', 'branch_id', 'orders', 'revenue', 'discount', 'cogs', 'refunds', 'expenses', 'items_sold'
+            )
+        )
+
+    def test_rollup_maintained_on_write(self):
+        sale = self.create_sale(days_ago=0, quantity=2)
+        expense = Expense.objects.create(
+            business=self.business,
+            category=self.expense_category,
+            amount=Decimal('5.00'),
+            date=self.today
+        )
+
+        totals = sales_totals(self.today, self.today)
+        self.assertEqual(totals['orders'], 1)
+        self.assertEqual(totals['revenue'], Decimal('20.00'))
+        self.assertEqual(totals['cogs'], Decimal('8.00'))
+        self.assertEqual(totals['items_sold'], Decimal('2.00'))
+        self.assertEqual(totals['expenses'], Decimal('5.00'))
+
+        # Moving an expense to another day moves its contribution
+        expense.date = self.today - timedelta(days=1)
+        expense.save()
+        self.assertEqual(sales_totals(self.today, self.today)['expenses'], Decimal('0'))
+
+        # Incremental maintenance must agree with a full rebuild
+        incremental = self.rollup_snapshot()
+        rebuild_rollups(business=self.business)
+        self.assertEqual(
+            [{k: v for k, v in row.items() if v} for row in incremental],
+            [{k: v for k, v in row.items() if v} for row in self.rollup_snapshot()]
+        )
+
+        sale.delete()
+        totals = sales_totals(self.today, self.today)
+        self.assertEqual(totals['orders'], 0)
+        self.assertEqual(totals['revenue'], Decimal('0'))
+        self.assertEqual(totals['cogs'], Decimal('0'))
+
+    def test_rebuild_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.create_sale(days_ago=3, quantity=1)
+        call_command('rebuild_sales_rollups', '--business', str(self.business.id), stdout=StringIO())
+
+        three_days_ago = self.today - timedelta(days=3)
+        self.assertEqual(sales_totals(three_days_ago, three_days_ago)['orders'], 1)
+        self.assertEqual(sales_totals(self.today, self.today)['orders'], 0)
+
+
+class ProductDailyRollupTest(ReportsTestBase):
+    def setUp(self):
+        super().setUp()
+        self.other_product = Product.objects.create(
+            business=self.business,
+            name='Water',
+            sku='WATER001',
+            category=self.category,
+            unit=self.unit,
+            cost_price=Decimal('1.00'),
+            selling_price=Decimal('2.00'),
+            quantity=10000
+        )
+
+    def add_item(self, sale, product, quantity):
+        total = product.selling_price * quantity
+        return SaleItem.objects.create(
+            business=self.business,
+            sale=sale,
+            product=product,
+            quantity=quantity,
+            unit_price=product.selling_price,
+            total_price=total
+        )
+
+    def product_snapshot(self):
+        return list(
+            ProductDailyRollup.objects.business_specific().order_by('date', 'product_id').values(
+                'date', 'product_id', 'units_sold', 'revenue', 'cost', 'refunds'
+            )
+        )
+
+    def test_top_products_single_query(self):
+        sale = self.create_sale(days_ago=0, quantity=2)
+        self.add_item(sale, self.other_product, 5)
+
+        with self.assertNumQueries(1):
+            by_units = top_products(self.today, self.today)
+        self.assertEqual([row['product__name'] for row in by_units], ['Water', 'Juice'])
+        self.assertEqual(by_units[0]['total_sold'], Decimal('5.00'))
+        self.assertEqual(by_units[1]['total_cost'], Decimal('8.00'))
+
+        by_revenue = top_products(self.today, self.today, limit=1, order_by='revenue')
+        self.assertEqual(len(by_revenue), 1)
+        self.assertEqual(by_revenue[0]['product__name'], 'Juice')
+        self.assertEqual(by_revenue[0]['total_revenue'], Decimal('20.00'))
+
+        with self.assertRaises(ValueError):
+            top_products(self.today, self.today, order_by='name')
+
+    def test_refunds_split_across_sale_lines(self):
+        sale = self.create_sale(days_ago=0, quantity=2)  # 20.00 of juice
+        self.add_item(sale, self.other_product, 10)  # 20.00 of water
+        Refund.objects.create(business=self.business, sale=sale, reason='Damaged', refund_amount=Decimal('10.00'))
+
+        refunds = {row['product__name']: row['total_refunds'] for row in top_products(self.today, self.today)}
+        self.assertEqual(refunds, {'Juice': Decimal('5.00'), 'Water': Decimal('5.00')})
+
+        # Incremental maintenance must agree with a full rebuild
+        incremental = self.product_snapshot()
+        rebuild_product_rollups(business=self.business)
+        self.assertEqual(incremental, self.product_snapshot())
+
+        # Deleting the sale cascades to items and refunds and empties the rollup
+        sale.delete()
+        for row in top_products(self.today, self.today):
+            self.assertEqual(row['total_sold'], Decimal('0'))
+            self.assertEqual(row['total_refunds'], Decimal('0'))
+
+    def test_inventory_report_performance_chart(self):
+        sale = self.create_sale(days_ago=0, quantity=3)
+        self.add_item(sale, self.other_product, 1)
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+
+        response = self.client.get('/reports/inventory/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.context['performance_product_names_json']), ['Juice', 'Water'])
+
+
+class DateRangeFilterTest(ReportsTestBase):
+    def test_half_open_day_boundaries(self):
+        midnight = day_start(self.today)
+        inside = self.create_sale(days_ago=0, quantity=1)
+        before = self.create_sale(days_ago=0, quantity=1)
+        after = self.create_sale(days_ago=0, quantity=1)
+        Sale.objects.filter(pk=inside.pk).update(sale_date=midnight)
+        Sale.objects.filter(pk=before.pk).update(sale_date=midnight - timedelta(microseconds=1))
+        Sale.objects.filter(pk=after.pk).update(sale_date=midnight + timedelta(days=1))
+
+        today_sales = Sale.objects.business_specific().filter(**on_day('sale_date', self.today))
+        self.assertEqual(list(today_sales.values_list('pk', flat=True)), [inside.pk])
+
+        lookups = date_range_filter('sale_date', self.today - timedelta(days=1), self.today)
+        self.assertEqual(
+            set(Sale.objects.business_specific().filter(**lookups).values_list('pk', flat=True)),
+            {inside.pk, before.pk}
+        )
+        self.assertEqual(date_range_filter('sale_date', self.today), {'sale_date__gte': midnight})
+
+
+class CsvExportTest(ReportsTestBase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+
+    def export(self, url, params=None):
+        """The rows of a streamed CSV export and the queries run while streaming it"""
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with CaptureQueriesContext(connection) as queries:
+            content = b''.join(response.streaming_content).decode()
+        return list(csv.reader(io.StringIO(content))), queries
+
+    def test_inventory_export_streams_rows_of_the_business(self):
+        Product.objects.filter(pk=self.product.pk).update(quantity=0, reorder_level=5)
+        other_user = User.objects.create_user(username='other', password='testpass123')
+        other = Business.objects.create(company_name='Other Shop', owner=other_user, email='other@example.com')
+        Product.objects.create(
+            business=other,
+            name='Other Juice',
+            sku='OTHER001',
+            category=Category.objects.create(business=other, name='Drinks'),
+            unit=Unit.objects.create(business=other, name='Bottle', symbol='btl'),
+            cost_price=Decimal('1.00'),
+            selling_price=Decimal('2.00'),
+            quantity=0
+        )
+
+        rows, queries = self.export('/reports/inventory/', {'export': 'csv'})
+
+        self.assertIn(['Juice', 'JUICE001', '0.00', '5.00', 'Drinks'], rows)
+        self.assertIn(['Juice', 'JUICE001', 'Drinks'], rows)
+        self.assertNotIn('Other Juice', [row[0] for row in rows if row])
+        # One chunked read per section while the rows stream
+        self.assertEqual(len(queries), 3)
+
+    def test_expense_export_detail_rows(self):
+        for day in range(3):
+            Expense.objects.create(
+                business=self.business,
+                category=self.expense_category,
+                description=f'Rent {day}',
+                amount=Decimal('100.00'),
+                date=self.today - timedelta(days=day)
+            )
+
+        rows, queries = self.export('/reports/expenses/', {
+            'export': 'csv',
+            'start_date': (self.today - timedelta(days=7)).isoformat(),
+            'end_date': self.today.isoformat(),
+        })
+
+        self.assertIn(['Number of Expense Entries', '3'], rows)
+        self.assertIn(['Rent', '$300.00', '3', '100.0%'], rows)
+        detail = rows.index(['Date', 'Category', 'Description', 'Amount'])
+        self.assertEqual(
+            rows[detail + 1:detail + 4],
+            [
+                [(self.today - timedelta(days=day)).isoformat(), 'Rent', f'Rent {day}', '$100.00']
+                for day in range(3)
+            ]
+        )
+        self.assertEqual(len(queries), 1)
+
+    def test_product_export_streams_all_products(self):
+        for number in range(5):
+            Product.objects.create(
+                business=self.business,
+                name=f'Soda {number}',
+                sku=f'SODA{number:03d}',
+                category=self.category,
+                unit=self.unit,
+                cost_price=Decimal('1.00'),
+                selling_price=Decimal('2.00'),
+                quantity=number
+            )
+
+        rows, queries = self.export('/products/export/')
 
-# Create your tests here.
+        self.assertEqual(rows[0][:3], ['Name', 'SKU', 'Barcode'])
+        self.assertEqual([row[0] for row in rows[1:]], ['Juice'] + [f'Soda {number}' for number in range(5)])
+        self.assertEqual(rows[1][:2], ['Juice', 'JUICE001'])
+        self.assertEqual(rows[1][3:], ['Drinks', 'Bottle', '', '4.00', '10.00', '10000.00', '0.00', ''])
+        self.assertEqual(len(queries), 1)
@@ -2,7 +2,6 @@ from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from django.db.models import Sum, F, Q, Count
 from products.models import Product
-from sales.models import Sale, SaleItem
 from expenses.models import Expense
 from customers.models import Customer
 from suppliers.models import Supplier
@@ -10,8 +9,9 @@ from datetime import datetime, timedelta
 from django.utils import timezone
 import json
 from decimal import Decimal
-import csv
-from django.http import HttpResponse
+from utils.csv_export import queryset_rows, streaming_csv_response
+from .aggregates import profit_report, sales_totals, totals_by_period
+from .aggregates import top_products as top_products_for
 
 @login_required
 def report_list(request):
@@ -19,7 +19,7 @@ def report_list(request):
 
 def get_date_ranges():
     """Get predefined date ranges for quick reporting"""
-    today = timezone.now().date()
+    today = timezone.localdate()
     
     # Daily
     daily_start = today
@@ -60,21 +60,11 @@ def quick_report(request, period):
     start_date = date_ranges[period]['start']
     end_date = date_ranges[period]['end']
     
-    # Get sales data
-    sales = Sale.objects.business_specific().filter(
-        sale_date__date__gte=start_date, 
-        sale_date__date__lte=end_date
-    )
-    
-    total_sales = sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-    total_orders = sales.count()
-    
-    # Get expenses data
-    expenses = Expense.objects.business_specific().filter(
-        date__gte=start_date, 
-        date__lte=end_date
-    )
-    total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    # Get sales and expenses data from the daily rollup
+    totals = sales_totals(start_date, end_date)
+    total_sales = totals['revenue']
+    total_orders = totals['orders']
+    total_expenses = totals['expenses']
     
     # Calculate profit
     # For simplicity, we'll use a rough estimate of COGS as 60% of sales
@@ -83,13 +73,7 @@ def quick_report(request, period):
     net_profit = gross_profit - total_expenses
     
     # Get top selling products
-    top_products = SaleItem.objects.business_specific().filter(
-        sale__sale_date__date__gte=start_date,
-        sale__sale_date__date__lte=end_date
-    ).values('product__name').annotate(
-        total_sold=Sum('quantity'),
-        total_revenue=Sum('total_price')
-    ).order_by('-total_sold')[:5]
+    top_products = top_products_for(start_date, end_date, limit=5)
     
     # Generate recommendations based on the data
     recommendations = generate_recommendations(
@@ -208,46 +192,10 @@ def generate_recommendations(period, total_sales, total_orders, total_expenses,
     
     return recommendations
 
-def export_quick_report_csv(request, period, start_date, end_date, total_sales, 
-                          total_orders, total_expenses, net_profit, top_products, recommendations):
-    """Export quick report data to CSV with recommendations"""
-    import csv
-    from django.http import HttpResponse
-    from io import StringIO
-    
-    # Create the HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="quick_{period}_report_{start_date}_to_{end_date}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write header
-    writer.writerow([f'Quick {period.capitalize()} Report', f'From {start_date} to {end_date}'])
-    writer.writerow([])
-    
-    # Write summary data
-    writer.writerow(['Summary'])
-    writer.writerow(['Metric', 'Value'])
-    writer.writerow(['Total Sales', f'${total_sales:.2f}'])
-    writer.writerow(['Total Orders', total_orders])
-    writer.writerow(['Total Expenses', f'${total_expenses:.2f}'])
-    writer.writerow(['Net Profit', f'${net_profit:.2f}'])
-    writer.writerow([])
-    
-    # Write top selling products
-    writer.writerow(['Top Selling Products'])
-    writer.writerow(['Product', 'Quantity Sold', 'Revenue'])
-    for product in top_products:
-        writer.writerow([
-            product['product__name'], 
-            product['total_sold'], 
-            f"${product['total_revenue']:.2f}"
-        ])
-    writer.writerow([])
-    
-    # Write recommendations
-    writer.writerow(['Business Recommendations'])
-    writer.writerow(['Priority', 'Category', 'Title', 'Description', 'Suggested Action'])
+def recommendation_rows(recommendations):
+    """The Business Recommendations section shared by the report exports"""
+    yield ['Business Recommendations']
+    yield ['Priority', 'Category', 'Title', 'Description', 'Suggested Action']
     for rec in recommendations:
         priority = rec.get('priority', 'medium')
         priority_label = {
@@ -257,20 +205,51 @@ def export_quick_report_csv(request, period, start_date, end_date, total_sales,
             'positive': 'POSITIVE'
         }.get(priority, 'MEDIUM')
         
-        writer.writerow([
+        yield [
             priority_label,
             rec.get('type', 'general').title(),
             rec.get('title', ''),
             rec.get('description', ''),
             rec.get('action', '')
-        ])
+        ]
+
+def export_quick_report_csv(request, period, start_date, end_date, total_sales, 
+                          total_orders, total_expenses, net_profit, top_products, recommendations):
+    """Export quick report data to CSV with recommendations"""
+    def rows():
+        # Write header
+        yield [f'Quick {period.capitalize()} Report', f'From {start_date} to {end_date}']
+        yield []
+        
+        # Write summary data
+        yield ['Summary']
+        yield ['Metric', 'Value']
+        yield ['Total Sales', f'${total_sales:.2f}']
+        yield ['Total Orders', total_orders]
+        yield ['Total Expenses', f'${total_expenses:.2f}']
+        yield ['Net Profit', f'${net_profit:.2f}']
+        yield []
+        
+        # Write top selling products
+        yield ['Top Selling Products']
+        yield ['Product', 'Quantity Sold', 'Revenue']
+        for product in top_products:
+            yield [
+                product['product__name'], 
+                product['total_sold'], 
+                f"${product['total_revenue']:.2f}"
+            ]
+        yield []
+        
+        # Write recommendations
+        yield from recommendation_rows(recommendations)
     
-    return response
+    return streaming_csv_response(rows(), f'quick_{period}_report_{start_date}_to_{end_date}.csv')
 
 @login_required
 def sales_report(request):
     # Get date range from request or use defaults
-    end_date = timezone.now().date()
+    end_date = timezone.localdate()
     start_date = end_date - timedelta(days=30)
     
     if 'start_date' in request.GET and request.GET['start_date']:
@@ -282,39 +261,24 @@ def sales_report(request):
     if 'export' in request.GET and request.GET['export'] == 'csv':
         return export_sales_report_csv_with_recommendations(request, start_date, end_date)
     
-    # Filter sales by date range and business context
-    sales = Sale.objects.business_specific().filter(sale_date__date__gte=start_date, sale_date__date__lte=end_date)
+    # Daily sales totals for the range come from the rollup table
+    daily_totals = totals_by_period(start_date, end_date, 'day')
     
     # Calculate total sales and orders
-    total_sales = sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-    total_orders = sales.count()
+    total_sales = sum((day['revenue'] for day in daily_totals.values()), Decimal('0'))
+    total_orders = sum(day['orders'] for day in daily_totals.values())
     
     # Get top selling products
-    top_products = SaleItem.objects.business_specific().filter(
-        sale__sale_date__date__gte=start_date,
-        sale__sale_date__date__lte=end_date
-    ).values('product__name').annotate(
-        total_sold=Sum('quantity'),
-        total_revenue=Sum('total_price')
-    ).order_by('-total_sold')[:10]
-    
-    # Prepare data for sales trend chart
-    sales_trend_data = sales.extra({'date': 'date(sale_date)'}).values('date').annotate(
-        total=Sum('total_amount')
-    ).order_by('date')
+    top_products = top_products_for(start_date, end_date, limit=10)
     
-    # Fix: Handle the case where item['date'] might already be a string
+    # Prepare data for sales trend chart (days with at least one sale)
     sales_trend_dates = []
     sales_trend_amounts = []
     
-    for item in sales_trend_data:
-        if isinstance(item['date'], str):
-            # Already a string, use as is
-            sales_trend_dates.append(item['date'])
-        else:
-            # Convert date object to string
-            sales_trend_dates.append(item['date'].strftime('%Y-%m-%d'))
-        sales_trend_amounts.append(float(item['total']))
+    for day, totals in daily_totals.items():
+        if totals['orders']:
+            sales_trend_dates.append(day.strftime('%Y-%m-%d'))
+            sales_trend_amounts.append(float(totals['revenue']))
     
     # Prepare data for top products chart
     product_names = [item['product__name'] for item in top_products]
@@ -350,85 +314,52 @@ def sales_report(request):
 
 def export_sales_report_csv_with_recommendations(request, start_date, end_date):
     """Export sales report data to CSV with recommendations"""
-    # Create the HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="sales_report_{start_date}_to_{end_date}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write header
-    writer.writerow(['Sales Report', f'From {start_date} to {end_date}'])
-    writer.writerow([])
-    
-    # Get sales data
-    sales = Sale.objects.business_specific().filter(sale_date__date__gte=start_date, sale_date__date__lte=end_date)
-    total_sales = sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-    total_orders = sales.count()
+    # Summaries are computed up front; only the rows below them stream
+    daily_totals = totals_by_period(start_date, end_date, 'day')
+    total_sales = sum((day['revenue'] for day in daily_totals.values()), Decimal('0'))
+    total_orders = sum(day['orders'] for day in daily_totals.values())
     
     # Get top selling products
-    top_products = SaleItem.objects.business_specific().filter(
-        sale__sale_date__date__gte=start_date,
-        sale__sale_date__date__lte=end_date
-    ).values('product__name').annotate(
-        total_sold=Sum('quantity'),
-        total_revenue=Sum('total_price')
-    ).order_by('-total_sold')[:10]
-    
-    # Write summary data
-    writer.writerow(['Summary'])
-    writer.writerow(['Metric', 'Value'])
-    writer.writerow(['Total Sales', f'${float(total_sales):.2f}'])
-    writer.writerow(['Total Orders', total_orders])
-    if total_orders > 0:
-        writer.writerow(['Average Order Value', f'${float(total_sales)/total_orders:.2f}'])
-    writer.writerow([])
-    
-    # Write sales trend data
-    sales_trend_data = sales.extra({'date': 'date(sale_date)'}).values('date').annotate(
-        total=Sum('total_amount')
-    ).order_by('date')
-    
-    writer.writerow(['Sales Trend'])
-    writer.writerow(['Date', 'Sales Amount'])
-    for item in sales_trend_data:
-        date_str = item['date'].strftime('%Y-%m-%d') if hasattr(item['date'], 'strftime') else str(item['date'])
-        writer.writerow([date_str, f"${float(item['total']):.2f}"])
-    writer.writerow([])
-    
-    # Write top selling products
-    writer.writerow(['Top Selling Products'])
-    writer.writerow(['Product', 'Quantity Sold', 'Revenue'])
-    for product in top_products:
-        writer.writerow([
-            product['product__name'], 
-            product['total_sold'], 
-            f"${float(product['total_revenue']):.2f}"
-        ])
-    writer.writerow([])
-    
-    # Generate and write recommendations
+    top_products = top_products_for(start_date, end_date, limit=10)
     recommendations = generate_sales_recommendations(float(total_sales), total_orders, top_products)
     
-    writer.writerow(['Business Recommendations'])
-    writer.writerow(['Priority', 'Category', 'Title', 'Description', 'Suggested Action'])
-    for rec in recommendations:
-        priority = rec.get('priority', 'medium')
-        priority_label = {
-            'high': 'HIGH',
-            'medium': 'MEDIUM',
-            'low': 'LOW',
-            'positive': 'POSITIVE'
-        }.get(priority, 'MEDIUM')
+    def rows():
+        # Write header
+        yield ['Sales Report', f'From {start_date} to {end_date}']
+        yield []
         
-        writer.writerow([
-            priority_label,
-            rec.get('type', 'general').title(),
-            rec.get('title', ''),
-            rec.get('description', ''),
-            rec.get('action', '')
-        ])
+        # Write summary data
+        yield ['Summary']
+        yield ['Metric', 'Value']
+        yield ['Total Sales', f'${float(total_sales):.2f}']
+        yield ['Total Orders', total_orders]
+        if total_orders > 0:
+            yield ['Average Order Value', f'${float(total_sales)/total_orders:.2f}']
+        yield []
+        
+        # Write sales trend data
+        yield ['Sales Trend']
+        yield ['Date', 'Sales Amount']
+        for day, totals in daily_totals.items():
+            if totals['orders']:
+                yield [day.strftime('%Y-%m-%d'), f"${float(totals['revenue']):.2f}"]
+        yield []
+        
+        # Write top selling products
+        yield ['Top Selling Products']
+        yield ['Product', 'Quantity Sold', 'Revenue']
+        for product in top_products:
+            yield [
+                product['product__name'], 
+                product['total_sold'], 
+                f"${float(product['total_revenue']):.2f}"
+            ]
+        yield []
+        
+        # Write recommendations
+        yield from recommendation_rows(recommendations)
     
-    return response
+    return streaming_csv_response(rows(), f'sales_report_{start_date}_to_{end_date}.csv')
 
 def generate_sales_recommendations(total_sales, total_orders, top_products):
     """Generate sales-specific recommendations"""
@@ -497,7 +428,7 @@ def inventory_report(request):
     ).order_by('name')
     
     # Get expired products
-    today = timezone.now().date()
+    today = timezone.localdate()
     expired_products = Product.objects.business_specific().filter(
         expiry_date__lt=today,
         is_active=True
@@ -518,11 +449,7 @@ def inventory_report(request):
     
     # Prepare data for product performance chart (top 10 products by sales in last 30 days)
     performance_start_date = today - timedelta(days=30)
-    performance_data = SaleItem.objects.business_specific().filter(
-        sale__sale_date__gte=performance_start_date
-    ).values('product__name').annotate(
-        total_sold=Sum('quantity')
-    ).order_by('-total_sold')[:10]
+    performance_data = top_products_for(performance_start_date, today, limit=10)
     
     performance_product_names = [item['product__name'] for item in performance_data]
     performance_product_quantities = [float(item['total_sold']) for item in performance_data]
@@ -553,79 +480,44 @@ def inventory_report(request):
     return render(request, 'reports/inventory.html', context)
 
 def export_inventory_report_csv(request):
-    # Create the HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="inventory_report.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write header
-    writer.writerow(['Inventory Report'])
-    writer.writerow([])
-    
-    # Write low stock products
-    writer.writerow(['Low Stock Products (Below Reorder Level)'])
-    writer.writerow(['Product', 'SKU', 'Current Stock', 'Reorder Level', 'Category'])
-    
-    low_stock_products = Product.objects.business_specific().filter(
-        quantity__lte=F('reorder_level'),
-        is_active=True
-    ).select_related('category')
-    
-    for product in low_stock_products:
-        writer.writerow([
-            product.name,
-            product.sku,
-            product.quantity,
-            product.reorder_level,
-            product.category.name if product.category else ''
-        ])
-    
-    writer.writerow([])
-    
-    # Write out of stock products
-    writer.writerow(['Out of Stock Products'])
-    writer.writerow(['Product', 'SKU', 'Category'])
-    
-    out_of_stock_products = Product.objects.business_specific().filter(
-        quantity=0,
-        is_active=True
-    ).select_related('category')
-    
-    for product in out_of_stock_products:
-        writer.writerow([
-            product.name,
-            product.sku,
-            product.category.name if product.category else ''
-        ])
-    
-    writer.writerow([])
-    
-    # Write expired products
-    writer.writerow(['Expired Products'])
-    writer.writerow(['Product', 'SKU', 'Expiry Date', 'Current Stock', 'Category'])
+    # Querysets are built (and so filtered by business) here, and read in chunks while streaming
+    products = Product.objects.business_specific().filter(is_active=True)
+    low_stock_products = products.filter(quantity__lte=F('reorder_level'))
+    out_of_stock_products = products.filter(quantity=0)
+    expired_products = products.filter(expiry_date__lt=timezone.localdate())
+    
+    def rows():
+        # Write header
+        yield ['Inventory Report']
+        yield []
+        
+        # Write low stock products
+        yield ['Low Stock Products (Below Reorder Level)']
+        yield ['Product', 'SKU', 'Current Stock', 'Reorder Level', 'Category']
+        yield from queryset_rows(
+            low_stock_products, 'name', 'sku', 'quantity', 'reorder_level', 'category__name'
+        )
+        yield []
+        
+        # Write out of stock products
+        yield ['Out of Stock Products']
+        yield ['Product', 'SKU', 'Category']
+        yield from queryset_rows(out_of_stock_products, 'name', 'sku', 'category__name')
+        yield []
+        
+        # Write expired products
+        yield ['Expired Products']
+        yield ['Product', 'SKU', 'Expiry Date', 'Current Stock', 'Category']
+        yield from queryset_rows(
+            expired_products, 'name', 'sku', 'expiry_date', 'quantity', 'category__name'
+        )
     
-    today = timezone.now().date()
-    expired_products = Product.objects.business_specific().filter(
-        expiry_date__lt=today,
-        is_active=True
-    ).select_related('category')
-    
-    for product in expired_products:
-        writer.writerow([
-            product.name,
-            product.sku,
-            product.expiry_date,
-            product.quantity,
-            product.category.name if product.category else ''
-        ])
-    
-    return response
+    return streaming_csv_response(rows(), 'inventory_report.csv')
 
 @login_required
 def profit_loss_report(request):
     # Get date range from request or use defaults
-    end_date = timezone.now().date()
+    end_date = timezone.localdate()
     start_date = end_date - timedelta(days=30)
     
     if 'start_date' in request.GET and request.GET['start_date']:
@@ -637,104 +529,32 @@ def profit_loss_report(request):
     if 'export' in request.GET and request.GET['export'] == 'csv':
         return export_profit_loss_report_csv_with_recommendations(request, start_date, end_date)
     
-    # Calculate sales revenue
-    sales = Sale.objects.business_specific().filter(sale_date__date__gte=start_date, sale_date__date__lte=end_date)
-    sales_revenue = sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-    
-    # Calculate cost of goods sold (COGS)
-    sale_items = SaleItem.objects.business_specific().filter(
-        sale__sale_date__date__gte=start_date,
-        sale__sale_date__date__lte=end_date
-    )
-    
-    cogs = Decimal('0')
-    for item in sale_items:
-        cogs += Decimal(str(item.product.cost_price)) * Decimal(str(item.quantity))
-    
-    # Calculate expenses
-    expenses = Expense.objects.business_specific().filter(date__gte=start_date, date__lte=end_date)
-    total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0')
-    
-    # Calculate profit metrics
-    gross_profit = sales_revenue - cogs
-    net_profit = gross_profit - total_expenses
+    # Revenue, COGS and expenses are aggregated in the database per day/month
+    report = profit_report(start_date, end_date)
+    summary = report['summary']
     
-    # Calculate profit margins
-    gross_profit_margin = (float(gross_profit) / float(sales_revenue) * 100) if float(sales_revenue) > 0 else 0
-    net_profit_margin = (float(net_profit) / float(sales_revenue) * 100) if float(sales_revenue) > 0 else 0
+    sales_revenue = summary['revenue']
+    cogs = summary['cogs']
+    total_expenses = summary['expenses']
+    gross_profit = summary['gross_profit']
+    net_profit = summary['net_profit']
+    gross_profit_margin = summary['gross_profit_margin']
+    net_profit_margin = summary['net_profit_margin']
     
-    # Prepare data for profit trend chart
-    profit_trend_data = sales.extra({'date': 'date(sale_date)'}).values('date').annotate(
-        total=Sum('total_amount')
-    ).order_by('date')
-    
-    # Fix: Handle the case where item['date'] might already be a string
-    profit_dates = []
-    profit_amounts = []
-    
-    for item in profit_trend_data:
-        if isinstance(item['date'], str):
-            # Already a string, use as is
-            profit_dates.append(item['date'])
-        else:
-            # Convert date object to string
-            profit_dates.append(item['date'].strftime('%Y-%m-%d'))
-        # Calculate daily profit (simplified)
-        daily_sales = Sale.objects.business_specific().filter(sale_date__date=item['date'])
-        daily_revenue = daily_sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-        
-        daily_items = SaleItem.objects.business_specific().filter(sale__sale_date__date=item['date'])
-        # Fix: Use Decimal for daily COGS calculation
-        daily_cogs = Decimal('0')
-        for daily_item in daily_items:
-            daily_cogs += Decimal(str(daily_item.product.cost_price)) * Decimal(str(daily_item.quantity))
-        
-        daily_profit = daily_revenue - daily_cogs
-        profit_amounts.append(float(daily_profit))
+    # Prepare data for profit trend chart (daily gross profit)
+    profit_dates = [row['period'].strftime('%Y-%m-%d') for row in report['daily']]
+    profit_amounts = [float(row['gross_profit']) for row in report['daily']]
     
     # Monthly profit summary
-    monthly_profit_summary = []
-    current_month = start_date.replace(day=1)
-    
-    while current_month <= end_date:
-        # Get last day of month
-        if current_month.month == 12:
-            next_month = current_month.replace(year=current_month.year + 1, month=1, day=1)
-        else:
-            next_month = current_month.replace(month=current_month.month + 1, day=1)
-        
-        month_end = next_month - timedelta(days=1)
-        
-        # Calculate monthly data
-        monthly_sales = Sale.objects.business_specific().filter(
-            sale_date__date__gte=current_month,
-            sale_date__date__lte=month_end
-        )
-        monthly_revenue = monthly_sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-        
-        monthly_items = SaleItem.objects.business_specific().filter(
-            sale__sale_date__date__gte=current_month,
-            sale__sale_date__date__lte=month_end
-        )
-        # Fix: Use Decimal for monthly COGS calculation
-        monthly_cogs = Decimal('0')
-        for monthly_item in monthly_items:
-            monthly_cogs += Decimal(str(monthly_item.product.cost_price)) * Decimal(str(monthly_item.quantity))
-        
-        monthly_profit = monthly_revenue - monthly_cogs
-        
-        monthly_profit_summary.append({
-            'month': current_month.strftime('%B %Y'),
-            'revenue': float(monthly_revenue),
-            'cogs': float(monthly_cogs),
-            'profit': float(monthly_profit)
-        })
-        
-        # Move to next month
-        if current_month.month == 12:
-            current_month = current_month.replace(year=current_month.year + 1, month=1, day=1)
-        else:
-            current_month = current_month.replace(month=current_month.month + 1, day=1)
+    monthly_profit_summary = [
+        {
+            'month': row['period'].strftime('%B %Y'),
+            'revenue': float(row['revenue']),
+            'cogs': float(row['cogs']),
+            'profit': float(row['gross_profit'])
+        }
+        for row in report['monthly']
+    ]
     
     # Convert to JSON for JavaScript
     profit_dates_json = json.dumps(profit_dates)
@@ -764,136 +584,58 @@ def profit_loss_report(request):
 
 def export_profit_loss_report_csv_with_recommendations(request, start_date, end_date):
     """Export profit & loss report data to CSV with recommendations"""
-    # Create the HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="profit_loss_report_{start_date}_to_{end_date}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write header
-    writer.writerow(['Profit & Loss Report', f'From {start_date} to {end_date}'])
-    writer.writerow([])
-    
-    # Calculate sales revenue
-    sales = Sale.objects.business_specific().filter(sale_date__date__gte=start_date, sale_date__date__lte=end_date)
-    sales_revenue = sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
+    # Revenue, COGS and expenses are aggregated in the database per day/month
+    report = profit_report(start_date, end_date)
+    summary = report['summary']
+    
+    sales_revenue = summary['revenue']
+    cogs = summary['cogs']
+    total_expenses = summary['expenses']
+    gross_profit = summary['gross_profit']
+    net_profit = summary['net_profit']
+    gross_profit_margin = summary['gross_profit_margin']
+    net_profit_margin = summary['net_profit_margin']
     
-    # Calculate cost of goods sold (COGS)
-    sale_items = SaleItem.objects.business_specific().filter(
-        sale__sale_date__date__gte=start_date,
-        sale__sale_date__date__lte=end_date
-    )
-    
-    cogs = Decimal('0')
-    for item in sale_items:
-        cogs += Decimal(str(item.product.cost_price)) * Decimal(str(item.quantity))
-    
-    # Calculate expenses
-    expenses = Expense.objects.business_specific().filter(date__gte=start_date, date__lte=end_date)
-    total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0')
-    
-    # Calculate profit metrics
-    gross_profit = sales_revenue - cogs
-    net_profit = gross_profit - total_expenses
-    
-    # Calculate profit margins
-    gross_profit_margin = (float(gross_profit) / float(sales_revenue) * 100) if float(sales_revenue) > 0 else 0
-    net_profit_margin = (float(net_profit) / float(sales_revenue) * 100) if float(sales_revenue) > 0 else 0
-    
-    # Write summary data
-    writer.writerow(['Financial Summary'])
-    writer.writerow(['Metric', 'Value'])
-    writer.writerow(['Sales Revenue', f'${float(sales_revenue):.2f}'])
-    writer.writerow(['Cost of Goods Sold (COGS)', f'${float(cogs):.2f}'])
-    writer.writerow(['Gross Profit', f'${float(gross_profit):.2f}'])
-    writer.writerow(['Gross Profit Margin', f'{gross_profit_margin:.2f}%'])
-    writer.writerow(['Operating Expenses', f'${float(total_expenses):.2f}'])
-    writer.writerow(['Net Profit', f'${float(net_profit):.2f}'])
-    writer.writerow(['Net Profit Margin', f'{net_profit_margin:.2f}%'])
-    writer.writerow([])
-    
-    # Write monthly profit summary
-    monthly_profit_summary = []
-    current_month = start_date.replace(day=1)
-    
-    writer.writerow(['Monthly Profit Summary'])
-    writer.writerow(['Month', 'Revenue', 'COGS', 'Gross Profit', 'Expenses', 'Net Profit'])
-    
-    while current_month <= end_date:
-        # Get last day of month
-        if current_month.month == 12:
-            next_month = current_month.replace(year=current_month.year + 1, month=1, day=1)
-        else:
-            next_month = current_month.replace(month=current_month.month + 1, day=1)
-        
-        month_end = next_month - timedelta(days=1)
-        
-        # Calculate monthly data
-        monthly_sales = Sale.objects.business_specific().filter(
-            sale_date__date__gte=current_month,
-            sale_date__date__lte=month_end
-        )
-        monthly_revenue = monthly_sales.aggregate(total=Sum('total_amount'))['total'] or Decimal('0')
-        
-        monthly_items = SaleItem.objects.business_specific().filter(
-            sale__sale_date__date__gte=current_month,
-            sale__sale_date__date__lte=month_end
-        )
-        monthly_cogs = Decimal('0')
-        for monthly_item in monthly_items:
-            monthly_cogs += Decimal(str(monthly_item.product.cost_price)) * Decimal(str(monthly_item.quantity))
-        
-        monthly_expenses = Expense.objects.business_specific().filter(
-            date__gte=current_month,
-            date__lte=month_end
-        )
-        monthly_expense_total = monthly_expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0')
-        
-        monthly_profit = monthly_revenue - monthly_cogs - monthly_expense_total
-        
-        writer.writerow([
-            current_month.strftime('%B %Y'),
-            f'${float(monthly_revenue):.2f}',
-            f'${float(monthly_cogs):.2f}',
-            f'${float(monthly_revenue - monthly_cogs):.2f}',
-            f'${float(monthly_expense_total):.2f}',
-            f'${float(monthly_profit):.2f}'
-        ])
-        
-        # Move to next month
-        if current_month.month == 12:
-            current_month = current_month.replace(year=current_month.year + 1, month=1, day=1)
-        else:
-            current_month = current_month.replace(month=current_month.month + 1, day=1)
-    
-    writer.writerow([])
-    
-    # Generate and write recommendations
     recommendations = generate_profit_loss_recommendations(
         float(sales_revenue), float(cogs), float(total_expenses), 
         float(gross_profit), float(net_profit), gross_profit_margin, net_profit_margin
     )
     
-    writer.writerow(['Business Recommendations'])
-    writer.writerow(['Priority', 'Category', 'Title', 'Description', 'Suggested Action'])
-    for rec in recommendations:
-        priority = rec.get('priority', 'medium')
-        priority_label = {
-            'high': 'HIGH',
-            'medium': 'MEDIUM',
-            'low': 'LOW',
-            'positive': 'POSITIVE'
-        }.get(priority, 'MEDIUM')
+    def rows():
+        # Write header
+        yield ['Profit & Loss Report', f'From {start_date} to {end_date}']
+        yield []
         
-        writer.writerow([
-            priority_label,
-            rec.get('type', 'general').title(),
-            rec.get('title', ''),
-            rec.get('description', ''),
-            rec.get('action', '')
-        ])
+        # Write summary data
+        yield ['Financial Summary']
+        yield ['Metric', 'Value']
+        yield ['Sales Revenue', f'${float(sales_revenue):.2f}']
+        yield ['Cost of Goods Sold (COGS)', f'${float(cogs):.2f}']
+        yield ['Gross Profit', f'${float(gross_profit):.2f}']
+        yield ['Gross Profit Margin', f'{gross_profit_margin:.2f}%']
+        yield ['Operating Expenses', f'${float(total_expenses):.2f}']
+        yield ['Net Profit', f'${float(net_profit):.2f}']
+        yield ['Net Profit Margin', f'{net_profit_margin:.2f}%']
+        yield []
+        
+        # Write monthly profit summary
+        yield ['Monthly Profit Summary']
+        yield ['Month', 'Revenue', 'COGS', 'Gross Profit', 'Expenses', 'Net Profit']
+        for row in report['monthly']:
+            yield [
+                row['period'].strftime('%B %Y'),
+                f"${float(row['revenue']):.2f}",
+                f"${float(row['cogs']):.2f}",
+                f"${float(row['gross_profit']):.2f}",
+                f"${float(row['expenses']):.2f}",
+                f"${float(row['net_profit']):.2f}"
+            ]
+        yield []
+        
+        # Write recommendations
+        yield from recommendation_rows(recommendations)
     
-    return response
+    return streaming_csv_response(rows(), f'profit_loss_report_{start_date}_to_{end_date}.csv')
 
 def generate_profit_loss_recommendations(sales_revenue, cogs, total_expenses, gross_profit, net_profit, gross_margin, net_margin):
     """Generate profit & loss specific recommendations"""
@@ -958,7 +700,7 @@ def generate_profit_loss_recommendations(sales_revenue, cogs, total_expenses, gr
 @login_required
 def expenses_report(request):
     # Get date range from request or use defaults
-    end_date = timezone.now().date()
+    end_date = timezone.localdate()
     start_date = end_date - timedelta(days=30)
     
     if 'start_date' in request.GET and request.GET['start_date']:
@@ -1030,83 +772,63 @@ def expenses_report(request):
 
 def export_expenses_report_csv_with_recommendations(request, start_date, end_date):
     """Export expenses report data to CSV with recommendations"""
-    # Create the HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="expenses_report_{start_date}_to_{end_date}.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write header
-    writer.writerow(['Expense Report', f'From {start_date} to {end_date}'])
-    writer.writerow([])
-    
     # Get expenses data
     expenses = Expense.objects.business_specific().filter(date__gte=start_date, date__lte=end_date)
-    total_expenses = expenses.aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    totals = expenses.aggregate(total=Sum('amount'), count=Count('id'))
+    total_expenses = totals['total'] or Decimal('0')
+    expense_count = totals['count']
     
     # Group expenses by category
-    expense_by_category = expenses.values('category__name').annotate(
+    expense_by_category = list(expenses.values('category__name').annotate(
         total=Sum('amount'),
         count=Count('id')
-    ).order_by('-total')
+    ).order_by('-total'))
+    recommendations = generate_expense_recommendations(float(total_expenses), expense_by_category, expense_count)
     
-    # Write summary data
-    writer.writerow(['Summary'])
-    writer.writerow(['Metric', 'Value'])
-    writer.writerow(['Total Expenses', f'${float(total_expenses):.2f}'])
-    writer.writerow(['Number of Expense Entries', expenses.count()])
-    writer.writerow([])
-    
-    # Write expenses by category
-    writer.writerow(['Expenses by Category'])
-    writer.writerow(['Category', 'Total Amount', 'Number of Expenses', 'Percentage of Total'])
-    for category in expense_by_category:
-        percentage = (float(category['total']) / float(total_expenses) * 100) if float(total_expenses) > 0 else 0
-        writer.writerow([
-            category['category__name'] or 'Uncategorized',
-            f"${float(category['total']):.2f}",
-            category['count'],
-            f"{percentage:.1f}%"
-        ])
-    writer.writerow([])
-    
-    # Write detailed expenses
-    writer.writerow(['Detailed Expenses'])
-    writer.writerow(['Date', 'Category', 'Description', 'Amount'])
-    
-    detailed_expenses = expenses.order_by('-date')
-    for expense in detailed_expenses:
-        writer.writerow([
-            expense.date.strftime('%Y-%m-%d') if expense.date else '',
-            expense.category.name if expense.category else 'Uncategorized',
-            expense.description,
-            f"${float(expense.amount):.2f}"
-        ])
-    writer.writerow([])
-    
-    # Generate and write recommendations
-    recommendations = generate_expense_recommendations(float(total_expenses), expense_by_category, expenses.count())
-    
-    writer.writerow(['Business Recommendations'])
-    writer.writerow(['Priority', 'Category', 'Title', 'Description', 'Suggested Action'])
-    for rec in recommendations:
-        priority = rec.get('priority', 'medium')
-        priority_label = {
-            'high': 'HIGH',
-            'medium': 'MEDIUM',
-            'low': 'LOW',
-            'positive': 'POSITIVE'
-        }.get(priority, 'MEDIUM')
+    def rows():
+        # Write header
+        yield ['Expense Report', f'From {start_date} to {end_date}']
+        yield []
         
-        writer.writerow([
-            priority_label,
-            rec.get('type', 'general').title(),
-            rec.get('title', ''),
-            rec.get('description', ''),
-            rec.get('action', '')
-        ])
+        # Write summary data
+        yield ['Summary']
+        yield ['Metric', 'Value']
+        yield ['Total Expenses', f'${float(total_expenses):.2f}']
+        yield ['Number of Expense Entries', expense_count]
+        yield []
+        
+        # Write expenses by category
+        yield ['Expenses by Category']
+        yield ['Category', 'Total Amount', 'Number of Expenses', 'Percentage of Total']
+        for category in expense_by_category:
+            percentage = (float(category['total']) / float(total_expenses) * 100) if float(total_expenses) > 0 else 0
+            yield [
+                category['category__name'] or 'Uncategorized',
+                f"${float(category['total']):.2f}",
+                category['count'],
+                f"{percentage:.1f}%"
+            ]
+        yield []
+        
+        # Write detailed expenses, read from the database in chunks
+        yield ['Detailed Expenses']
+        yield ['Date', 'Category', 'Description', 'Amount']
+        detailed_expenses = queryset_rows(
+            expenses.order_by('-date', '-id'), 'date', 'category__name', 'description', 'amount'
+        )
+        for date, category_name, description, amount in detailed_expenses:
+            yield [
+                date.strftime('%Y-%m-%d') if date else '',
+                category_name or 'Uncategorized',
+                description,
+                f"${float(amount):.2f}"
+            ]
+        yield []
+        
+        # Write recommendations
+        yield from recommendation_rows(recommendations)
     
-    return response
+    return streaming_csv_response(rows(), f'expenses_report_{start_date}_to_{end_date}.csv')
 
 def generate_expense_recommendations(total_expenses, expense_by_category, expense_count):
     """Generate expense-specific recommendations"""
@@ -0,0 +1,244 @@
+"""
+Pluggable storage of the server-side carts of cart.js.
+
+CART_STORE_BACKEND names where a cart is kept ('session' by default):
+
+- SessionCartStore keeps it in the session, expiring with it.
+- CacheCartStore keeps it in the cache under one key per business and user
+  (or session), expiring CART_TIMEOUT seconds after its last change. It
+  needs a cache every worker shares (Redis, the database cache): with a
+  per-process cache a cart filled through one worker is empty on the next,
+  so the app refuses to start with it on one.
+- DatabaseCartStore keeps the Cart and CartItem rows used before; the carts
+  left behind are deleted by the prune_carts command.
+
+With the cache and session stores a cart only reaches the database when it
+is checked out, as the sale. They key the lines by product, so the ``id`` of
+a line is its product id there and its CartItem id in the database store.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from utils.cache import is_shared_cache
+from .models import Cart, CartItem
+
+# Where carts are kept: 'session', 'cache' or 'db'
+CART_STORE_BACKEND = getattr(settings, 'CART_STORE_BACKEND', 'session')
+# Seconds a cart is kept after its last change
+CART_TIMEOUT = getattr(settings, 'CART_TIMEOUT', 86400)
+
+
+def cart_line(item_id, product_id, product_name, quantity, unit_price):
+    quantity = Decimal(str(quantity))
+    unit_price = Decimal(str(unit_price))
+    return {
+        'id': item_id,
+        'product_id': product_id,
+        'product_name': product_name,
+        'quantity': quantity,
+        'unit_price': unit_price,
+        'total_price': quantity * unit_price,
+    }
+
+
+def cart_owner(request):
+    """The user, or the session of an anonymous visitor, a cart belongs to"""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    if not request.session.session_key:
+        request.session.create()
+    return f'session:{request.session.session_key}'
+
+
+class _DictCartStore:
+    """A cart kept as a dict of lines keyed by product id"""
+
+    def __init__(self, request, business):
+        self.request = request
+        self.business = business
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self.load()
+        return self._entries
+
+    def _line(self, entry):
+        return cart_line(entry['product_id'], **entry)
+
+    def lines(self):
+        return [self._line(entry) for entry in self.entries.values()]
+
+    def get(self, item_id):
+        entry = self.entries.get(str(item_id))
+        return self._line(entry) if entry else None
+
+    def find(self, product_id):
+        return self.get(product_id)
+
+    def put(self, product, quantity):
+        """Set the quantity of ``product``, priced at its selling price when first added"""
+        entry = self.entries.setdefault(str(product.pk), {
+            'product_id': product.pk,
+            'product_name': product.name,
+            'unit_price': str(product.selling_price),
+        })
+        entry['quantity'] = str(quantity)
+        self.save()
+        return self._line(entry)
+
+    def set_quantity(self, item_id, quantity):
+        entry = self.entries.get(str(item_id))
+        if entry is None:
+            return None
+        entry['quantity'] = str(quantity)
+        self.save()
+        return self._line(entry)
+
+    def remove(self, item_id):
+        if self.entries.pop(str(item_id), None) is None:
+            return False
+        self.save()
+        return True
+
+    def clear(self):
+        self._entries = {}
+        self.save()
+
+
+class CacheCartStore(_DictCartStore):
+    name = 'cache'
+
+    @property
+    def key(self):
+        return f'sales:cart:{self.business.pk}:{cart_owner(self.request)}'
+
+    def load(self):
+        return cache.get(self.key) or {}
+
+    def save(self):
+        if self._entries:
+            cache.set(self.key, self._entries, CART_TIMEOUT)
+        else:
+            cache.delete(self.key)
+
+
+class SessionCartStore(_DictCartStore):
+    name = 'session'
+
+    def load(self):
+        return dict(self.request.session.get('carts', {}).get(str(self.business.pk), {}))
+
+    def save(self):
+        carts = self.request.session.get('carts', {})
+        if self._entries:
+            carts[str(self.business.pk)] = self._entries
+        else:
+            carts.pop(str(self.business.pk), None)
+        self.request.session['carts'] = carts
+
+
+class DatabaseCartStore:
+    """The Cart and CartItem rows, one cart per business and user or session"""
+
+    name = 'db'
+
+    def __init__(self, request, business):
+        self.request = request
+        self.business = business
+        self._cart = None
+
+    @property
+    def cart(self):
+        if self._cart is None:
+            session = self.request.session
+            if not session.session_key:
+                session.create()
+            if self.request.user.is_authenticated:
+                owner = {'user': self.request.user}
+            else:
+                owner = {'user': None, 'session_key': session.session_key}
+            carts = Cart.objects.for_business(self.business).filter(**owner)
+            self._cart = carts.order_by('-created_at').first() or Cart.objects.create(
+                business=self.business, **{'session_key': session.session_key, **owner}
+            )
+        return self._cart
+
+    def _items(self):
+        return CartItem.objects.filter(cart=self.cart).select_related('product')
+
+    def _line(self, item):
+        return cart_line(item.pk, item.product_id, item.product.name, item.quantity, item.unit_price)
+
+    def lines(self):
+        return [self._line(item) for item in self._items().order_by('pk')]
+
+    def get(self, item_id):
+        item = self._items().filter(pk=item_id).first()
+        return self._line(item) if item else None
+
+    def find(self, product_id):
+        item = self._items().filter(product_id=product_id).first()
+        return self._line(item) if item else None
+
+    def put(self, product, quantity):
+        item, _ = CartItem.objects.update_or_create(
+            cart=self.cart,
+            product=product,
+            defaults={'quantity': quantity},
+            create_defaults={'quantity': quantity, 'unit_price': product.selling_price, 'business': self.business},
+        )
+        return self._line(item)
+
+    def set_quantity(self, item_id, quantity):
+        if not CartItem.objects.filter(cart=self.cart, pk=item_id).update(quantity=quantity, updated_at=timezone.now()):
+            return None
+        return self.get(item_id)
+
+    def remove(self, item_id):
+        deleted, _ = CartItem.objects.filter(cart=self.cart, pk=item_id).delete()
+        return deleted > 0
+
+    def clear(self):
+        CartItem.objects.filter(cart=self.cart).delete()
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (CacheCartStore, SessionCartStore, DatabaseCartStore)
+}
+
+
+def check_cart_store():
+    """Raise ImproperlyConfigured for a CART_STORE_BACKEND this deployment cannot serve"""
+    if CART_STORE_BACKEND not in BACKENDS:
+        raise ImproperlyConfigured(
+            f'Unknown CART_STORE_BACKEND {CART_STORE_BACKEND!r}; choose one of {", ".join(BACKENDS)}'
+        )
+    if CART_STORE_BACKEND == CacheCartStore.name and not is_shared_cache():
+        raise ImproperlyConfigured(
+            "CART_STORE_BACKEND = 'cache' needs a cache shared by every worker (Redis or the database cache); "
+            "the default cache is local to each process. Use 'session' or 'db' instead."
+        )
+
+
+def get_cart_store(request, business):
+    """The cart of the request's user or session in ``business``"""
+    return BACKENDS[CART_STORE_BACKEND](request, business)
+
+
+def prune_carts(timeout=None):
+    """Delete the database carts unchanged for ``timeout`` seconds; returns how many were deleted"""
+    cutoff = timezone.now() - timedelta(seconds=CART_TIMEOUT if timeout is None else timeout)
+    stale = list(
+        Cart.objects.all_businesses().filter(updated_at__lt=cutoff)
+        .exclude(cartitem__updated_at__gte=cutoff).values_list('pk', flat=True)
+    )
+    Cart.objects.all_businesses().filter(pk__in=stale).delete()
+    return len(stale)
@@ -0,0 +1,132 @@
+"""
+Idempotency keys of the POS checkouts.
+
+A till generates a key for every sale and sends it with each attempt, in
+the ``Idempotency-Key`` header or as ``idempotency_key`` in the body, so it
+can retry with short timeouts without recording the sale twice. The key is
+claimed as an OfflineSale row inside the checkout's transaction, so online
+and offline sales share one set of keys per business: a retry through the
+checkout views or the offline sync finds the sale recorded the first time
+and gets its original response back.
+
+Two requests racing with one key are serialized by the unique
+(business, idempotency_key) index: the second waits for the first to commit
+and then replays its sale. A checkout that fails rolls its claim back, so
+the key can be retried. Keys of recorded sales are kept for
+IDEMPOTENCY_KEY_RETENTION_DAYS; a till must not retry a sale after that.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .offline import IDEMPOTENCY_KEY_MAX_LENGTH
+from .offline_models import OfflineSale
+from .services import CheckoutError, checkout
+
+# Days the keys of recorded sales are kept to detect retries
+IDEMPOTENCY_KEY_RETENTION_DAYS = getattr(settings, 'IDEMPOTENCY_KEY_RETENTION_DAYS', 30)
+
+
+class IdempotencyKeyError(Exception):
+    """The idempotency key sent with a request is not usable"""
+
+
+def request_idempotency_key(request, data=None):
+    """The idempotency key of a request, from its header or its JSON ``data``; None without one"""
+    key = request.headers.get('Idempotency-Key')
+    if not key and isinstance(data, dict):
+        key = data.get('idempotency_key')
+    if key is None or key == '':
+        return None
+    if not isinstance(key, str) or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise IdempotencyKeyError(f'The idempotency key must be a string of at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters')
+    return key
+
+
+def _replayed_sale(offline_sale):
+    """The sale recorded under a claimed key, or None when it still has to be recorded"""
+    if offline_sale.status == 'rejected':
+        raise CheckoutError(offline_sale.error_message)
+    if offline_sale.status != 'synced':
+        return None
+    if offline_sale.sale_id is None:
+        raise CheckoutError('The sale recorded with this idempotency key has been deleted.')
+    return offline_sale.sale
+
+
+def recorded_sale(business, key):
+    """
+    The sale already recorded under ``key``, or None. Raises CheckoutError
+    when the key belongs to a sale that was rejected or deleted.
+    """
+    if not key:
+        return None
+    offline_sale = OfflineSale.objects.for_business(business).filter(idempotency_key=key).first()
+    return _replayed_sale(offline_sale) if offline_sale else None
+
+
+def checkout_once(business, key, lines, cart_items, **kwargs):
+    """
+    ``checkout`` recorded at most once per ``key``; ``cart_items`` is what
+    the till sent, kept with the key. Returns the sale and whether it was
+    recorded before, by an earlier request or an offline sync.
+    """
+    if not key:
+        return checkout(business, lines, **kwargs), False
+
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                claim = OfflineSale.objects.create(
+                    business=business,
+                    idempotency_key=key,
+                    sold_at=timezone.now(),
+                    cart_items=cart_items,
+                    subtotal=0,
+                    total_amount=0,
+                )
+        except IntegrityError:
+            # Claimed before; a request still recording it holds the row until it commits
+            claim = OfflineSale.objects.for_business(business).select_for_update().get(idempotency_key=key)
+            sale = _replayed_sale(claim)
+            if sale is not None:
+                return sale, True
+            # Queued by an offline sync that has not recorded it: record it now
+
+        sale = checkout(business, lines, **kwargs)
+        claim.sale = sale
+        claim.status = 'synced'
+        claim.synced_at = timezone.now()
+        claim.error_message = None
+        claim.customer_id = sale.customer_id
+        claim.payment_method = sale.payment_method
+        claim.discount = sale.discount
+        claim.tax = sale.tax
+        claim.subtotal = sale.subtotal
+        claim.total_amount = sale.total_amount
+        claim.save()
+    return sale, False
+
+
+def processed_sale_response(sale, replayed=False):
+    """The response of a processed sale, the same for every retry of it"""
+    response = JsonResponse({
+        'success': True,
+        'sale_id': sale.pk,
+        'message': 'Sale processed successfully!'
+    })
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def prune_idempotency_keys(days=None):
+    """Delete the keys of sales recorded more than ``days`` ago; returns how many were deleted"""
+    days = IDEMPOTENCY_KEY_RETENTION_DAYS if days is None else days
+    deleted, _ = OfflineSale.objects.all_businesses().filter(
+        status='synced', synced_at__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    return deleted
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from products.models import Product
+from sales.models import SaleItem
+
+
+class Command(BaseCommand):
+    help = 'Backfill the unit cost snapshot on sale items that were recorded before it existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of sale items updated per transaction')
+        parser.add_argument('--business', type=int, help='Only backfill sale items of this business ID', required=False)
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many sale items would be updated')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            self.stdout.write(self.style.ERROR('--chunk-size must be a positive number'))
+            return
+
+        pending = SaleItem.objects.all_businesses().filter(unit_cost__isnull=True)
+        if options.get('business'):
+            pending = pending.filter(business_id=options['business'])
+
+        if options['dry_run']:
+            self.stdout.write(f'{pending.count()} sale items are missing a unit cost')
+            return
+
+        # Current product cost is the best estimate available for historical lines
+        current_cost = Subquery(
+            Product.objects.all_businesses().filter(pk=OuterRef('product_id')).values('cost_price')[:1]
+        )
+
+        total_updated = 0
+        last_pk = 0
+        while True:
+            # Walk the primary key index so each chunk is a cheap range scan
+            chunk = list(
+                pending.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not chunk:
+                break
+
+            with transaction.atomic():
+                total_updated += SaleItem.objects.all_businesses().filter(
+                    pk__in=chunk, unit_cost__isnull=True
+                ).update(unit_cost=current_cost)
+
+            last_pk = chunk[-1]
+            self.stdout.write(f'Updated {total_updated} sale items (up to ID {last_pk})')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled unit cost on {total_updated} sale items'))
@@ -0,0 +1,137 @@
+import json
+import time
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+
+from products.models import Product
+from sales import cart_store, cart_views
+from sales.models import Cart
+from superadmin.middleware import business_context
+from superadmin.models import Business
+from utils.cache import is_shared_cache
+
+
+class Command(BaseCommand):
+    help = 'Compare cart operations per second through the cart views with each cart store'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--business',
+            type=int,
+            help='ID of the business to benchmark (defaults to the first business)',
+            required=False
+        )
+        parser.add_argument(
+            '--products',
+            type=int,
+            default=20,
+            help='Products added to the cart per round'
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=10,
+            help='Rounds of adding, updating, reading and removing every product per run'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of runs per store; the best run is reported'
+        )
+
+    def handle(self, *args, **options):
+        if options.get('business'):
+            business = Business.objects.filter(id=options['business']).first()
+        else:
+            business = Business.objects.first()
+
+        if not business:
+            self.stdout.write(self.style.ERROR('No businesses found'))
+            return
+
+        products = list(
+            Product.objects.for_business(business).filter(is_active=True, quantity__gte=2)
+            .values_list('pk', flat=True).order_by('pk')[:options['products']]
+        )
+        if not products:
+            self.stdout.write(self.style.ERROR(
+                'The business has no products in stock; seed some with benchmark_product_search --seed'
+            ))
+            return
+
+        factory = RequestFactory()
+        user = business.owner
+
+        def call(view, session, data=None):
+            if data is None:
+                request = factory.get('/')
+            else:
+                request = factory.post('/', data=json.dumps(data), content_type='application/json')
+            request.user = user
+            request.session = session
+            request.business = business
+            response = view(request)
+            if response.status_code != 200:
+                raise CommandError(f'{view.__name__} failed: {response.content.decode()}')
+            return json.loads(response.content)
+
+        def run(session):
+            # Four cart operations per product, as cart.js sends them
+            for _ in range(options['rounds']):
+                for product_id in products:
+                    item = call(cart_views.add_to_cart, session, {'product_id': product_id, 'quantity': 1})['item']
+                    call(cart_views.update_cart_item, session, {'item_id': item['id'], 'quantity': 2})
+                    call(cart_views.get_cart, session)
+                    call(cart_views.remove_from_cart, session, {'item_id': item['id']})
+
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        operations = options['rounds'] * len(products) * 4
+        self.stdout.write(f'Benchmarking cart stores for business: {business.company_name}')
+        self.stdout.write(f'{len(products)} products, {operations} cart operations per run')
+        self.stdout.write('=' * 60)
+        if not is_shared_cache():
+            self.stdout.write(self.style.WARNING(
+                'The default cache is local to this process: the cache store is measured here, '
+                'but cannot be used with several workers'
+            ))
+
+        original_backend = cart_store.CART_STORE_BACKEND
+        own_carts = list(Cart.objects.for_business(business).filter(user=user).values_list('pk', flat=True))
+        try:
+            with business_context(business):
+                for name in cart_store.BACKENDS:
+                    cart_store.CART_STORE_BACKEND = name
+                    session = SessionStore()
+                    session.create()
+                    best = None
+                    for _ in range(options['repeat']):
+                        queries = 0
+                        with connection.execute_wrapper(count_query):
+                            started = time.perf_counter()
+                            run(session)
+                            elapsed = time.perf_counter() - started
+                        best = elapsed if best is None else min(best, elapsed)
+                    session.delete()
+
+                    self.stdout.write(self.style.MIGRATE_HEADING(
+                        f'{name}: {operations / best:,.0f} operations/s '
+                        f'({best / operations * 1000:.3f} ms per operation, '
+                        f'{queries / operations:.2f} queries per operation)'
+                    ))
+        finally:
+            cart_store.CART_STORE_BACKEND = original_backend
+            # The cart the database store created for the benchmark
+            Cart.objects.for_business(business).filter(user=user).exclude(pk__in=own_carts).delete()
+
+        self.stdout.write('=' * 60)
+        self.stdout.write(self.style.SUCCESS('Benchmark completed!'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from sales.cart_store import CART_TIMEOUT, prune_carts
+
+
+class Command(BaseCommand):
+    help = 'Delete the database carts (CART_STORE_BACKEND = "db") left unchanged longer than the cart timeout'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=float,
+            help=f'Hours a cart is kept after its last change (defaults to CART_TIMEOUT, {CART_TIMEOUT / 3600:g} hours)'
+        )
+
+    def handle(self, *args, **options):
+        timeout = options['hours'] * 3600 if options['hours'] is not None else None
+        deleted = prune_carts(timeout)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} carts'))
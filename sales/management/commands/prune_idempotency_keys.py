@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from sales.idempotency import IDEMPOTENCY_KEY_RETENTION_DAYS, prune_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete the idempotency keys of POS sales recorded longer ago than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            help=f'Days to keep the keys (defaults to IDEMPOTENCY_KEY_RETENTION_DAYS, {IDEMPOTENCY_KEY_RETENTION_DAYS})'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_idempotency_keys(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys'))
@@ -77,6 +77,11 @@ class Sale(models.Model):
     
     class Meta:
         ordering = ['-sale_date']
+        indexes = [
+            # Date range filters are always scoped to a business (and often a branch)
+            models.Index(fields=['business', 'sale_date']),
+            models.Index(fields=['business', 'branch', 'sale_date']),
+        ]
     
     def __str__(self):
         return f"Sale #{self.id} - {self.total_amount}"
@@ -93,11 +98,24 @@ class SaleItem(models.Model):
     quantity = models.DecimalField(max_digits=10, decimal_places=2)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Unit cost of the product at the time of sale, used for COGS in reports
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'product']),
+        ]
+    
     def __str__(self):
         return f"{self.product.name} - {self.quantity}"
+    
+    def save(self, *args, **kwargs):
+        # Snapshot the product cost so later price changes don't alter COGS
+        if self.unit_cost is None and self.product_id:
+            self.unit_cost = self.product.cost_price
+        super().save(*args, **kwargs)
 
 class Refund(models.Model):
     objects = BusinessSpecificManager()
@@ -114,4 +132,23 @@ class Refund(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f"Refund for Sale #{self.sale.id}"
\ No newline at end of file
+        return f"Refund for Sale #{self.sale.id}"
+
+class RefundItem(models.Model):
+    """The quantity of one sale line returned with a refund, and its share of the refund amount"""
+    objects = BusinessSpecificManager()
+    # Add business relationship for multi-tenancy
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='refund_items', null=True)
+
+    refund = models.ForeignKey(Refund, on_delete=models.CASCADE, related_name='items')
+    sale_item = models.ForeignKey(SaleItem, on_delete=models.CASCADE, related_name='refund_items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} refunded"
+
+# Registers the offline sale models with the sales app
+from .offline_models import OfflineSale, OfflineSettings  # noqa: E402,F401
@@ -0,0 +1,258 @@
+"""
+Replay of sales recorded by tills while they were offline.
+
+A till that cannot reach the server queues its sales, each with an
+idempotency key it generated, and sends them in batches once it is back
+online. ``sync_offline_sales`` stages every sale of a batch as an
+OfflineSale (a key already staged is not staged again) and replays the ones
+not synced yet through the checkout rules, in bulk:
+
+- one transaction per batch, locking the products of all its sales once
+- stock checked sale by sale in the order the till recorded them; a sale
+  that cannot be recorded is marked failed with the reason, the rest go
+  through
+- a sale with invalid data (cart, discount, tax) is rejected when staged
+  and never replayed, as its key can only ever carry that data
+- one stock UPDATE for the batch (one row per product), and the sales,
+  their lines and the rollups written in bulk
+
+A failed sale stays queued on the till, which sends its key again with
+every sync until it is recorded, for example once the stock was corrected;
+a synced one is only reported back.
+"""
+from decimal import Decimal
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from customers.models import Customer
+from dashboard.stats import invalidate_dashboard_stats
+from products.barcode_index import refresh_products_on_commit
+from products.catalog import bump_catalog_version
+from reports.rollups import record_sale_items, record_sales
+from .models import Sale, SaleItem
+from .offline_models import OfflineSale, OfflineSettings
+from .services import (
+    CheckoutError, InsufficientStockError, ProductNotFoundError, _decimal, lock_products, notify_low_stock,
+    prepare_lines, sale_items, sale_totals, stock_by_product, take_stock,
+)
+
+logger = logging.getLogger(__name__)
+
+# Sales one sync request may carry
+OFFLINE_SYNC_MAX_BATCH = getattr(settings, 'OFFLINE_SYNC_MAX_BATCH', 500)
+# Seconds between syncs when the business has no OfflineSettings
+DEFAULT_SYNC_INTERVAL = 300
+
+IDEMPOTENCY_KEY_MAX_LENGTH = OfflineSale._meta.get_field('idempotency_key').max_length
+# Statuses of staged sales that are (re)played
+REPLAYABLE = ('pending', 'failed')
+
+
+class OfflineSyncError(Exception):
+    """The batch as a whole is malformed; nothing was staged"""
+
+
+def _lines(cart_items):
+    """Checkout lines of the ``cart_items`` the POS sends"""
+    if not isinstance(cart_items, list):
+        raise CheckoutError('Invalid cart data.')
+    try:
+        return prepare_lines(
+            {'product_id': item['id'], 'quantity': item['quantity'], 'unit_price': item['price']}
+            for item in cart_items
+        )
+    except (KeyError, TypeError):
+        raise CheckoutError('Invalid cart data.')
+
+
+def _sold_at(value):
+    sold_at = parse_datetime(value) if isinstance(value, str) else None
+    if sold_at is not None and timezone.is_naive(sold_at):
+        sold_at = timezone.make_aware(sold_at)
+    return sold_at
+
+
+def _offline_sale(business, key, entry):
+    """An unsaved OfflineSale of a queued sale; rejected if its data is invalid"""
+    offline_sale = OfflineSale(
+        business=business,
+        idempotency_key=key,
+        sold_at=_sold_at(entry.get('created_at')),
+        customer_id=entry.get('customer_id') if str(entry.get('customer_id') or '').isdigit() else None,
+        payment_method=str(entry.get('payment_method') or 'cash')[:20],
+        cart_items=entry.get('cart_items'),
+        subtotal=Decimal('0'),
+        total_amount=Decimal('0'),
+    )
+    try:
+        offline_sale.discount = _decimal(entry.get('discount') or 0, 'discount')
+        offline_sale.tax = _decimal(entry.get('tax') or 0, 'tax')
+        offline_sale.subtotal, offline_sale.total_amount = sale_totals(
+            _lines(offline_sale.cart_items), offline_sale.discount, offline_sale.tax
+        )
+    except CheckoutError as e:
+        offline_sale.discount = offline_sale.tax = Decimal('0')
+        offline_sale.status = 'rejected'
+        offline_sale.error_message = str(e)
+    return offline_sale
+
+
+def stage_offline_sales(business, sales):
+    """
+    Store the queued ``sales`` of a batch as OfflineSales, skipping keys
+    staged before. Returns the OfflineSales of the batch in its order.
+    Raises OfflineSyncError for a malformed batch.
+    """
+    if not isinstance(sales, list) or not sales:
+        raise OfflineSyncError('sales must be a non-empty list')
+    if len(sales) > OFFLINE_SYNC_MAX_BATCH:
+        raise OfflineSyncError(f'At most {OFFLINE_SYNC_MAX_BATCH} sales can be synced at once')
+
+    batch = {}
+    for entry in sales:
+        key = entry.get('idempotency_key') if isinstance(entry, dict) else None
+        if not isinstance(key, str) or not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise OfflineSyncError(
+                f'Every sale needs an idempotency_key of at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters'
+            )
+        if key not in batch:
+            batch[key] = _offline_sale(business, key, entry)
+
+    OfflineSale.objects.bulk_create(batch.values(), ignore_conflicts=True)
+    staged = {
+        offline_sale.idempotency_key: offline_sale
+        for offline_sale in OfflineSale.objects.for_business(business).filter(idempotency_key__in=list(batch))
+    }
+    return [staged[key] for key in batch]
+
+
+def replay_offline_sales(business, offline_sales, branch=None):
+    """
+    Record the pending and failed ``offline_sales`` as sales, in one
+    transaction, and mark each synced or failed. Returns the replayed
+    OfflineSales keyed by id.
+    """
+    ids = [offline_sale.pk for offline_sale in offline_sales if offline_sale.status in REPLAYABLE]
+    if not ids:
+        return {}
+
+    with transaction.atomic():
+        # A concurrent sync of the same batch waits here, then finds them synced
+        claimed = list(
+            OfflineSale.objects.for_business(business).select_for_update().filter(pk__in=ids)
+            .filter(status__in=REPLAYABLE).order_by(F('sold_at').asc(nulls_last=True), 'pk')
+        )
+        # Validated when staged
+        lines = {offline_sale.pk: _lines(offline_sale.cart_items) for offline_sale in claimed}
+
+        # The catalog version is locked before the products, as in decrement_stock
+        catalog_version = bump_catalog_version(business.pk)
+        products = lock_products(business, {line['product_id'] for sale in lines.values() for line in sale})
+        customers = Customer.objects.for_business(business).in_bulk(
+            [offline_sale.customer_id for offline_sale in claimed if offline_sale.customer_id]
+        )
+        available = {product_id: product.quantity for product_id, product in products.items()}
+        requested = {}
+        accepted = []
+        for offline_sale in claimed:
+            needed = stock_by_product(lines[offline_sale.pk])
+            try:
+                for product_id, quantity in needed.items():
+                    if product_id not in products:
+                        raise ProductNotFoundError(product_id)
+                    if available[product_id] < quantity:
+                        raise InsufficientStockError(products[product_id], available[product_id], quantity)
+            except CheckoutError as e:
+                offline_sale.status = 'failed'
+                offline_sale.error_message = str(e)
+                continue
+            for product_id, quantity in needed.items():
+                available[product_id] -= quantity
+                requested[product_id] = requested.get(product_id, Decimal('0')) + quantity
+            accepted.append(offline_sale)
+
+        sales = []
+        items = []
+        if accepted:
+            take_stock(business, requested, catalog_version)
+            sales = Sale.objects.for_business(business).bulk_create([
+                Sale(
+                    business=business,
+                    branch=branch,
+                    customer=customers.get(offline_sale.customer_id),
+                    subtotal=offline_sale.subtotal,
+                    tax=offline_sale.tax,
+                    discount=offline_sale.discount,
+                    total_amount=offline_sale.total_amount,
+                    payment_method=offline_sale.payment_method,
+                )
+                for offline_sale in accepted
+            ])
+            # auto_now_add stamped the sync time; keep the time of the sale
+            dated = []
+            for sale, offline_sale in zip(sales, accepted):
+                if offline_sale.sold_at:
+                    sale.sale_date = offline_sale.sold_at
+                    dated.append(sale)
+            Sale.objects.for_business(business).bulk_update(dated, ['sale_date'])
+            items = SaleItem.objects.bulk_create([
+                item
+                for sale, offline_sale in zip(sales, accepted)
+                for item in sale_items(business, sale, lines[offline_sale.pk], products)
+            ])
+
+            # bulk_create skips the per-row signals
+            record_sales(sales)
+            record_sale_items(items)
+            notify_low_stock(products, requested)
+            refresh_products_on_commit(business.pk, requested)
+            transaction.on_commit(lambda: invalidate_dashboard_stats(business.pk, branch.pk if branch else None))
+
+        synced_at = timezone.now()
+        for sale, offline_sale in zip(sales, accepted):
+            offline_sale.status = 'synced'
+            offline_sale.sale = sale
+            offline_sale.synced_at = synced_at
+            offline_sale.error_message = None
+        OfflineSale.objects.for_business(business).bulk_update(
+            claimed, ['status', 'sale', 'synced_at', 'error_message']
+        )
+
+    logger.info(
+        f"Offline sync recorded {len(sales)} sales with {len(items)} lines for business {business.pk}, "
+        f"{len(claimed) - len(sales)} failed"
+    )
+    return {offline_sale.pk: offline_sale for offline_sale in claimed}
+
+
+def sync_offline_sales(business, sales, branch=None):
+    """
+    Stage and replay a batch of queued sales. Returns one result per
+    distinct idempotency key, in batch order, with its ``status``
+    (synced, failed or rejected), ``sale_id`` and ``error``.
+    """
+    staged = stage_offline_sales(business, sales)
+    replayed = replay_offline_sales(business, staged, branch)
+    OfflineSettings.objects.filter(business=business).update(last_synced=timezone.now())
+
+    results = []
+    for offline_sale in staged:
+        offline_sale = replayed.get(offline_sale.pk, offline_sale)
+        results.append({
+            'idempotency_key': offline_sale.idempotency_key,
+            'status': offline_sale.status,
+            'sale_id': offline_sale.sale_id,
+            'error': offline_sale.error_message,
+        })
+    return results
+
+
+def sync_interval(business):
+    """Seconds a till should wait between syncs"""
+    interval = OfflineSettings.objects.filter(business=business).values_list('sync_interval', flat=True).first()
+    return interval or DEFAULT_SYNC_INTERVAL
@@ -1,17 +1,26 @@
 from django.db import models
 from superadmin.models import Business
+from superadmin.managers import BusinessSpecificManager
 
 class OfflineSale(models.Model):
     """
     Model to store sales data when offline mode is active
     """
+    objects = BusinessSpecificManager()
+    
     SALE_STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('synced', 'Synced'),
         ('failed', 'Failed'),
+        ('rejected', 'Rejected'),
     ]
     
     business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='offline_sales')
+    # Generated by the till for each sale, so a sale sent twice is recorded once
+    idempotency_key = models.CharField(max_length=64)
+    # When the till recorded the sale
+    sold_at = models.DateTimeField(null=True, blank=True)
+    sale = models.OneToOneField('sales.Sale', on_delete=models.SET_NULL, null=True, blank=True, related_name='offline_sale')
     customer_id = models.IntegerField(null=True, blank=True)
     payment_method = models.CharField(max_length=20, default='cash')
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # type: ignore
@@ -26,6 +35,7 @@ class OfflineSale(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        unique_together = ('business', 'idempotency_key')
         verbose_name = 'Offline Sale'
         verbose_name_plural = 'Offline Sales'
     
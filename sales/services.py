@@ -0,0 +1,416 @@
+"""
+Checkout service used by the POS and cart views.
+
+A checkout locks the products it sells once, in primary key order so
+concurrent tills cannot deadlock, inserts the sale lines with a single
+bulk_create and decrements stock with a single F()-based UPDATE. The
+per-item stock signals are bypassed, so this module also keeps the sales
+rollups, low stock notifications, scanner index and dashboard cache up to
+date.
+
+Deleting and refunding a sale go through ``reverse_stock`` the same way: the
+stock of every returned line is put back with one UPDATE and the refund
+lines are written with one bulk_create. Stock that a refund returned is not
+returned again when its sale is deleted.
+"""
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+import logging
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+
+from dashboard.stats import invalidate_dashboard_stats
+from notifications.models import Notification
+from products.barcode_index import refresh_products_on_commit
+from products.catalog import bump_catalog_version
+from products.models import Product
+from reports.rollups import record_refunds, record_sale_items
+from .models import Refund, RefundItem, Sale, SaleItem
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(Exception):
+    """A checkout could not be completed; the message is safe to show to the cashier"""
+
+
+class RefundError(Exception):
+    """A refund could not be recorded; the message is safe to show to the user"""
+
+
+class ProductNotFoundError(CheckoutError):
+    def __init__(self, product_id, name=None):
+        self.product_id = product_id
+        super().__init__(f'Product not found: {name or product_id}. Please refresh and try again.')
+
+
+class InsufficientStockError(CheckoutError):
+    def __init__(self, product, available, requested):
+        self.product = product
+        self.available = available
+        self.requested = requested
+        super().__init__(f'Insufficient stock for {product.name}. Available: {available}, Requested: {requested}')
+
+
+def _decimal(value, field):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, TypeError, ValueError):
+        raise CheckoutError(f'Invalid {field}: {value}')
+
+
+def _product_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ProductNotFoundError(value)
+
+
+def stock_by_product(lines):
+    """Total quantity requested per product, keeping the first-seen order"""
+    requested = OrderedDict()
+    for line in lines:
+        requested[line['product_id']] = requested.get(line['product_id'], Decimal('0')) + line['quantity']
+    return requested
+
+
+def lock_products(business, product_ids):
+    """Lock the products of ``product_ids`` in primary key order; returns them keyed by id"""
+    return {
+        product.pk: product
+        for product in Product.objects.for_business(business).select_for_update().filter(
+            pk__in=list(product_ids)
+        ).order_by('pk')
+    }
+
+
+def take_stock(business, requested, catalog_version):
+    """
+    Take the quantities of ``requested`` ({product_id: quantity}) off the
+    stock of already checked products with one UPDATE, stamping them with
+    ``catalog_version``.
+    """
+    amount = Case(
+        *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in requested.items()],
+        output_field=DecimalField(max_digits=10, decimal_places=2)
+    )
+    # The quantity guard keeps stock from going negative even where the
+    # database does not support row locks. update() skips the catalog
+    # signals, so the new stock is stamped with a catalog version here.
+    updated = Product.objects.for_business(business).filter(
+        pk__in=list(requested), quantity__gte=amount
+    ).update(quantity=F('quantity') - amount, catalog_version=catalog_version)
+    if updated != len(requested):
+        fresh = Product.objects.for_business(business).filter(pk__in=list(requested))
+        for product in fresh:
+            if product.quantity < requested[product.pk]:
+                raise InsufficientStockError(product, product.quantity, requested[product.pk])
+        raise CheckoutError('Stock changed while processing the sale. Please try again.')
+
+
+def check_stock(products, requested):
+    """Raise ProductNotFoundError or InsufficientStockError unless ``products`` cover ``requested``"""
+    for product_id, quantity in requested.items():
+        product = products.get(product_id)
+        if product is None:
+            raise ProductNotFoundError(product_id)
+        if product.quantity < quantity:
+            raise InsufficientStockError(product, product.quantity, quantity)
+
+
+def decrement_stock(business, requested):
+    """
+    Lock the products of ``requested`` ({product_id: quantity}) and take the
+    quantities off their stock with one UPDATE. Returns the locked products
+    (with their quantity before the sale) keyed by id.
+
+    Raises ProductNotFoundError or InsufficientStockError without writing.
+    """
+    # Every writer locks the catalog version before the product rows, as
+    # Product.save() does through its pre_save signal, so they cannot deadlock
+    catalog_version = bump_catalog_version(business.pk)
+    products = lock_products(business, requested)
+    check_stock(products, requested)
+    take_stock(business, requested, catalog_version)
+    return products
+
+
+def notify_low_stock(products, requested):
+    """
+    Queue low stock notifications for products the sale took to or below their
+    reorder level. They are written in bulk once the sale has committed.
+    """
+    alerts = []
+    for product_id, quantity in requested.items():
+        product = products[product_id]
+        remaining = product.quantity - quantity
+        if remaining <= product.reorder_level:
+            alerts.append((
+                product,
+                f'Low Stock Alert: {product.name}',
+                f'The product "{product.name}" is low on stock after a sale. Current quantity: {remaining}, Reorder level: {product.reorder_level}',
+            ))
+    Notification.create_for_products_on_commit('low_stock', alerts)
+
+
+def prepare_lines(lines):
+    """
+    Validate sale lines (dicts with ``product_id``, ``quantity`` and
+    ``unit_price``) and convert their values. Raises CheckoutError.
+    """
+    lines = [
+        {
+            'product_id': _product_id(line['product_id']),
+            'quantity': _decimal(line['quantity'], 'quantity'),
+            'unit_price': _decimal(line['unit_price'], 'price'),
+        }
+        for line in lines
+    ]
+    if not lines:
+        raise CheckoutError('Cannot process sale: Your cart is empty. Please add items to the cart before checkout.')
+    for line in lines:
+        if line['quantity'] <= 0:
+            raise CheckoutError(f'Invalid quantity: {line["quantity"]}')
+    return lines
+
+
+def sale_totals(lines, discount, tax):
+    """``(subtotal, total_amount)`` of prepared lines. Raises CheckoutError for a discount above the total"""
+    subtotal = sum((line['quantity'] * line['unit_price'] for line in lines), Decimal('0'))
+    total_amount = subtotal + tax - discount
+    if total_amount < 0:
+        raise CheckoutError('Invalid discount amount. Discount cannot exceed the subtotal.')
+    return subtotal, total_amount
+
+
+def sale_items(business, sale, lines, products):
+    """Unsaved SaleItems of prepared ``lines``, with the cost of the locked ``products`` snapshotted"""
+    return [
+        SaleItem(
+            business=business,
+            branch=sale.branch,
+            sale=sale,
+            product=products[line['product_id']],
+            quantity=line['quantity'],
+            unit_price=line['unit_price'],
+            total_price=line['quantity'] * line['unit_price'],
+            unit_cost=products[line['product_id']].cost_price,  # Snapshot cost at time of sale
+        )
+        for line in lines
+    ]
+
+
+def checkout(business, lines, customer=None, payment_method='cash', discount=0, tax=0, branch=None):
+    """
+    Record a sale of ``lines`` for ``business`` and take the stock off.
+
+    ``lines`` is an iterable of dicts with ``product_id``, ``quantity`` and
+    ``unit_price``. Runs in one transaction: on any CheckoutError nothing is
+    written. Returns the created Sale.
+    """
+    lines = prepare_lines(lines)
+    discount = _decimal(discount, 'discount')
+    tax = _decimal(tax, 'tax')
+    subtotal, total_amount = sale_totals(lines, discount, tax)
+
+    requested = stock_by_product(lines)
+
+    with transaction.atomic():
+        products = decrement_stock(business, requested)
+
+        sale = Sale.objects.create(
+            business=business,
+            branch=branch,
+            customer=customer,
+            subtotal=subtotal,
+            tax=tax,
+            discount=discount,
+            total_amount=total_amount,
+            payment_method=payment_method,
+        )
+        items = SaleItem.objects.bulk_create(sale_items(business, sale, lines, products))
+
+        # bulk_create skips the per-item signals
+        record_sale_items(items)
+        notify_low_stock(products, requested)
+        refresh_products_on_commit(business.pk, requested)
+        transaction.on_commit(lambda: invalidate_dashboard_stats(business.pk, branch.pk if branch else None))
+
+    logger.info(f"Checkout recorded sale {sale.pk} with {len(items)} lines for business {business.pk}")
+    return sale
+
+
+# Sales being deleted by delete_sale, whose items are reversed in bulk
+_sales_reversed_in_bulk = ContextVar('sales_reversed_in_bulk', default=frozenset())
+
+
+@contextmanager
+def reversing_in_bulk(sale_ids):
+    """Within this block the per-item delete signals skip the items of ``sale_ids``"""
+    token = _sales_reversed_in_bulk.set(_sales_reversed_in_bulk.get() | frozenset(sale_ids))
+    try:
+        yield
+    finally:
+        _sales_reversed_in_bulk.reset(token)
+
+
+def reversed_in_bulk(sale_item):
+    """Whether the stock and rollups of a deleted ``sale_item`` are reversed by delete_sale"""
+    return sale_item.sale_id in _sales_reversed_in_bulk.get()
+
+
+def reverse_stock(business, returned, branch=None):
+    """
+    Put the quantities of ``returned`` ({product_id: quantity}) back into
+    stock with one UPDATE, and refresh what depends on the stock.
+    """
+    returned = {product_id: quantity for product_id, quantity in returned.items() if quantity}
+    if returned:
+        amount = Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in returned.items()],
+            output_field=DecimalField(max_digits=10, decimal_places=2)
+        )
+        # update() skips the catalog signals, so the stock is stamped with a catalog version here
+        Product.objects.for_business(business).filter(pk__in=list(returned)).update(
+            quantity=F('quantity') + amount, catalog_version=bump_catalog_version(business.pk)
+        )
+        refresh_products_on_commit(business.pk, returned)
+    transaction.on_commit(lambda: invalidate_dashboard_stats(business.pk, branch.pk if branch else None))
+
+
+def refunded_quantities(sale):
+    """The quantity already refunded of each line of ``sale``, keyed by sale item id"""
+    return dict(
+        RefundItem.objects.all_businesses().filter(sale_item__sale=sale).values('sale_item_id')
+        .annotate(refunded=Sum('quantity')).order_by().values_list('sale_item_id', 'refunded')
+    )
+
+
+def delete_sale(sale):
+    """
+    Delete ``sale`` and put the stock of its lines back, less what its
+    refunds have returned already.
+    """
+    with transaction.atomic():
+        items = list(SaleItem.objects.all_businesses().filter(sale=sale))
+        refunded = refunded_quantities(sale)
+        returned = defaultdict(Decimal)
+        for item in items:
+            item.sale = sale
+            returned[item.product_id] += item.quantity - refunded.get(item.pk, 0)
+        reverse_stock(sale.business, returned, sale.branch)
+
+        with reversing_in_bulk([sale.pk]):
+            sale.delete()
+        # The item delete signals were skipped
+        record_sale_items(items, sign=-1)
+
+    logger.info(f"Deleted sale {sale.pk} and returned the stock of {len(items)} lines")
+
+
+def _cents(value):
+    return value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def _line_amounts(refund_amount, lines):
+    """Split ``refund_amount`` across ``[(item, quantity)]`` in proportion to their value"""
+    values = [quantity * item.unit_price for item, quantity in lines]
+    total = sum(values, Decimal('0'))
+    amounts = []
+    for value in values[:-1]:
+        amounts.append(_cents(refund_amount * value / total) if total else Decimal('0'))
+    # The last line takes the rounding difference, so the lines add up to the refund
+    amounts.append(refund_amount - sum(amounts, Decimal('0')))
+    return amounts
+
+
+def refund_sale(sale, reason, refund_amount=None, quantities=None):
+    """
+    Refund ``sale`` and put the returned quantities back into stock.
+
+    ``quantities`` ({sale_item_id: quantity}) returns part of the lines; by
+    default everything not refunded yet is returned. ``refund_amount``
+    defaults to the value paid for the returned quantities. The sale is
+    marked refunded once all of its lines are. Raises RefundError without
+    writing. Returns the Refund.
+    """
+    with transaction.atomic():
+        # Serializes refunds of one sale
+        sale = Sale.objects.all_businesses().select_related('business', 'branch').select_for_update(of=('self',)).get(pk=sale.pk)
+        items = {item.pk: item for item in SaleItem.objects.all_businesses().filter(sale=sale).order_by('pk')}
+        refunded = refunded_quantities(sale)
+        remaining = {pk: item.quantity - refunded.get(pk, 0) for pk, item in items.items()}
+
+        if quantities is None:
+            quantities = {pk: quantity for pk, quantity in remaining.items() if quantity > 0}
+        lines = []
+        for item_id, quantity in quantities.items():
+            item = items.get(int(item_id)) if str(item_id).isdigit() else None
+            if item is None:
+                raise RefundError(f'Sale line not found: {item_id}')
+            quantity = Decimal(str(quantity))
+            if not quantity:
+                continue
+            if quantity < 0 or quantity > remaining[item.pk]:
+                raise RefundError(
+                    f'Invalid quantity to refund for {item.product.name}: {quantity}. '
+                    f'Refundable: {remaining[item.pk]}'
+                )
+            lines.append((item, quantity))
+
+        refundable = sale.total_amount - (
+            Refund.objects.all_businesses().filter(sale=sale).aggregate(total=Sum('refund_amount'))['total'] or 0
+        )
+        fully_refunded = all(quantity == remaining[item.pk] for item, quantity in lines) and (
+            len(lines) == sum(1 for quantity in remaining.values() if quantity > 0)
+        )
+        if refund_amount is None:
+            if fully_refunded:
+                refund_amount = refundable
+            else:
+                # The returned lines' value, with the sale's discount and tax applied
+                value = sum((quantity * item.unit_price for item, quantity in lines), Decimal('0'))
+                refund_amount = _cents(value * sale.total_amount / sale.subtotal) if sale.subtotal else value
+        refund_amount = Decimal(str(refund_amount))
+        if refund_amount <= 0 and not lines:
+            raise RefundError('Please select the items to refund or provide a refund amount.')
+        if refund_amount < 0 or refund_amount > refundable:
+            raise RefundError(f'Refund amount must be between 0 and {refundable}.')
+
+        # Written without signals, so the rollups see the refund with its lines
+        refund = Refund(
+            business=sale.business,
+            branch=sale.branch,
+            sale=sale,
+            reason=reason,
+            refund_amount=refund_amount,
+        )
+        Refund.objects.bulk_create([refund])
+        RefundItem.objects.bulk_create([
+            RefundItem(
+                business=sale.business,
+                refund=refund,
+                sale_item=item,
+                product_id=item.product_id,
+                quantity=quantity,
+                amount=amount,
+            )
+            for (item, quantity), amount in zip(lines, _line_amounts(refund_amount, lines) if lines else [])
+        ])
+        record_refunds([refund])
+
+        returned = defaultdict(Decimal)
+        for item, quantity in lines:
+            returned[item.product_id] += quantity
+        reverse_stock(sale.business, returned, sale.branch)
+
+        if fully_refunded and not sale.is_refunded:
+            Sale.objects.all_businesses().filter(pk=sale.pk).update(is_refunded=True, updated_at=timezone.now())
+            sale.is_refunded = True
+
+    logger.info(f"Refunded {refund_amount} of sale {sale.pk} returning {len(lines)} lines")
+    return refund
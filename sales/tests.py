@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from products.models import Product, Category, Unit
@@ -59,10 +59,10 @@ class POSTestCase(TestCase):
         self.assertContains(response, 'Point of Sale')
         
     def test_product_display_in_pos(self):
-        """Test that products are displayed in the POS view"""
+        """Test that the POS loads its products from the catalog endpoint"""
         response = self.client.get(reverse('sales:pos'))
-        self.assertContains(response, self.product1.name)
-        self.assertContains(response, str(self.product1.selling_price))
+        self.assertContains(response, f'data-catalog-url="{reverse("sales:pos_catalog")}"')
+        self.assertNotContains(response, self.product1.name)
         
     def test_add_product_to_cart(self):
         """Test adding a product to the cart via AJAX"""
@@ -100,4 +100,923 @@ class POSTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         data = response.json()
         self.assertTrue(data['success'])
-        self.assertIn('sale_id', data)
\ No newline at end of file
+        self.assertIn('sale_id', data)
+
+class SaleItemCostSnapshotTest(TestCase):
+    def setUp(self):
+        from superadmin.models import Business
+        from superadmin.middleware import set_current_business
+        from sales.models import Sale
+        
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+        set_current_business(self.business)
+        
+        category = Category.objects.create(business=self.business, name='Test Category')
+        unit = Unit.objects.create(business=self.business, name='Piece', symbol='pcs')
+        self.product = Product.objects.create(
+            business=self.business,
+            name='Test Product',
+            sku='TP001',
+            category=category,
+            unit=unit,
+            quantity=10,
+            cost_price=5.00,
+            selling_price=10.00
+        )
+        self.sale = Sale.objects.create(business=self.business, subtotal=20, total_amount=20)
+    
+    def tearDown(self):
+        from superadmin.middleware import clear_current_business
+        clear_current_business()
+    
+    def test_unit_cost_captured_at_sale_time(self):
+        from sales.models import SaleItem
+        item = SaleItem.objects.create(
+            business=self.business, sale=self.sale, product=self.product,
+            quantity=2, unit_price=10, total_price=20
+        )
+        Product.objects.filter(pk=self.product.pk).update(cost_price=8)
+        item.refresh_from_db()
+        self.assertEqual(float(item.unit_cost), 5.0)
+    
+    def test_backfill_sale_item_costs(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from sales.models import SaleItem
+        item = SaleItem.objects.create(
+            business=self.business, sale=self.sale, product=self.product,
+            quantity=2, unit_price=10, total_price=20
+        )
+        SaleItem.objects.filter(pk=item.pk).update(unit_cost=None)
+        
+        call_command('backfill_sale_item_costs', '--chunk-size', '1', stdout=StringIO())
+        
+        item.refresh_from_db()
+        self.assertEqual(float(item.unit_cost), 5.0)
+
+
+class CheckoutServiceTest(TestCase):
+    def setUp(self):
+        from superadmin.models import Business
+        from superadmin.middleware import set_current_business
+        
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+        set_current_business(self.business)
+        
+        category = Category.objects.create(business=self.business, name='Test Category')
+        unit = Unit.objects.create(business=self.business, name='Piece', symbol='pcs')
+        self.products = [
+            Product.objects.create(
+                business=self.business,
+                name=f'Test Product {index}',
+                sku=f'TP00{index}',
+                category=category,
+                unit=unit,
+                quantity=10,
+                reorder_level=2,
+                cost_price=5.00,
+                selling_price=10.00
+            )
+            for index in range(3)
+        ]
+    
+    def tearDown(self):
+        from superadmin.middleware import clear_current_business
+        clear_current_business()
+    
+    def test_checkout_records_sale_and_decrements_stock_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from reports.aggregates import sales_totals
+        from sales.services import checkout
+        
+        lines = [
+            {'product_id': product.pk, 'quantity': 2, 'unit_price': '10.00'}
+            for product in self.products
+        ]
+        lines.append({'product_id': self.products[0].pk, 'quantity': 1, 'unit_price': '10.00'})
+        
+        with CaptureQueriesContext(connection) as queries:
+            sale = checkout(self.business, lines, discount=5)
+        
+        stock_updates = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE') and 'products_product' in query['sql']
+        ]
+        self.assertEqual(len(stock_updates), 1)
+        
+        self.assertEqual(sale.items.count(), 4)
+        self.assertEqual(float(sale.total_amount), 65.0)
+        self.assertEqual(
+            [float(product.quantity) for product in Product.objects.business_specific().order_by('pk')],
+            [7.0, 8.0, 8.0]
+        )
+        
+        today = timezone.localdate()
+        totals = sales_totals(today, today)
+        self.assertEqual(totals['orders'], 1)
+        self.assertEqual(float(totals['items_sold']), 7.0)
+        self.assertEqual(float(totals['cogs']), 35.0)
+    
+    def test_insufficient_stock_writes_nothing(self):
+        from sales.models import Sale
+        from sales.services import checkout, InsufficientStockError
+        
+        lines = [
+            {'product_id': self.products[0].pk, 'quantity': 1, 'unit_price': '10.00'},
+            {'product_id': self.products[1].pk, 'quantity': 11, 'unit_price': '10.00'},
+        ]
+        with self.assertRaises(InsufficientStockError) as context:
+            checkout(self.business, lines)
+        
+        self.assertEqual(context.exception.product, self.products[1])
+        self.assertEqual(Sale.objects.business_specific().count(), 0)
+        self.assertEqual(
+            [float(product.quantity) for product in Product.objects.business_specific().order_by('pk')],
+            [10.0, 10.0, 10.0]
+        )
+    
+    def test_api_sale_goes_through_checkout(self):
+        from decimal import Decimal
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.exceptions import ValidationError
+        from sales.models import Sale
+        from api.serializers.sales_serializers import SaleCreateUpdateSerializer
+        
+        serializer = SaleCreateUpdateSerializer(data={
+            'payment_method': 'cash',
+            'notes': 'Phone order',
+            'items': [
+                {'product': self.products[0].pk, 'quantity': '2'},
+                {'product': self.products[1].pk, 'quantity': '1', 'unit_price': '8.00'},
+            ],
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with CaptureQueriesContext(connection) as queries:
+            sale = serializer.save()
+        # One guarded stock UPDATE for both lines, no per-line product saves
+        self.assertEqual(
+            len([query for query in queries if query['sql'].startswith('UPDATE "products_product"')]), 1
+        )
+        self.assertEqual((sale.total_amount, sale.notes), (Decimal('28.00'), 'Phone order'))
+        self.assertEqual(
+            [float(product.quantity) for product in Product.objects.business_specific().order_by('pk')],
+            [8.0, 9.0, 10.0]
+        )
+        
+        serializer = SaleCreateUpdateSerializer(data={'items': [{'product': self.products[0].pk, 'quantity': '9'}]})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.assertRaises(ValidationError) as context:
+            serializer.save()
+        self.assertIn('Insufficient stock', str(context.exception.detail['items'][0]))
+        self.assertEqual(Sale.objects.business_specific().count(), 1)
+    
+    def test_catalog_version_is_locked_before_the_products(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from sales.services import checkout
+        
+        # The order Product.save() takes them in through its pre_save signal
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.business, [{'product_id': self.products[0].pk, 'quantity': 1, 'unit_price': '10.00'}])
+        statements = [query['sql'] for query in queries]
+        version = next(i for i, sql in enumerate(statements) if sql.startswith('UPDATE "products_catalogversion"'))
+        products = next(i for i, sql in enumerate(statements) if 'FROM "products_product"' in sql)
+        self.assertLess(version, products)
+    
+    def test_process_pos_sale_view_uses_checkout(self):
+        import json
+        from sales.models import Sale
+        
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+        
+        def post(quantity):
+            return self.client.post(
+                reverse('sales:process_pos_sale'),
+                data=json.dumps({'cart_items': [
+                    {'id': self.products[0].pk, 'name': 'Test Product 0', 'price': '10.00', 'quantity': quantity}
+                ]}),
+                content_type='application/json'
+            )
+        
+        response = post(20)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Insufficient stock', response.json()['error'])
+        self.assertEqual(Sale.objects.business_specific().count(), 0)
+        
+        response = post(4)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+        self.products[0].refresh_from_db()
+        self.assertEqual(float(self.products[0].quantity), 6.0)
+    
+    def test_unknown_product_rejected(self):
+        from sales.services import checkout, ProductNotFoundError
+        
+        with self.assertRaises(ProductNotFoundError):
+            checkout(self.business, [{'product_id': 999999, 'quantity': 1, 'unit_price': '1.00'}])
+
+
+class PosCatalogTest(TestCase):
+    def setUp(self):
+        from superadmin.models import Business
+        from superadmin.middleware import set_current_business
+        
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+        set_current_business(self.business)
+        
+        self.category = Category.objects.create(business=self.business, name='Test Category')
+        self.unit = Unit.objects.create(business=self.business, name='Piece', symbol='pcs')
+        self.products = [self.create_product(index) for index in range(5)]
+        
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+    
+    def tearDown(self):
+        from superadmin.middleware import clear_current_business
+        clear_current_business()
+    
+    def create_product(self, index):
+        return Product.objects.create(
+            business=self.business,
+            name=f'Test Product {index}',
+            sku=f'TP00{index}',
+            category=self.category,
+            unit=self.unit,
+            quantity=10,
+            cost_price=5.00,
+            selling_price=10.00
+        )
+    
+    def get(self, **params):
+        return self.client.get(reverse('sales:pos_catalog'), params)
+    
+    def test_full_catalog_is_paginated(self):
+        Product.objects.filter(pk=self.products[4].pk).update(is_active=False)
+        
+        first = self.get(limit=3).json()
+        self.assertEqual(first['mode'], 'full')
+        self.assertEqual([product['id'] for product in first['products']], [product.pk for product in self.products[:3]])
+        self.assertEqual(first['products'][0], {
+            'id': self.products[0].pk,
+            'name': 'Test Product 0',
+            'sku': 'TP000',
+            'barcode': self.products[0].barcode,
+            'price': '10.00',
+            'stock': '10.00',
+        })
+        self.assertEqual(first['next'], self.products[2].pk)
+        
+        second = self.get(limit=3, after=first['next']).json()
+        self.assertEqual([product['id'] for product in second['products']], [self.products[3].pk])
+        self.assertIsNone(second['next'])
+    
+    def test_delta_returns_only_changes(self):
+        from sales.services import checkout
+        
+        version = self.get().json()['version']
+        self.assertEqual(self.get(since=version).json()['products'], [])
+        
+        renamed = self.products[0]
+        renamed.name = 'Renamed Product'
+        renamed.save()
+        deactivated = self.products[1]
+        deactivated.is_active = False
+        deactivated.save()
+        deleted_id = self.products[2].pk
+        self.products[2].delete()
+        checkout(self.business, [{'product_id': self.products[3].pk, 'quantity': 4, 'unit_price': '10.00'}])
+        
+        delta = self.get(since=version).json()
+        self.assertEqual(delta['mode'], 'delta')
+        self.assertGreater(delta['version'], version)
+        self.assertEqual(
+            {product['id']: (product['name'], product['stock']) for product in delta['products']},
+            {renamed.pk: ('Renamed Product', '10.00'), self.products[3].pk: ('Test Product 3', '6.00')}
+        )
+        self.assertEqual(sorted(delta['deleted']), sorted([deactivated.pk, deleted_id]))
+        
+        self.assertEqual(self.get(since=delta['version']).json()['products'], [])
+    
+    def test_unchanged_catalog_is_not_modified(self):
+        response = self.get(since=0)
+        etag = response['ETag']
+        
+        response = self.client.get(reverse('sales:pos_catalog'), {'since': 0}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        self.create_product(9)
+        response = self.client.get(reverse('sales:pos_catalog'), {'since': 0}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_invalid_parameters_rejected(self):
+        self.assertEqual(self.get(since='abc').status_code, 400)
+        self.assertEqual(self.get(after=-1).status_code, 400)
+    
+    def test_pos_page_registers_service_worker_without_server_cart(self):
+        response = self.client.get(reverse('sales:pos'))
+        self.assertContains(response, f'data-service-worker-url="{reverse("sales:pos_service_worker")}"')
+        self.assertContains(response, 'js/pos-store.js')
+        self.assertNotContains(response, 'js/cart.js')
+    
+    def test_service_worker_is_public_and_scoped_to_the_pos(self):
+        self.client.logout()
+        response = self.client.get(reverse('sales:pos_service_worker'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(reverse('sales:pos_service_worker').startswith(reverse('sales:pos')))
+        self.assertContains(response, f"const SHELL_URL = '{reverse('sales:pos')}';")
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from sales.models import Sale
+        from superadmin.models import Business
+        from superadmin.middleware import set_current_business
+        
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+        set_current_business(self.business)
+        
+        # Ties on the sort key must neither repeat nor skip rows
+        for index in range(7):
+            Sale.objects.create(business=self.business, subtotal=index, total_amount=index)
+        Sale.objects.for_business(self.business).filter(pk__lte=Sale.objects.order_by('pk')[3].pk).update(
+            sale_date=timezone.now()
+        )
+        self.expected = list(
+            Sale.objects.for_business(self.business).order_by('-sale_date', '-pk').values_list('pk', flat=True)
+        )
+        
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+    
+    def tearDown(self):
+        from superadmin.middleware import clear_current_business
+        clear_current_business()
+    
+    def test_pages_walk_forwards_and_backwards(self):
+        from sales.models import Sale
+        from utils.pagination import keyset_paginate
+        
+        sales = Sale.objects.for_business(self.business)
+        pages = [keyset_paginate(sales, per_page=3)]
+        while pages[-1].has_next:
+            pages.append(keyset_paginate(sales, pages[-1].next_cursor, per_page=3))
+        self.assertEqual([[sale.pk for sale in page] for page in pages], [
+            self.expected[:3], self.expected[3:6], self.expected[6:]
+        ])
+        self.assertFalse(pages[0].has_previous)
+        
+        previous = keyset_paginate(sales, pages[-1].previous_cursor, per_page=3)
+        self.assertEqual([sale.pk for sale in previous], self.expected[3:6])
+        previous = keyset_paginate(sales, previous.previous_cursor, per_page=3)
+        self.assertEqual([sale.pk for sale in previous], self.expected[:3])
+        self.assertFalse(previous.has_previous)
+        self.assertTrue(previous.has_next)
+    
+    def test_sale_list_is_paginated(self):
+        response = self.client.get(reverse('sales:list'))
+        self.assertEqual([sale.pk for sale in response.context['sales']], self.expected)
+        self.assertFalse(response.context['page'].has_other_pages)
+        
+        # A tampered cursor shows the first page
+        response = self.client.get(reverse('sales:list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+
+
+class CheckoutConcurrencyTest(TransactionTestCase):
+    """
+    Parallel checkouts of one product must never oversell it. SQLite has no
+    row locks and lets one writer in at a time, failing the others with
+    "database is locked"; they are retried, and the guarded stock UPDATE
+    keeps the stock from going below zero.
+    """
+    
+    def setUp(self):
+        from superadmin.models import Business
+        
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+        category = Category.objects.create(business=self.business, name='Test Category')
+        unit = Unit.objects.create(business=self.business, name='Piece', symbol='pcs')
+        self.product = Product.objects.create(
+            business=self.business,
+            name='Contended Product',
+            sku='TP001',
+            category=category,
+            unit=unit,
+            quantity=5,
+            cost_price=5.00,
+            selling_price=10.00
+        )
+        self.skip_unless_threads_share_the_database()
+    
+    def skip_unless_threads_share_the_database(self):
+        """
+        A connection opened before the test database was set up (by a module
+        querying on import) keeps a private in-memory database other threads
+        cannot see.
+        """
+        import threading
+        from django.db import OperationalError, connection
+        
+        visible = []
+        
+        def look():
+            try:
+                visible.append(Product.objects.all_businesses().filter(pk=self.product.pk).exists())
+            except OperationalError:
+                visible.append(False)
+            finally:
+                connection.close()
+        
+        thread = threading.Thread(target=look)
+        thread.start()
+        thread.join()
+        if not visible[0]:
+            self.skipTest('Other threads cannot see the test database')
+    
+    def test_parallel_checkouts_never_oversell(self):
+        import threading
+        import time
+        from django.db import OperationalError, connection
+        from sales.models import Sale
+        from sales.services import checkout, InsufficientStockError
+        
+        attempts = 10
+        barrier = threading.Barrier(attempts)
+        outcomes = []
+        
+        def buy():
+            try:
+                barrier.wait()
+                for _ in range(200):
+                    try:
+                        checkout(self.business, [{'product_id': self.product.pk, 'quantity': 1, 'unit_price': '10.00'}])
+                        outcomes.append('sold')
+                        return
+                    except InsufficientStockError:
+                        outcomes.append('rejected')
+                        return
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        time.sleep(0.01)
+                outcomes.append('gave up')
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=buy) for _ in range(attempts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.product.refresh_from_db()
+        # A sale whose on-commit work hit the lock is retried and rejected,
+        # so the stock and the sales recorded are what must add up
+        self.assertNotIn('gave up', outcomes)
+        self.assertLessEqual(outcomes.count('sold'), 5)
+        self.assertEqual(float(self.product.quantity), 0.0)
+        self.assertEqual(Sale.objects.for_business(self.business).count(), 5)
+
+
+class OfflineSyncTest(TestCase):
+    def setUp(self):
+        from superadmin.models import Business
+        
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+        category = Category.objects.create(business=self.business, name='Test Category')
+        unit = Unit.objects.create(business=self.business, name='Piece', symbol='pcs')
+        self.products = [
+            Product.objects.create(
+                business=self.business,
+                name=f'Test Product {index}',
+                sku=f'TP00{index}',
+                category=category,
+                unit=unit,
+                quantity=100,
+                reorder_level=2,
+                cost_price=5.00,
+                selling_price=10.00
+            )
+            for index in range(2)
+        ]
+        
+        self.client.force_login(self.user)
+        session = self.client.session
+        session['current_business_id'] = self.business.id
+        session.save()
+    
+    def queued_sale(self, key, quantity=1, products=None, **fields):
+        return {
+            'idempotency_key': key,
+            'payment_method': 'cash',
+            'discount': 0,
+            'cart_items': [
+                {'id': product.pk, 'name': product.name, 'price': '10.00', 'quantity': quantity}
+                for product in (products or self.products)
+            ],
+            **fields,
+        }
+    
+    def sync(self, sales):
+        import json
+        
+        return self.client.post(
+            reverse('sales:offline_sync'), data=json.dumps({'sales': sales}), content_type='application/json'
+        )
+    
+    def stock(self):
+        return [float(quantity) for quantity in Product.objects.for_business(self.business).order_by('pk').values_list('quantity', flat=True)]
+    
+    def test_batch_is_recorded_once_with_one_stock_update(self):
+        from datetime import timedelta
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from reports.aggregates import sales_totals
+        from sales.models import Sale
+        
+        sold_at = timezone.now() - timedelta(days=1)
+        sales = [self.queued_sale(f'till-1-{index}', created_at=sold_at.isoformat()) for index in range(20)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.sync(sales)
+        data = response.json()
+        
+        self.assertEqual(data['synced'], 20)
+        self.assertEqual(data['sync_interval'], 300)
+        stock_updates = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE') and 'products_product' in query['sql']
+        ]
+        self.assertEqual(len(stock_updates), 1)
+        self.assertEqual(self.stock(), [80.0, 80.0])
+        
+        # Recorded on the day the till sold them
+        day = timezone.localtime(sold_at).date()
+        self.assertEqual(sales_totals(day, day, business=self.business)['orders'], 20)
+        self.assertEqual(Sale.objects.for_business(self.business).filter(sale_date=sold_at).count(), 20)
+        
+        # Sending the batch again records nothing new
+        again = self.sync(sales).json()
+        self.assertEqual(
+            [result['sale_id'] for result in again['results']],
+            [result['sale_id'] for result in data['results']]
+        )
+        self.assertEqual(Sale.objects.for_business(self.business).count(), 20)
+        self.assertEqual(self.stock(), [80.0, 80.0])
+    
+    def test_query_count_does_not_grow_with_the_batch(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        # The first sync also creates the rollup and counter rows
+        self.sync([self.queued_sale('warm-up')])
+        counts = []
+        for prefix, size in [('small', 5), ('large', 20)]:
+            with CaptureQueriesContext(connection) as queries:
+                self.sync([self.queued_sale(f'{prefix}-{index}') for index in range(size)])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+    
+    def test_sale_without_stock_fails_alone_and_is_retried(self):
+        from sales.offline_models import OfflineSale
+        
+        Product.objects.for_business(self.business).update(quantity=10)
+        sales = [self.queued_sale(f'key-{index}', quantity=4, created_at=f'2024-01-01T10:0{index}:00') for index in range(3)]
+        data = self.sync(sales).json()
+        
+        self.assertEqual([result['status'] for result in data['results']], ['synced', 'synced', 'failed'])
+        self.assertIn('Insufficient stock', data['results'][2]['error'])
+        self.assertEqual(self.stock(), [2.0, 2.0])
+        
+        # Once the stock is corrected, sending the key again records it
+        Product.objects.for_business(self.business).update(quantity=6)
+        data = self.sync(sales[2:]).json()
+        self.assertEqual(data['results'][0]['status'], 'synced')
+        self.assertEqual(self.stock(), [2.0, 2.0])
+        self.assertEqual(OfflineSale.objects.for_business(self.business).filter(status='synced').count(), 3)
+    
+    def test_invalid_sales_are_rejected(self):
+        data = self.sync([
+            self.queued_sale('bad-discount', discount=100),
+            self.queued_sale('bad-cart', cart_items=[{'id': self.products[0].pk}]),
+            self.queued_sale('good'),
+        ]).json()
+        self.assertEqual([result['status'] for result in data['results']], ['rejected', 'rejected', 'synced'])
+        self.assertEqual(self.stock(), [99.0, 99.0])
+        
+        response = self.sync([self.queued_sale('')])
+        self.assertEqual(response.status_code, 400)
+
+
+class IdempotentCheckoutTest(OfflineSyncTest):
+    def process(self, key, quantity=1, **headers):
+        import json
+        
+        sale = self.queued_sale(key, quantity)
+        return self.client.post(
+            reverse('sales:process_pos_sale'), data=json.dumps(sale), content_type='application/json', **headers
+        )
+    
+    def test_retried_sale_is_recorded_once(self):
+        from sales.models import Sale
+        
+        first = self.process('till-1-sale-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', first)
+        
+        retry = self.process('till-1-sale-1')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Sale.objects.for_business(self.business).count(), 1)
+        self.assertEqual(self.stock(), [99.0, 99.0])
+        
+        # The header takes precedence over the body
+        self.assertEqual(self.process('', HTTP_IDEMPOTENCY_KEY='till-1-sale-1').json(), first.json())
+        self.assertEqual(self.process('x' * 65).status_code, 400)
+    
+    def test_keys_are_shared_with_the_offline_sync(self):
+        from sales.models import Sale
+        
+        # Recorded online, then queued offline because the response was lost
+        sale_id = self.process('till-1-sale-1').json()['sale_id']
+        result = self.sync([self.queued_sale('till-1-sale-1')]).json()['results'][0]
+        self.assertEqual((result['status'], result['sale_id']), ('synced', sale_id))
+        
+        # Synced offline, then retried online
+        sale_id = self.sync([self.queued_sale('till-1-sale-2')]).json()['results'][0]['sale_id']
+        self.assertEqual(self.process('till-1-sale-2').json()['sale_id'], sale_id)
+        
+        self.assertEqual(Sale.objects.for_business(self.business).count(), 2)
+        self.assertEqual(self.stock(), [98.0, 98.0])
+    
+    def test_failed_checkout_releases_the_key(self):
+        from sales.offline_models import OfflineSale
+        
+        self.assertEqual(self.process('till-1-sale-1', quantity=500).status_code, 400)
+        self.assertFalse(OfflineSale.objects.for_business(self.business).exists())
+        
+        Product.objects.for_business(self.business).update(quantity=1000)
+        self.assertEqual(self.process('till-1-sale-1', quantity=500).status_code, 200)
+        self.assertEqual(self.stock(), [500.0, 500.0])
+    
+    def test_retried_cart_checkout_is_replayed_after_the_cart_was_cleared(self):
+        import json
+        from sales.models import Sale
+        
+        self.client.post(
+            reverse('sales:add_to_cart'), data=json.dumps({'product_id': self.products[0].pk, 'quantity': 2}),
+            content_type='application/json'
+        )
+        checkout = lambda: self.client.post(
+            reverse('sales:process_sale_from_cart'), data=json.dumps({'payment_method': 'cash'}),
+            content_type='application/json', HTTP_IDEMPOTENCY_KEY='till-1-sale-1'
+        )
+        first = checkout()
+        self.assertEqual(first.status_code, 200)
+        retry = checkout()
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Sale.objects.for_business(self.business).count(), 1)
+        self.assertEqual(self.stock(), [98.0, 100.0])
+    
+    def test_old_keys_are_pruned(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from sales.idempotency import prune_idempotency_keys
+        from sales.offline_models import OfflineSale
+        
+        self.process('till-1-sale-1')
+        self.process('till-1-sale-2')
+        OfflineSale.objects.for_business(self.business).filter(idempotency_key='till-1-sale-1').update(
+            synced_at=timezone.now() - timedelta(days=31)
+        )
+        self.assertEqual(prune_idempotency_keys(30), 1)
+        self.assertEqual(
+            list(OfflineSale.objects.for_business(self.business).values_list('idempotency_key', flat=True)),
+            ['till-1-sale-2']
+        )
+
+
+class CartStoreTest(OfflineSyncTest):
+    def post(self, name, **data):
+        import json
+        
+        return self.client.post(reverse(f'sales:{name}'), data=json.dumps(data), content_type='application/json')
+    
+    def use_store(self, name):
+        from unittest import mock
+        from django.core.cache import cache
+        
+        cache.clear()
+        patcher = mock.patch('sales.cart_store.CART_STORE_BACKEND', name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_cart_operations_and_checkout(self):
+        from sales.models import Cart, CartItem, Sale
+        
+        for store in ['cache', 'session', 'db']:
+            with self.subTest(store=store):
+                self.use_store(store)
+                first, second = self.products
+                
+                item = self.post('add_to_cart', product_id=first.pk, quantity=2).json()['item']
+                self.assertEqual((item['quantity'], item['total_price']), (2.0, 20.0))
+                self.assertEqual(self.post('add_to_cart', product_id=first.pk).json()['item']['quantity'], 3.0)
+                self.assertEqual(self.post('add_to_cart', product_id=first.pk, quantity=98).status_code, 400)
+                other = self.post('add_to_cart', product_id=second.pk).json()['item']
+                
+                updated = self.post('update_cart_item', item_id=item['id'], quantity=5).json()['cart_item']
+                self.assertEqual(updated['total_price'], 50.0)
+                self.assertEqual(self.post('update_cart_item', item_id=item['id'], quantity=101).status_code, 400)
+                self.assertEqual(self.post('remove_from_cart', item_id=other['id']).status_code, 200)
+                self.assertEqual(self.post('remove_from_cart', item_id=other['id']).status_code, 404)
+                
+                items = self.client.get(reverse('sales:get_cart')).json()['items']
+                self.assertEqual([(line['product_id'], line['quantity']) for line in items], [(first.pk, 5.0)])
+                
+                sale_id = self.post('process_sale_from_cart', payment_method='cash').json()['sale_id']
+                sale = Sale.objects.for_business(self.business).get(pk=sale_id)
+                self.assertEqual(float(sale.total_amount), 50.0)
+                self.assertEqual(self.client.get(reverse('sales:get_cart')).json()['items'], [])
+                
+                # Only the database store keeps rows between checkouts
+                self.assertEqual(CartItem.objects.exists(), False)
+                self.assertEqual(Cart.objects.for_business(self.business).exists(), store == 'db')
+                Product.objects.for_business(self.business).update(quantity=100)
+    
+    def test_cache_store_needs_a_shared_cache(self):
+        from django.core.exceptions import ImproperlyConfigured
+        from django.test import override_settings
+        from sales.cart_store import check_cart_store
+        
+        check_cart_store()  # The session store by default
+        self.use_store('cache')
+        with self.assertRaises(ImproperlyConfigured):
+            check_cart_store()
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cache_table'
+        }}):
+            check_cart_store()
+    
+    def test_stale_database_carts_are_pruned(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from sales.cart_store import prune_carts
+        from sales.models import Cart
+        
+        self.use_store('db')
+        self.post('add_to_cart', product_id=self.products[0].pk)
+        cart = Cart.objects.for_business(self.business).get()
+        
+        self.assertEqual(prune_carts(3600), 0)
+        Cart.objects.for_business(self.business).update(updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(prune_carts(3600), 0)  # Its line changed since
+        cart.cartitem_set.update(updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(prune_carts(3600), 1)
+        self.assertFalse(Cart.objects.for_business(self.business).exists())
+
+
+class SaleReversalTest(OfflineSyncTest):
+    def create_sale(self, quantities=(3, 2)):
+        from sales.services import checkout
+        
+        return checkout(self.business, [
+            {'product_id': product.pk, 'quantity': quantity, 'unit_price': '10.00'}
+            for product, quantity in zip(self.products, quantities)
+        ])
+    
+    def product_updates(self, queries):
+        return [query['sql'] for query in queries if query['sql'].startswith('UPDATE "products_product"')]
+    
+    def product_refunds(self):
+        from reports.models import ProductDailyRollup
+        
+        return {
+            product_id: refunds
+            for product_id, refunds in ProductDailyRollup.objects.for_business(self.business).values_list('product_id', 'refunds')
+            if refunds
+        }
+    
+    def test_delete_returns_the_stock_once(self):
+        from decimal import Decimal
+        from django.db import connection
+        from django.utils import timezone
+        from django.test.utils import CaptureQueriesContext
+        from reports.aggregates import sales_totals
+        from sales.models import Sale
+        from sales.services import delete_sale
+        
+        sale = self.create_sale()
+        self.assertEqual(self.stock(), [97.0, 98.0])
+        
+        with CaptureQueriesContext(connection) as queries:
+            delete_sale(sale)
+        self.assertEqual(len(self.product_updates(queries)), 1)
+        self.assertEqual(len(queries), 19)
+        self.assertEqual(self.stock(), [100.0, 100.0])
+        self.assertFalse(Sale.objects.for_business(self.business).exists())
+        
+        today = timezone.localdate()
+        totals = sales_totals(today, today, business=self.business)
+        self.assertEqual((totals['orders'], totals['items_sold'], totals['cogs']), (0, Decimal('0'), Decimal('0')))
+        
+        # Through the view
+        sale = self.create_sale()
+        response = self.client.post(reverse('sales:delete', args=[sale.pk]))
+        self.assertRedirects(response, reverse('sales:list'), fetch_redirect_response=False)
+        self.assertEqual(self.stock(), [100.0, 100.0])
+    
+    def test_partial_and_full_refunds_return_the_stock(self):
+        from decimal import Decimal
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from reports.rollups import rebuild_product_rollups
+        from sales.models import RefundItem, SaleItem
+        from sales.services import RefundError, delete_sale, refund_sale
+        
+        sale = self.create_sale()
+        first, second = SaleItem.objects.for_business(self.business).filter(sale=sale).order_by('pk')
+        
+        with CaptureQueriesContext(connection) as queries:
+            refund = refund_sale(sale, 'Damaged', quantities={first.pk: 1})
+        self.assertEqual(len(self.product_updates(queries)), 1)
+        self.assertEqual(len(queries), 16)
+        self.assertEqual(refund.refund_amount, Decimal('10.00'))
+        self.assertEqual(self.stock(), [98.0, 98.0])
+        self.assertEqual(self.product_refunds(), {first.product_id: Decimal('10.00')})
+        sale.refresh_from_db()
+        self.assertFalse(sale.is_refunded)
+        
+        with self.assertRaises(RefundError):
+            refund_sale(sale, 'Damaged', quantities={first.pk: 3})
+        self.assertEqual(self.stock(), [98.0, 98.0])
+        
+        # The rest of the sale, with one update for both products
+        with CaptureQueriesContext(connection) as queries:
+            refund = refund_sale(sale, 'Changed mind')
+        self.assertEqual(len(self.product_updates(queries)), 1)
+        self.assertEqual(refund.refund_amount, Decimal('40.00'))
+        self.assertEqual(
+            sorted(RefundItem.objects.for_business(self.business).filter(refund=refund).values_list('quantity', 'amount')),
+            [(Decimal('2.00'), Decimal('20.00')), (Decimal('2.00'), Decimal('20.00'))]
+        )
+        self.assertEqual(self.stock(), [100.0, 100.0])
+        sale.refresh_from_db()
+        self.assertTrue(sale.is_refunded)
+        with self.assertRaises(RefundError):
+            refund_sale(sale, 'Again')
+        
+        # Incremental maintenance must agree with a full rebuild
+        incremental = self.product_refunds()
+        self.assertEqual(incremental, {first.product_id: Decimal('30.00'), second.product_id: Decimal('20.00')})
+        rebuild_product_rollups(business=self.business)
+        self.assertEqual(self.product_refunds(), incremental)
+        
+        # The refunds returned the stock already
+        delete_sale(sale)
+        self.assertEqual(self.stock(), [100.0, 100.0])
+        self.assertEqual(self.product_refunds(), {})
+    
+    def test_refund_view_returns_the_posted_quantities(self):
+        from decimal import Decimal
+        from sales.models import Refund, SaleItem
+        
+        sale = self.create_sale()
+        first, second = SaleItem.objects.for_business(self.business).filter(sale=sale).order_by('pk')
+        self.assertContains(self.client.get(reverse('sales:refund', args=[sale.pk])), f'name="quantity_{first.pk}"')
+        
+        response = self.client.post(reverse('sales:refund', args=[sale.pk]), {
+            'reason': 'Damaged',
+            f'quantity_{first.pk}': '2',
+            f'quantity_{second.pk}': '0',
+        })
+        self.assertRedirects(response, reverse('sales:detail', args=[sale.pk]), fetch_redirect_response=False)
+        self.assertEqual(self.stock(), [99.0, 98.0])
+        self.assertEqual(Refund.objects.for_business(self.business).get(sale=sale).refund_amount, Decimal('20.00'))
+        
+        response = self.client.post(reverse('sales:refund', args=[sale.pk]), {
+            'reason': 'Damaged', f'quantity_{second.pk}': '5',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [99.0, 98.0])
@@ -12,7 +12,10 @@ urlpatterns = [
     path('<int:pk>/delete/', views.sale_delete, name='delete'),
     path('<int:pk>/refund/', views.sale_refund, name='refund'),
     path('pos/', views.pos_view, name='pos'),
+    path('pos/catalog/', views.pos_catalog, name='pos_catalog'),
     path('pos/process/', views.process_pos_sale, name='process_pos_sale'),
+    path('pos/offline-sync/', views.offline_sync, name='offline_sync'),
+    path('pos/sw.js', views.pos_service_worker, name='pos_service_worker'),
     path('pos/test-scanner/', views.test_scanner_view, name='test_scanner'),
     path('pos/scanner-test/', views.pos_scanner_test_view, name='pos_scanner_test'),
     path('pos/camera-test/', views.camera_test_view, name='camera_test'),
@@ -1,11 +1,11 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db import transaction
+from django.http import JsonResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import F
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
@@ -14,18 +14,34 @@ if TYPE_CHECKING:
     from products.models import Product as ProductModel
     from .models import Sale as SaleModel, Refund as RefundModel
 
-from .models import Sale, SaleItem, Refund
+from .models import Sale, SaleItem
 from .forms import SaleForm
+from .idempotency import (
+    IdempotencyKeyError, checkout_once, processed_sale_response, recorded_sale, request_idempotency_key,
+)
+from .offline import OfflineSyncError, sync_interval, sync_offline_sales
+from .services import (
+    CheckoutError, ProductNotFoundError, RefundError, delete_sale, refund_sale, refunded_quantities,
+)
+from products.barcode_index import lookup_barcode, lookup_sku
+from products.catalog import (
+    CATALOG_MAX_PAGE_SIZE, CATALOG_PAGE_SIZE, catalog_changes, catalog_page, current_catalog_version,
+)
 from products.models import Product
 from customers.models import Customer
 from superadmin.models import Business
+from superadmin.tenant_cache import session_business
 from superadmin.middleware import get_current_business
+from utils.pagination import paginate_request
+from decimal import Decimal, InvalidOperation
 import json
 
 @login_required
 def sale_list(request):
-    sales = Sale.objects.business_specific().all().prefetch_related('items__product')
-    return render(request, 'sales/list.html', {'sales': sales})
+    # Items are prefetched for the sales of the page only
+    sales = Sale.objects.business_specific().select_related('customer').prefetch_related('items__product')
+    page = paginate_request(request, sales)
+    return render(request, 'sales/list.html', {'sales': page, 'page': page})
 
 @login_required
 def sale_create(request):
@@ -36,7 +52,7 @@ def sale_create(request):
             current_business = None
             if 'current_business_id' in request.session:
                 try:
-                    current_business = Business.objects.get(id=request.session['current_business_id'])
+                    current_business = session_business(request)
                 except Business.DoesNotExist:
                     pass
             
@@ -79,20 +95,10 @@ def sale_delete(request, pk):
     sale = get_object_or_404(Sale.objects.business_specific(), pk=pk)
     
     if request.method == 'POST':
-        # Before deleting, we need to restore the product quantities
-        # This requires reversing the sale items
-        with transaction.atomic():  # type: ignore
-            # Restore product quantities
-            for item in sale.items.all():
-                product = item.product
-                product.quantity = F('quantity') + item.quantity
-                product.save()
-            
-            # Delete the sale (this will cascade delete sale items due to foreign key)
-            sale.delete()
-            
-            messages.success(request, 'Sale deleted successfully!')
-            return redirect('sales:list')
+        # Puts the stock of the sale's items back with one update
+        delete_sale(sale)
+        messages.success(request, 'Sale deleted successfully!')
+        return redirect('sales:list')
     
     return render(request, 'sales/confirm_delete.html', {'sale': sale})
 
@@ -104,33 +110,40 @@ def sale_detail(request, pk):
 @login_required
 def sale_refund(request, pk):
     sale = get_object_or_404(Sale.objects.business_specific(), pk=pk)
+    items = list(SaleItem.objects.for_business(sale.business).filter(sale=sale).select_related('product').order_by('pk'))
+    refunded = refunded_quantities(sale)
+    for item in items:
+        item.refundable = item.quantity - refunded.get(item.pk, 0)
     
     if request.method == 'POST':
         reason = request.POST.get('reason')
         refund_amount = request.POST.get('refund_amount')
         
-        if reason and refund_amount:
+        if reason:
             try:
-                refund_amount = float(refund_amount)
-                if refund_amount > float(sale.total_amount):
-                    messages.error(request, 'Refund amount cannot exceed sale total.')
-                else:
-                    # Process refund (in a real app, you would integrate with payment providers)
-                    refund = Refund.objects.create(  # type: ignore
-                        sale=sale,
-                        reason=reason,
-                        refund_amount=refund_amount
-                    )
-                    sale.is_refunded = True
-                    sale.save()
-                    messages.success(request, 'Refund processed successfully!')
-                    return redirect('sales:detail', pk=sale.pk)
-            except ValueError:
-                messages.error(request, 'Invalid refund amount.')
+                # Items returned per line; without lines on the form everything left is returned
+                quantities = None
+                if items:
+                    quantities = {
+                        item.pk: Decimal(request.POST.get(f'quantity_{item.pk}') or 0)
+                        for item in items
+                    }
+                refund_sale(
+                    sale,
+                    reason,
+                    refund_amount=Decimal(refund_amount) if refund_amount else None,
+                    quantities=quantities,
+                )
+                messages.success(request, 'Refund processed successfully!')
+                return redirect('sales:detail', pk=sale.pk)
+            except InvalidOperation:
+                messages.error(request, 'Invalid refund amount or quantity.')
+            except RefundError as e:
+                messages.error(request, str(e))
         else:
-            messages.error(request, 'Please provide a reason and refund amount.')
+            messages.error(request, 'Please provide a reason for the refund.')
     
-    return render(request, 'sales/refund.html', {'sale': sale})
+    return render(request, 'sales/refund.html', {'sale': sale, 'items': items})
 
 @login_required
 def pos_view(request):
@@ -155,7 +168,7 @@ def pos_view(request):
     # Try to get business from session first
     if 'current_business_id' in request.session:
         try:
-            current_business = Business.objects.get(id=request.session['current_business_id'])
+            current_business = session_business(request)
         except Business.DoesNotExist:
             # If business doesn't exist, remove from session
             if 'current_business_id' in request.session:
@@ -179,16 +192,82 @@ def pos_view(request):
         from superadmin.middleware import set_current_business
         set_current_business(current_business)
     
-    # Get products and customers for the current business
-    products = Product.objects.business_specific().filter(is_active=True)
+    # Products are loaded by the POS from the catalog endpoint (pos_catalog)
     customers = Customer.objects.business_specific().filter(is_active=True)
     
     return render(request, 'sales/pos_modern.html', {
-        'products': products,
         'customers': customers,
         'business_settings': business_settings
     })
 
+def _catalog_param(request, name, default):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    value = int(value)
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+    return value
+
+@login_required
+@require_http_methods(["GET"])
+def pos_catalog(request):
+    """
+    Compact, versioned product catalog for the POS.
+    
+    Without ``since`` it returns the active products page by page: pass the
+    ``next`` value of a page as ``after`` to get the following one. With
+    ``since=N`` it only returns the products changed after catalog version N
+    and the ids of products removed since. Clients keep the ``version`` of the
+    first page and use it as ``since`` on their next sync.
+    """
+    try:
+        business = session_business(request)
+    except Business.DoesNotExist:
+        business = get_current_business()
+    if not business:
+        return JsonResponse({'error': 'No business selected'}, status=400)
+    
+    try:
+        since = _catalog_param(request, 'since', None)
+        after = _catalog_param(request, 'after', 0)
+        limit = min(max(_catalog_param(request, 'limit', CATALOG_PAGE_SIZE), 1), CATALOG_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'since, after and limit must be non-negative integers'}, status=400)
+    
+    # Read the version before the products: a change committed in between is
+    # sent twice at worst, never skipped
+    version = current_catalog_version(business.pk)
+    mode = 'full' if since is None else 'delta'
+    etag = f'W/"catalog-{business.pk}-{version}-{mode}-{since}-{after}-{limit}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        if since is None:
+            page = catalog_page(business, after=after, limit=limit)
+        else:
+            page = catalog_changes(business, since, after=after, limit=limit)
+        response = JsonResponse({'version': version, 'mode': mode, **page})
+    
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def pos_service_worker(request):
+    """
+    Service worker of the modern POS. It is served under /sales/pos/ so that
+    its scope covers the POS page, which it keeps available offline together
+    with the assets the page loaded. The script holds nothing private and is
+    fetched without the session once the login expires, so it is public.
+    """
+    response = render(
+        request, 'sales/pos_sw.js', {'shell_url': reverse('sales:pos')},
+        content_type='application/javascript',
+    )
+    # Browsers compare the script on every registration to pick up updates
+    patch_cache_control(response, no_cache=True)
+    return response
+
 @login_required
 def test_scanner_view(request):
     return render(request, 'sales/test_scanner.html')
@@ -238,7 +317,7 @@ def process_pos_sale(request):
         # Try to get business from session first
         if 'current_business_id' in request.session:
             try:
-                current_business = Business.objects.get(id=request.session['current_business_id'])
+                current_business = session_business(request)
                 logger.info(f"Current business from session: {current_business}")
             except Business.DoesNotExist:
                 logger.error("Business not found for ID in session")
@@ -294,6 +373,16 @@ def process_pos_sale(request):
                 'error': 'Invalid request data format. Please try again.'
             }, status=400)
         
+        # A retry of a sale already recorded gets the original response
+        try:
+            idempotency_key = request_idempotency_key(request, data)
+            sale = recorded_sale(current_business, idempotency_key)
+        except (IdempotencyKeyError, CheckoutError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if sale is not None:
+            logger.info(f"Replaying sale {sale.pk} for idempotency key {idempotency_key}")
+            return processed_sale_response(sale, replayed=True)
+        
         # Extract sale data
         customer_id = data.get('customer_id')
         payment_method = data.get('payment_method', 'cash')
@@ -344,92 +433,43 @@ def process_pos_sale(request):
                 'error': 'Invalid discount amount. Discount cannot exceed the subtotal.'
             }, status=400)
         
-        # Create the sale in a transaction
-        logger.info("Starting database transaction")
-        with transaction.atomic():  # type: ignore
-            # Create the sale
-            sale_data = {
-                'subtotal': subtotal,
-                'tax': tax,
-                'discount': discount,
-                'total_amount': total_amount,
-                'payment_method': payment_method,
-                'business': current_business,  # Associate with current business
-            }
-            
-            logger.info(f"Preparing sale data: {sale_data}")
-            
-            if customer_id:
-                # Verify customer belongs to current business
-                try:
-                    customer = Customer.objects.business_specific().get(pk=customer_id)
-                    sale_data['customer'] = customer
-                    logger.info(f"Customer found: {customer}")
-                except Customer.DoesNotExist:
-                    logger.warning(f"Customer {customer_id} not found in current business")
-                    # Continue without customer
-            
-            logger.info(f"Creating sale with data: {sale_data}")
+        customer = None
+        if customer_id:
+            # Verify customer belongs to current business
             try:
-                sale = Sale.objects.create(**sale_data)  # type: ignore
-                logger.info(f"Sale created with ID: {sale.pk}")
-            except Exception as e:
-                logger.error(f"Error creating sale: {str(e)}")
-                return JsonResponse({
-                    'error': f'Error creating sale record: {str(e)}'
-                }, status=500)
-            
-            # Create sale items (stock will be automatically updated by signals)
-            for i, item in enumerate(cart_items):
-                product_id = item['id']
-                quantity = float(item['quantity'])
-                price = float(item['price'])
-                total_price = quantity * price
-                
-                logger.info(f"Creating sale item {i} - Product ID: {product_id}, Quantity: {quantity}, Price: {price}")
-                
-                # Verify product belongs to current business
-                try:
-                    product = Product.objects.business_specific().get(pk=product_id)
-                    logger.info(f"Product found: {product}")
-                except Product.DoesNotExist:
-                    logger.error(f"Product {product_id} not found in current business")
-                    return JsonResponse({
-                        'error': f'Product not found: {item.get("name", "Unknown product")}. Please refresh and try again.'
-                    }, status=400)
-                
-                # Check if sufficient stock is available
-                if float(product.quantity) < quantity:
-                    logger.error(f"Insufficient stock for product {product.name}")
-                    return JsonResponse({
-                        'error': f'Insufficient stock for {product.name}. Available: {product.quantity}, Requested: {quantity}'
-                    }, status=400)
-                
-                # Create sale item
-                try:
-                    sale_item = SaleItem.objects.create(  # type: ignore
-                        sale=sale,
-                        product=product,  # Use the product object instead of product_id
-                        quantity=quantity,
-                        unit_price=price,
-                        total_price=total_price
-                    )
-                    logger.info(f"Sale item created: {sale_item}")
-                except Exception as e:
-                    logger.error(f"Error creating sale item: {str(e)}")
-                    return JsonResponse({
-                        'error': f'Error creating sale item: {str(e)}'
-                    }, status=500)
-                
-                # Note: Product quantity is now automatically updated by signals
-                # No need to manually update product.quantity here
+                customer = Customer.objects.business_specific().get(pk=customer_id)
+                logger.info(f"Customer found: {customer}")
+            except Customer.DoesNotExist:
+                logger.warning(f"Customer {customer_id} not found in current business")
+                # Continue without customer
+        
+        # Lock the products, record the sale lines and take the stock off in one transaction
+        try:
+            sale, replayed = checkout_once(
+                current_business,
+                idempotency_key,
+                [
+                    {'product_id': item['id'], 'quantity': item['quantity'], 'unit_price': item['price']}
+                    for item in cart_items
+                ],
+                cart_items,
+                customer=customer,
+                payment_method=payment_method,
+                discount=discount,
+                tax=tax,
+            )
+        except ProductNotFoundError as e:
+            names = {str(item['id']): item.get('name') for item in cart_items}
+            logger.error(f"Product {e.product_id} not found in current business")
+            return JsonResponse({
+                'error': f'Product not found: {names.get(str(e.product_id)) or "Unknown product"}. Please refresh and try again.'
+            }, status=400)
+        except CheckoutError as e:
+            logger.error(f"Checkout failed: {str(e)}")
+            return JsonResponse({'error': str(e)}, status=400)
             
         logger.info(f"=== SALE PROCESSED SUCCESSFULLY! Sale ID: {sale.pk} ===")
-        return JsonResponse({
-            'success': True,
-            'sale_id': sale.pk,
-            'message': 'Sale processed successfully!'
-        })
+        return processed_sale_response(sale, replayed)
         
     except Exception as e:
         import logging
@@ -443,6 +483,42 @@ def process_pos_sale(request):
             'error': f'An unexpected error occurred while processing your sale. Please try again. Error details: {str(e)}'
         }, status=500)
 
+@login_required
+@require_http_methods(["POST"])
+def offline_sync(request):
+    """
+    Record the sales a till queued while offline. The body is
+    ``{"sales": [...]}``, each sale with the fields of process_pos_sale plus
+    a client-generated ``idempotency_key`` and its ``created_at`` time;
+    keys already recorded are reported back, never recorded twice.
+    """
+    try:
+        business = session_business(request)
+    except Business.DoesNotExist:
+        business = get_current_business()
+    if not business:
+        return JsonResponse({'error': 'No business selected'}, status=400)
+    
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid request data format.'}, status=400)
+    
+    try:
+        results = sync_offline_sales(business, data.get('sales') if isinstance(data, dict) else None)
+    except OfflineSyncError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except CheckoutError as e:
+        # Stock changed under the batch; nothing was recorded, the till retries
+        return JsonResponse({'error': str(e)}, status=409)
+    
+    return JsonResponse({
+        'results': results,
+        'synced': sum(result['status'] == 'synced' for result in results),
+        'failed': sum(result['status'] != 'synced' for result in results),
+        'sync_interval': sync_interval(business),
+    })
+
 def get_product_details(request, product_id):
     """AJAX view to get product details for POS - No login required for product details"""
     try:
@@ -459,19 +535,24 @@ def get_product_details(request, product_id):
         return JsonResponse({'error': str(e)}, status=400)
 
 def get_product_by_barcode(request, barcode):
-    """AJAX view to get product details by barcode"""
-    try:
-        product = get_object_or_404(Product.objects.business_specific(), barcode=barcode)
-        data = {
-            'id': product.pk,
-            'name': product.name,
-            'price': float(product.selling_price),
-            'stock': float(product.quantity),
-            'unit': product.unit.symbol
-        }
-        return JsonResponse(data)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=400)
+    """
+    AJAX view to get product details by barcode, or by SKU for codes typed in
+    by hand, served from the barcode index
+    """
+    business = get_current_business()
+    product = None
+    if business:
+        product = lookup_barcode(business.pk, barcode) or lookup_sku(business.pk, barcode)
+    if product is None:
+        return JsonResponse({'error': f'No product with barcode {barcode}'}, status=400)
+    data = {
+        'id': product['id'],
+        'name': product['name'],
+        'price': float(product['price']),
+        'stock': float(product['stock']),
+        'unit': product['unit']
+    }
+    return JsonResponse(data)
 
 @login_required
 def pos_test(request):
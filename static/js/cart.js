@@ -346,6 +346,8 @@ class ModernCartSystem {
         const discountInput = document.getElementById('discountInput');
         
         const saleData = {
+            // Lets the server record the sale once, however often it is sent
+            idempotency_key: this.checkoutKey || (this.checkoutKey = this.newIdempotencyKey()),
             customer_id: customerSelect ? customerSelect.value : null,
             payment_method: paymentOptions.length > 0 ? paymentOptions[0].dataset.method : 'cash',
             discount: discountInput ? parseFloat(discountInput.value) || 0 : 0
@@ -369,7 +371,8 @@ class ModernCartSystem {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
-                    'X-CSRFToken': csrfToken
+                    'X-CSRFToken': csrfToken,
+                    'Idempotency-Key': saleData.idempotency_key
                 },
                 body: JSON.stringify(saleData)
             });
@@ -411,8 +414,17 @@ class ModernCartSystem {
         }
     }
 
+    newIdempotencyKey() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+    }
+
     // Update cart display in UI
     updateCartDisplay() {
+        // A changed cart is a different sale, sent with a new idempotency key
+        this.checkoutKey = null;
         const cartItemsContainer = document.getElementById('cartItems');
         const cartItemCount = document.getElementById('cartItemCount');
         const cartSubtotal = document.getElementById('cartSubtotal');
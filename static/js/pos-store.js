@@ -0,0 +1,99 @@
+// IndexedDB storage of the modern POS: the product catalog and the sales
+// waiting to be sent, one database per business
+class POSStore {
+    constructor(businessId) {
+        this.name = `pos:${businessId}`;
+        this.db = null;
+    }
+
+    static isSupported() {
+        return typeof indexedDB !== 'undefined';
+    }
+
+    // Resolve with the result of an IndexedDB request
+    static request(request) {
+        return new Promise((resolve, reject) => {
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    // Resolve once a transaction is committed
+    static done(transaction) {
+        return new Promise((resolve, reject) => {
+            transaction.oncomplete = () => resolve();
+            transaction.onerror = () => reject(transaction.error);
+            transaction.onabort = () => reject(transaction.error);
+        });
+    }
+
+    async open() {
+        const request = indexedDB.open(this.name, 1);
+        request.onupgradeneeded = () => {
+            const db = request.result;
+            db.createObjectStore('products', { keyPath: 'id' });
+            db.createObjectStore('meta');
+            const sales = db.createObjectStore('sales', { keyPath: 'idempotency_key' });
+            sales.createIndex('created_at', 'created_at');
+        };
+        this.db = await POSStore.request(request);
+        return this;
+    }
+
+    async loadCatalog() {
+        const transaction = this.db.transaction(['products', 'meta'], 'readonly');
+        const [products, version] = await Promise.all([
+            POSStore.request(transaction.objectStore('products').getAll()),
+            POSStore.request(transaction.objectStore('meta').get('catalogVersion'))
+        ]);
+        return { products: products, version: version || 0 };
+    }
+
+    // A full load replaces the stored products, a delta patches them
+    saveCatalog(version, products, deleted, replace) {
+        const transaction = this.db.transaction(['products', 'meta'], 'readwrite');
+        const store = transaction.objectStore('products');
+        if (replace) {
+            store.clear();
+        }
+        products.forEach(product => store.put(product));
+        deleted.forEach(productId => store.delete(productId));
+        transaction.objectStore('meta').put(version, 'catalogVersion');
+        return POSStore.done(transaction);
+    }
+
+    queueSales(sales) {
+        const transaction = this.db.transaction('sales', 'readwrite');
+        const store = transaction.objectStore('sales');
+        sales.forEach(sale => store.put(sale));
+        return POSStore.done(transaction);
+    }
+
+    // The oldest queued sales first, leaving out the keys in skip
+    queuedSales(limit, skip = new Set()) {
+        const transaction = this.db.transaction('sales', 'readonly');
+        const request = transaction.objectStore('sales').index('created_at').openCursor();
+        const sales = [];
+        return new Promise((resolve, reject) => {
+            request.onsuccess = () => {
+                const cursor = request.result;
+                if (!cursor || sales.length >= limit) {
+                    resolve(sales);
+                    return;
+                }
+                if (!skip.has(cursor.primaryKey)) {
+                    sales.push(cursor.value);
+                }
+                cursor.continue();
+            };
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    removeSales(keys) {
+        const transaction = this.db.transaction('sales', 'readwrite');
+        const store = transaction.objectStore('sales');
+        keys.forEach(key => store.delete(key));
+        return POSStore.done(transaction);
+    }
+}
@@ -10,6 +10,20 @@ class POSSystem {
         this.scanProcessing = false;
         this.pendingRequests = new Map(); // Track pending requests to prevent duplicates
         this.autoStopScanner = false; // Changed default to false for continuous scanning
+        this.catalog = new Map(); // Product id -> catalog entry, synced from the catalog endpoint
+        this.barcodes = new Map(); // Barcode -> product id, to resolve scans without the server
+        this.skus = new Map(); // SKU -> product id, for codes typed in by hand
+        this.catalogVersion = 0;
+        this.catalogSyncing = false;
+        this.catalogRefreshInterval = 60; // Seconds between catalog delta syncs
+        this.store = null; // IndexedDB storage, when the browser has it
+        this.maxRenderedProducts = 200; // Cards rendered at once; search narrows the rest
+        this.offlineSyncTimer = null;
+        this.offlineSyncing = false;
+        this.offlineSyncBatchSize = 100; // Sales per sync request
+        this.saleAttempts = 3; // Tries to send a sale before queueing it
+        this.saleTimeout = 5000; // Milliseconds to wait for each try
+        this.checkoutKey = null; // Idempotency key of the sale in the cart
         this.init();
     }
 
@@ -18,6 +32,63 @@ class POSSystem {
         this.bindEvents();
         this.loadCartFromStorage();
         this.updateCartDisplay();
+        this.storeReady = this.openStore();
+        this.loadCatalog();
+        this.registerServiceWorker();
+        // Flush sales queued while offline as soon as the connection is back
+        window.addEventListener('online', () => {
+            this.syncOfflineSales();
+            this.refreshCatalog();
+        });
+        setInterval(() => this.refreshCatalog(), this.catalogRefreshInterval * 1000);
+        this.syncOfflineSales();
+    }
+
+    async openStore() {
+        const grid = document.getElementById('productsGrid');
+        if (!grid || typeof POSStore === 'undefined' || !POSStore.isSupported()) {
+            return;
+        }
+        try {
+            this.store = await new POSStore(grid.dataset.businessId).open();
+        } catch (e) {
+            console.error('Error opening the POS database:', e);
+            return;
+        }
+
+        // Move what earlier versions kept in localStorage
+        try {
+            const queued = JSON.parse(localStorage.getItem(this.offlineQueueKey()) || '[]');
+            if (queued.length > 0) {
+                await this.store.queueSales(queued);
+            }
+            localStorage.removeItem(this.offlineQueueKey());
+            localStorage.removeItem(`posCatalog:${grid.dataset.businessId}`);
+        } catch (e) {
+            console.error('Error moving offline sales to the POS database:', e);
+        }
+    }
+
+    registerServiceWorker() {
+        // The worker keeps the page and its assets available offline
+        const grid = document.getElementById('productsGrid');
+        if (!grid || !grid.dataset.serviceWorkerUrl || !('serviceWorker' in navigator)) {
+            return;
+        }
+        navigator.serviceWorker.register(grid.dataset.serviceWorkerUrl)
+            .then(() => navigator.serviceWorker.ready)
+            .then(registration => {
+                // Everything this page loaded, so the first visit is cached too
+                const assets = performance.getEntriesByType('resource')
+                    .filter(entry => ['script', 'link', 'css', 'img'].includes(entry.initiatorType))
+                    .map(entry => entry.name);
+                registration.active.postMessage({
+                    type: 'cache-shell',
+                    page: window.location.pathname,
+                    assets: assets
+                });
+            })
+            .catch(e => console.error('Error registering the POS service worker:', e));
     }
 
     bindEvents() {
@@ -556,8 +627,29 @@ class POSSystem {
         console.log('Scanner state reset for continuous scanning');
     }
 
+    // Find a product of the local catalog by barcode, or by SKU like the server does
+    findCatalogProduct(code) {
+        const productId = this.barcodes.has(code) ? this.barcodes.get(code) : this.skus.get(code);
+        return productId === undefined ? null : this.catalog.get(productId);
+    }
+
     // Search for product by barcode and add to cart - NOW RETURNS PROMISE
     searchProductByBarcode(barcode) {
+        // Codes of the local catalog are resolved without a round trip
+        const product = this.findCatalogProduct(barcode);
+        if (product) {
+            const added = this.addProductToCartFromData({
+                id: product.id,
+                name: product.name,
+                price: parseFloat(product.price),
+                stock: parseFloat(product.stock)
+            });
+            if (added) {
+                this.showNotification(`Added ${product.name} to cart`, 'success');
+            }
+            return Promise.resolve();
+        }
+
         // Show loading indicator
         this.showLoading(true);
         
@@ -580,9 +672,8 @@ class POSSystem {
                 
                 if (data.error) {
                     this.showNotification(`Product not found: ${data.error}`, 'warning');
-                } else {
-                    // Add product to cart
-                    this.addProductToCartFromData(data);
+                } else if (this.addProductToCartFromData(data)) {
+                    // Not in the local catalog yet; the next delta sync brings it
                     this.showNotification(`Added ${data.name} to cart`, 'success');
                 }
             })
@@ -609,13 +700,13 @@ class POSSystem {
                 existingItem.quantity += 1;
             } else {
                 this.showNotification('Cannot add more of this item. Insufficient stock.', 'warning');
-                return;
+                return false;
             }
         } else {
             // Check stock before adding
             if (productData.stock <= 0) {
                 this.showNotification('This product is out of stock.', 'warning');
-                return;
+                return false;
             }
             
             // Add new item to cart
@@ -631,6 +722,7 @@ class POSSystem {
         // Save cart and update display
         this.saveCartToStorage();
         this.updateCartDisplay();
+        return true;
     }
 
     addProductToCart(productCard) {
@@ -724,6 +816,9 @@ class POSSystem {
         const cartTotal = document.getElementById('cartTotal');
         const checkoutButton = document.getElementById('checkoutButton');
         
+        // A changed cart is a different sale, sent with a new idempotency key
+        this.checkoutKey = null;
+        
         if (!cartItemsContainer) return;
         
         // Update cart items count
@@ -855,15 +950,182 @@ class POSSystem {
         `;
     }
 
+    putCatalogProduct(product) {
+        this.deleteCatalogProduct(product.id);
+        this.catalog.set(product.id, product);
+        if (product.barcode) {
+            this.barcodes.set(product.barcode, product.id);
+        }
+        if (product.sku) {
+            this.skus.set(product.sku, product.id);
+        }
+    }
+
+    deleteCatalogProduct(productId) {
+        const product = this.catalog.get(productId);
+        if (!product) {
+            return;
+        }
+        this.catalog.delete(productId);
+        if (this.barcodes.get(product.barcode) === productId) {
+            this.barcodes.delete(product.barcode);
+        }
+        if (this.skus.get(product.sku) === productId) {
+            this.skus.delete(product.sku);
+        }
+    }
+
+    async loadCatalog() {
+        // Start from the catalog stored in IndexedDB and only pull what changed since
+        const grid = document.getElementById('productsGrid');
+        if (!grid || !grid.dataset.catalogUrl) {
+            return;
+        }
+
+        await this.storeReady;
+        if (this.store) {
+            try {
+                const stored = await this.store.loadCatalog();
+                this.catalogVersion = stored.version;
+                stored.products.forEach(product => this.putCatalogProduct(product));
+                if (this.catalog.size > 0) {
+                    this.renderProducts();
+                }
+            } catch (e) {
+                console.error('Error loading catalog from the POS database:', e);
+                this.catalog.clear();
+                this.barcodes.clear();
+                this.skus.clear();
+                this.catalogVersion = 0;
+            }
+        }
+
+        try {
+            await this.syncCatalog();
+        } catch (e) {
+            console.error('Error syncing catalog:', e);
+            if (this.catalog.size === 0) {
+                this.showNotification('Could not load products. Please refresh the page.', 'error');
+            }
+        }
+        this.renderProducts();
+    }
+
+    async refreshCatalog() {
+        // Periodic delta sync; the grid is only redrawn when something changed
+        if (this.catalog.size === 0 || !navigator.onLine || document.hidden) {
+            return;
+        }
+        try {
+            if (await this.syncCatalog()) {
+                const productSearch = document.getElementById('productSearch');
+                this.filterProducts(productSearch ? productSearch.value : '');
+            }
+        } catch (e) {
+            console.error('Error refreshing catalog:', e);
+        }
+    }
+
+    async syncCatalog() {
+        // Full load when the catalog is empty, otherwise a delta since its version.
+        // Returns whether anything changed.
+        const grid = document.getElementById('productsGrid');
+        if (this.catalogSyncing || !grid || !grid.dataset.catalogUrl) {
+            return false;
+        }
+        this.catalogSyncing = true;
+        try {
+            const since = this.catalog.size > 0 ? this.catalogVersion : null;
+            let after = 0;
+            let version = null;
+            const changed = [];
+            const deleted = [];
+            do {
+                const params = new URLSearchParams({ after: after });
+                if (since !== null) {
+                    params.set('since', since);
+                }
+                const response = await fetch(`${grid.dataset.catalogUrl}?${params}`, {
+                    credentials: 'same-origin',
+                    headers: { 'Accept': 'application/json' }
+                });
+                if (!response.ok) {
+                    throw new Error(`Catalog request failed with status ${response.status}`);
+                }
+                const page = await response.json();
+                if (version === null) {
+                    version = page.version;
+                }
+                changed.push(...page.products);
+                deleted.push(...page.deleted);
+                after = page.next;
+            } while (after);
+
+            if (since === null) {
+                this.catalog.clear();
+                this.barcodes.clear();
+                this.skus.clear();
+            }
+            changed.forEach(product => this.putCatalogProduct(product));
+            deleted.forEach(productId => this.deleteCatalogProduct(productId));
+            this.catalogVersion = version;
+
+            if (this.store) {
+                try {
+                    await this.store.saveCatalog(version, changed, deleted, since === null);
+                } catch (e) {
+                    // The next page load syncs again from the stored version
+                    console.error('Error saving catalog to the POS database:', e);
+                }
+            }
+            return since === null || changed.length > 0 || deleted.length > 0;
+        } finally {
+            this.catalogSyncing = false;
+        }
+    }
+
+    renderProducts(products) {
+        const grid = document.getElementById('productsGrid');
+        if (!grid) {
+            return;
+        }
+        if (products === undefined) {
+            products = Array.from(this.catalog.values()).sort((a, b) => a.name.localeCompare(b.name));
+        }
+        if (products.length === 0) {
+            grid.innerHTML = '<div class="no-products">No products available</div>';
+            return;
+        }
+
+        const currencySymbol = grid.dataset.currencySymbol || this.getCurrencySymbol();
+        const escape = (value) => {
+            const element = document.createElement('span');
+            element.textContent = value === null || value === undefined ? '' : value;
+            return element.innerHTML;
+        };
+        grid.innerHTML = products.slice(0, this.maxRenderedProducts).map(product => `
+            <div class="product-card" data-product-id="${product.id}" data-product-name="${escape(product.name)}" data-product-price="${product.price}" data-product-stock="${product.stock}">
+                <div class="product-image">
+                    <i class="fas fa-box"></i>
+                </div>
+                <div class="product-info">
+                    <h6>${escape(product.name)}</h6>
+                    <p class="product-price">${escape(currencySymbol)}${product.price}</p>
+                    <p class="product-stock">${parseFloat(product.stock)} left</p>
+                </div>
+                <button class="add-to-cart-btn btn btn-primary btn-sm">
+                    <i class="fas fa-plus"></i> Add
+                </button>
+            </div>
+        `).join('');
+    }
+
     filterProducts(searchTerm) {
-        const productCards = document.querySelectorAll('.product-card');
         const suggestionsContainer = document.getElementById('productSuggestions');
         
         if (!searchTerm) {
             // Show all products
-            productCards.forEach(card => {
-                card.style.display = 'block';
-            });
+            this.renderProducts();
             
             if (suggestionsContainer) {
                 suggestionsContainer.innerHTML = '';
@@ -872,29 +1134,28 @@ class POSSystem {
             return;
         }
         
-        // Filter products by name
+        // Filter the cached catalog by name, SKU or barcode
+        const term = searchTerm.toLowerCase();
         const filteredProducts = [];
-        productCards.forEach(card => {
-            const productName = card.querySelector('h6').textContent.toLowerCase();
-            if (productName.includes(searchTerm.toLowerCase())) {
-                card.style.display = 'block';
-                filteredProducts.push({
-                    id: card.dataset.productId,
-                    name: card.querySelector('h6').textContent,
-                    element: card
-                });
-            } else {
-                card.style.display = 'none';
+        this.catalog.forEach(product => {
+            if (product.name.toLowerCase().includes(term) ||
+                (product.sku || '').toLowerCase().includes(term) ||
+                (product.barcode || '').toLowerCase() === term) {
+                filteredProducts.push(product);
             }
         });
+        filteredProducts.sort((a, b) => a.name.localeCompare(b.name));
+        this.renderProducts(filteredProducts);
         
         // Show suggestions
         if (suggestionsContainer && filteredProducts.length > 0) {
             let suggestionsHTML = '';
             filteredProducts.slice(0, 5).forEach(product => {
+                const name = document.createElement('span');
+                name.textContent = product.name;
                 suggestionsHTML += `
                     <div class="suggestion-item" data-product-id="${product.id}">
-                        ${product.name}
+                        ${name.innerHTML}
                     </div>
                 `;
             });
@@ -919,6 +1180,10 @@ class POSSystem {
         const discountInput = document.getElementById('discountInput');
         
         const saleData = {
+            // Lets the server record the sale once, however often it is sent,
+            // including when the cashier presses the button again
+            idempotency_key: this.checkoutKey || (this.checkoutKey = this.newIdempotencyKey()),
+            created_at: new Date().toISOString(),
             customer_id: customerSelect ? customerSelect.value : null,
             payment_method: paymentOptions.length > 0 ? paymentOptions[0].dataset.method : 'cash',
             discount: discountInput ? parseFloat(discountInput.value) || 0 : 0,
@@ -947,20 +1212,14 @@ class POSSystem {
         const csrfToken = csrfTokenElement.value;
         console.log('CSRF Token:', csrfToken);
         
-        // Use the correct URL endpoint - FIXED: was '/sales/process/' but should be '/sales/pos/process/'
-        fetch('/sales/pos/process/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
-            },
-            body: JSON.stringify(saleData)
-        })
+        this.postSale(saleData, csrfToken)
         .then(response => {
             console.log('Response status:', response.status);
             console.log('Response headers:', [...response.headers.entries()]);
             if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+                const error = new Error(`HTTP error! status: ${response.status}`);
+                error.status = response.status;
+                throw error;
             }
             return response.json();
         })
@@ -986,6 +1245,19 @@ class POSSystem {
         })
         .catch(error => {
             console.error('Error:', error);
+            if (error.status === undefined) {
+                // The server could not be reached: keep the sale and sync it later
+                return this.queueOfflineSale(saleData).then(() => {
+                    this.cart = [];
+                    this.saveCartToStorage();
+                    this.updateCartDisplay();
+                    this.updateOrderSummary();
+                    this.showNotification('You are offline. The sale was saved and will be synced when the connection is back.', 'warning');
+                }, e => {
+                    console.error('Error queueing offline sale:', e);
+                    this.showNotification('You are offline and the sale could not be saved. Please try again.', 'error');
+                });
+            }
             this.showNotification('Error processing sale. Please try again.', 'error');
         })
         .finally(() => {
@@ -993,6 +1265,42 @@ class POSSystem {
         });
     }
 
+    // Retrying is safe: the server records a sale once per idempotency key
+    async postSale(saleData, csrfToken) {
+        let lastError = null;
+        for (let attempt = 0; attempt < this.saleAttempts; attempt++) {
+            if (attempt > 0) {
+                await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+            }
+            const controller = new AbortController();
+            const timer = setTimeout(() => controller.abort(), this.saleTimeout);
+            try {
+                // Use the correct URL endpoint - FIXED: was '/sales/process/' but should be '/sales/pos/process/'
+                const response = await fetch('/sales/pos/process/', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'X-CSRFToken': csrfToken,
+                        'Idempotency-Key': saleData.idempotency_key
+                    },
+                    body: JSON.stringify(saleData),
+                    signal: controller.signal
+                });
+                if (response.status < 500) {
+                    return response;
+                }
+                lastError = new Error(`HTTP error! status: ${response.status}`);
+                lastError.status = response.status;
+            } catch (e) {
+                // Unreachable or timed out; the sale may have been recorded, the key tells
+                lastError = e;
+            } finally {
+                clearTimeout(timer);
+            }
+        }
+        throw lastError;
+    }
+
     showNotification(message, type = 'info') {
         // Remove any existing notifications of the same type
         const existingNotifications = document.querySelectorAll(`.notification-${type}`);
@@ -1143,6 +1451,135 @@ class POSSystem {
         }
     }
 
+    newIdempotencyKey() {
+        if (window.crypto && window.crypto.randomUUID) {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    offlineQueueKey() {
+        const grid = document.getElementById('productsGrid');
+        return `posOfflineSales:${grid ? grid.dataset.businessId : ''}`;
+    }
+
+    loadOfflineSales() {
+        try {
+            return JSON.parse(localStorage.getItem(this.offlineQueueKey()) || '[]');
+        } catch (e) {
+            console.error('Error loading offline sales from localStorage:', e);
+            return [];
+        }
+    }
+
+    saveOfflineSales(sales) {
+        try {
+            localStorage.setItem(this.offlineQueueKey(), JSON.stringify(sales));
+        } catch (e) {
+            console.error('Error saving offline sales to localStorage:', e);
+        }
+    }
+
+    // The queue lives in IndexedDB, or in localStorage without it
+    async queueOfflineSale(saleData) {
+        await this.storeReady;
+        if (this.store) {
+            await this.store.queueSales([saleData]);
+        } else {
+            const sales = this.loadOfflineSales();
+            sales.push(saleData);
+            this.saveOfflineSales(sales);
+        }
+        this.scheduleOfflineSync(30);
+    }
+
+    async queuedSales(limit, skip = new Set()) {
+        await this.storeReady;
+        if (this.store) {
+            return this.store.queuedSales(limit, skip);
+        }
+        return this.loadOfflineSales().filter(sale => !skip.has(sale.idempotency_key)).slice(0, limit);
+    }
+
+    async dequeueSales(keys) {
+        if (this.store) {
+            await this.store.removeSales(keys);
+        } else {
+            const done = new Set(keys);
+            this.saveOfflineSales(this.loadOfflineSales().filter(sale => !done.has(sale.idempotency_key)));
+        }
+    }
+
+    scheduleOfflineSync(seconds) {
+        clearTimeout(this.offlineSyncTimer);
+        this.offlineSyncTimer = setTimeout(() => this.syncOfflineSales(), seconds * 1000);
+    }
+
+    async syncOfflineSales() {
+        // Send the queued sales in batches; the server skips keys it already recorded
+        const grid = document.getElementById('productsGrid');
+        const csrfTokenElement = document.querySelector('[name=csrfmiddlewaretoken]');
+        if (this.offlineSyncing || !grid || !grid.dataset.offlineSyncUrl || !csrfTokenElement) {
+            return;
+        }
+
+        this.offlineSyncing = true;
+        let interval = 30;
+        let synced = 0;
+        let failed = 0;
+        // Failed sales stay queued; they are sent once per sync
+        const retry = new Set();
+        try {
+            let batch = await this.queuedSales(this.offlineSyncBatchSize, retry);
+            while (batch.length > 0) {
+                const response = await fetch(grid.dataset.offlineSyncUrl, {
+                    method: 'POST',
+                    credentials: 'same-origin',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'X-CSRFToken': csrfTokenElement.value
+                    },
+                    body: JSON.stringify({ sales: batch })
+                });
+                if (!response.ok) {
+                    throw new Error(`Offline sync failed with status ${response.status}`);
+                }
+                const data = await response.json();
+                interval = data.sync_interval || interval;
+                synced += data.synced;
+                failed += data.failed;
+
+                // Synced and rejected sales are done with; a failed one (out of stock, say)
+                // is recorded by the server when its key is sent again
+                const done = [];
+                data.results.forEach(result => {
+                    if (result.status === 'failed') {
+                        retry.add(result.idempotency_key);
+                    } else {
+                        done.push(result.idempotency_key);
+                    }
+                });
+                await this.dequeueSales(done);
+                batch = await this.queuedSales(this.offlineSyncBatchSize, retry);
+            }
+            if (retry.size > 0) {
+                this.scheduleOfflineSync(interval);
+            }
+        } catch (e) {
+            console.error('Error syncing offline sales:', e);
+            this.scheduleOfflineSync(interval);
+        } finally {
+            this.offlineSyncing = false;
+        }
+
+        if (synced > 0) {
+            this.showNotification(`Synced ${synced} offline sale${synced === 1 ? '' : 's'}.`, 'success');
+        }
+        if (failed > 0) {
+            this.showNotification(`${failed} offline sale${failed === 1 ? '' : 's'} could not be recorded yet and will be retried; check the stock of their products.`, 'error');
+        }
+    }
+
     // New method to manually stop the scanner
     manuallyStopScanner() {
         this.scannerStopping = true;
@@ -1188,5 +1625,7 @@ class POSSystem {
 
 // Initialize POS system when DOM is loaded
 document.addEventListener('DOMContentLoaded', function() {
-    window.posSystem = new POSSystem();
+    if (!window.posSystem) {
+        window.posSystem = new POSSystem();
+    }
 });
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class SuperadminConfig(AppConfig):
+    name = 'superadmin'
+
+    def ready(self):
+        import superadmin.signals
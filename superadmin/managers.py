@@ -33,6 +33,13 @@ class BusinessSpecificManager(models.Manager):
         # Bypass the current business context filtering and filter directly by business
         return super().get_queryset().filter(business=business)
     
+    def all_businesses(self):
+        """
+        Return objects across every business, bypassing the business context.
+        Only intended for maintenance tasks such as management commands.
+        """
+        return super().get_queryset()
+    
     def for_branch(self, branch):
         """
         Filter objects by a specific branch.
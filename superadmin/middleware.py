@@ -1,49 +1,122 @@
-from threading import local
+"""
+The current business (tenant) of a request, job or command.
 
-# Thread-local storage for the current business context
-_thread_locals = local()
+The business is held in a context variable rather than a thread-local, so
+it follows the code that runs on its behalf: each asyncio task of an ASGI
+server sees its own request's business, sync views run through
+``sync_to_async`` inherit it, and the chunks of a streaming response are
+produced with the business of the request that returned it, even though
+that happens after the middleware has finished.
+
+Outside requests use ``business_context``, which restores whatever was
+current before on exit::
+
+    with business_context(business):
+        Product.objects.business_specific()
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+import asyncio
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import FileResponse
+
+# The business BusinessSpecificManager filters by
+_current_business = ContextVar('current_business', default=None)
 
 def set_current_business(business):
-    """Set the current business in thread-local storage"""
-    _thread_locals.current_business = business
+    """Set the current business for the rest of the current context"""
+    _current_business.set(business)
 
 def get_current_business():
-    """Get the current business from thread-local storage"""
-    return getattr(_thread_locals, 'current_business', None)
+    """Get the current business, or None outside any business context"""
+    return _current_business.get()
 
 def clear_current_business():
-    """Clear the current business from thread-local storage"""
-    if hasattr(_thread_locals, 'current_business'):
-        delattr(_thread_locals, 'current_business')
+    """Clear the current business for the rest of the current context"""
+    _current_business.set(None)
+
+@contextmanager
+def business_context(business):
+    """Make ``business`` the current business inside the ``with`` block"""
+    token = _current_business.set(business)
+    try:
+        yield business
+    finally:
+        _current_business.reset(token)
+
+def _iterate_in_context(context, iterator):
+    # Every chunk is produced inside the context, without it leaking between chunks
+    iterator = iter(iterator)
+    while True:
+        try:
+            yield context.run(next, iterator)
+        except StopIteration:
+            return
+
+async def _aiterate_in_context(context, iterator):
+    iterator = aiter(iterator)
+    while True:
+        try:
+            yield await asyncio.create_task(anext(iterator), context=context)
+        except StopAsyncIteration:
+            return
 
 class BusinessContextMiddleware:
     """
     Middleware to manage business context for multi-tenancy.
-    This middleware ensures that each request has access to the current business context.
+    This middleware ensures that each request has access to the current business context,
+    both through get_current_business() and as ``request.business``.
     """
-    
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        # Clear any existing business context at the start of each request
-        clear_current_business()
-        
-        # Try to get the current business from the session
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        business = self.resolve_business(request)
+        with business_context(business):
+            response = self.get_response(request)
+            return self.bind_streaming_content(response)
+
+    async def __acall__(self, request):
+        # The session and the tenant cache may hit the database
+        business = await sync_to_async(self.resolve_business)(request)
+        with business_context(business):
+            response = await self.get_response(request)
+            return self.bind_streaming_content(response)
+
+    def resolve_business(self, request):
+        """Resolve the current business from the session through the tenant cache"""
+        request.business = None
         business_id = request.session.get('current_business_id')
         if business_id:
-            try:
-                from .models import Business
-                business = Business.objects.get(id=business_id)
-                set_current_business(business)
-            except (Business.DoesNotExist, ValueError, TypeError):
+            from .tenant_cache import get_business
+            business = get_business(business_id)
+            if business:
+                request.business = business
+            elif 'current_business_id' in request.session:
                 # If the business doesn't exist or business_id is invalid, clear the session value
-                if 'current_business_id' in request.session:
-                    del request.session['current_business_id']
-        
-        response = self.get_response(request)
-        
-        # Clear the business context at the end of the request
-        clear_current_business()
-        
-        return response
\ No newline at end of file
+                del request.session['current_business_id']
+        return request.business
+
+    def bind_streaming_content(self, response):
+        """
+        Streaming content is consumed after this middleware returns; produce
+        it in the request's business context. Files are left to the server's
+        file wrapper, they do not query.
+        """
+        if not response.streaming or isinstance(response, FileResponse) or get_current_business() is None:
+            return response
+        context = copy_context()
+        if response.is_async:
+            response.streaming_content = _aiterate_in_context(context, response.streaming_content)
+        else:
+            response.streaming_content = _iterate_in_context(context, response.streaming_content)
+        return response
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Business
+from .tenant_cache import invalidate_business
+
+
+@receiver(post_save, sender=Business)
+@receiver(post_delete, sender=Business)
+def invalidate_cached_business(sender, instance, **kwargs):
+    """Drop a saved or deleted business from the tenant cache"""
+    invalidate_business(instance.pk)
@@ -0,0 +1,124 @@
+"""
+Cached tenant (Business) resolution.
+
+Resolved businesses are kept in a small in-process LRU with a short TTL and
+in the shared cache backend, so most requests resolve their tenant without a
+database query. Saving or deleting a Business invalidates both (see
+superadmin.signals); other processes drop their in-process copy when its TTL
+expires.
+"""
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Number of businesses kept in the in-process LRU
+TENANT_CACHE_SIZE = getattr(settings, 'TENANT_CACHE_SIZE', 256)
+# Seconds a business is reused from the in-process LRU
+TENANT_LOCAL_TIMEOUT = getattr(settings, 'TENANT_LOCAL_TIMEOUT', 30)
+# Seconds a business is kept in the shared cache backend
+TENANT_CACHE_TIMEOUT = getattr(settings, 'TENANT_CACHE_TIMEOUT', 300)
+
+# Shared cache marker for ids that do not exist, so bad sessions don't hit the database
+MISSING = 'missing'
+
+
+class TenantLRU:
+    """Thread-safe LRU of business id -> (expires_at, business)"""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, business_id):
+        with self._lock:
+            entry = self._entries.get(business_id)
+            if entry is None:
+                return None
+            expires_at, business = entry
+            if expires_at < time.monotonic():
+                del self._entries[business_id]
+                return None
+            self._entries.move_to_end(business_id)
+            return business
+
+    def set(self, business_id, business):
+        with self._lock:
+            self._entries[business_id] = (time.monotonic() + self.timeout, business)
+            self._entries.move_to_end(business_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, business_id):
+        with self._lock:
+            self._entries.pop(business_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = TenantLRU(TENANT_CACHE_SIZE, TENANT_LOCAL_TIMEOUT)
+
+
+def business_cache_key(business_id):
+    return f'tenant:business:{business_id}'
+
+
+def get_business(business_id):
+    """
+    Return the Business with this id, or None if it does not exist.
+    Each call returns its own copy so requests cannot leak state into the cache.
+    """
+    from .models import Business
+
+    try:
+        business_id = int(business_id)
+    except (TypeError, ValueError):
+        return None
+
+    business = _local.get(business_id)
+    if business is None:
+        business = cache.get(business_cache_key(business_id))
+        if business is None:
+            business = Business.objects.filter(id=business_id).first() or MISSING
+            cache.set(business_cache_key(business_id), business, TENANT_CACHE_TIMEOUT)
+        _local.set(business_id, business)
+
+    if isinstance(business, str):
+        return None
+    return copy.copy(business)
+
+
+def invalidate_business(business_id):
+    """Forget a cached business in this process and in the shared cache"""
+    _local.delete(business_id)
+    cache.delete(business_cache_key(business_id))
+
+
+def clear_tenant_cache():
+    """Forget every business cached in this process"""
+    _local.clear()
+
+
+def session_business(request):
+    """
+    Return the business selected in the session, reusing ``request.business``
+    resolved by BusinessContextMiddleware when it still matches the session.
+    Raises Business.DoesNotExist like a direct lookup would.
+    """
+    from .models import Business
+
+    business_id = request.session.get('current_business_id')
+    business = getattr(request, 'business', None)
+    if business is not None and str(business.pk) == str(business_id):
+        return business
+    business = get_business(business_id)
+    if business is None:
+        raise Business.DoesNotExist(f'Business {business_id} does not exist')
+    return business
@@ -0,0 +1,132 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+import asyncio
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, RequestFactory
+
+from superadmin.middleware import BusinessContextMiddleware, business_context, get_current_business
+from superadmin.models import Business
+from superadmin.tenant_cache import clear_tenant_cache, get_business
+
+User = get_user_model()
+
+
+class TenantCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_tenant_cache()
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+
+    def tearDown(self):
+        cache.clear()
+        clear_tenant_cache()
+
+    def request_for(self, business_id):
+        request = RequestFactory().get('/')
+        request.session = {'current_business_id': business_id}
+        return request
+
+    def test_business_resolved_once(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_business(self.business.id), self.business)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_business(self.business.id), self.business)
+
+        # The shared cache backs up the in-process LRU
+        clear_tenant_cache()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_business(self.business.id), self.business)
+
+    def test_save_invalidates_cached_business(self):
+        get_business(self.business.id)
+        self.business.company_name = 'Renamed Shop'
+        self.business.save()
+
+        self.assertEqual(get_business(self.business.id).company_name, 'Renamed Shop')
+
+    def test_middleware_exposes_request_business(self):
+        seen = {}
+
+        def view(request):
+            seen['business'] = request.business
+            seen['context'] = get_current_business()
+            return HttpResponse()
+
+        middleware = BusinessContextMiddleware(view)
+        middleware(self.request_for(self.business.id))
+        self.assertEqual(seen['business'], self.business)
+        self.assertEqual(seen['context'], self.business)
+
+        with self.assertNumQueries(0):
+            middleware(self.request_for(self.business.id))
+
+    def test_middleware_clears_unknown_business(self):
+        request = self.request_for(999999)
+        BusinessContextMiddleware(lambda request: HttpResponse())(request)
+
+        self.assertIsNone(request.business)
+        self.assertNotIn('current_business_id', request.session)
+
+
+class BusinessContextTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_tenant_cache()
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.business = Business.objects.create(company_name='Test Shop', owner=self.user, email='shop@example.com')
+        self.other = Business.objects.create(company_name='Other Shop', owner=self.user, email='other@example.com')
+
+    def tearDown(self):
+        cache.clear()
+        clear_tenant_cache()
+
+    def request_for(self, business_id):
+        request = RequestFactory().get('/')
+        request.session = {'current_business_id': business_id}
+        return request
+
+    def test_context_manager_restores_previous_business(self):
+        self.assertIsNone(get_current_business())
+        with business_context(self.business):
+            with business_context(self.other):
+                self.assertEqual(get_current_business(), self.other)
+            self.assertEqual(get_current_business(), self.business)
+        self.assertIsNone(get_current_business())
+
+    def test_streaming_response_is_produced_in_request_business(self):
+        def chunks():
+            yield get_current_business().company_name
+            yield get_current_business().company_name
+
+        middleware = BusinessContextMiddleware(lambda request: StreamingHttpResponse(chunks()))
+        response = middleware(self.request_for(self.business.id))
+
+        # The middleware has returned, the generator has not run yet
+        self.assertIsNone(get_current_business())
+        self.assertEqual(b''.join(response.streaming_content), b'Test ShopTest Shop')
+        self.assertIsNone(get_current_business())
+
+    async def test_async_requests_keep_their_own_business(self):
+        async def view(request):
+            # Let the other request run in between
+            await asyncio.sleep(0)
+            return HttpResponse(get_current_business().company_name)
+
+        async def chunks():
+            await asyncio.sleep(0)
+            yield get_current_business().company_name
+
+        async def streaming_view(request):
+            return StreamingHttpResponse(chunks())
+
+        responses = await asyncio.gather(
+            BusinessContextMiddleware(view)(self.request_for(self.business.id)),
+            BusinessContextMiddleware(view)(self.request_for(self.other.id)),
+        )
+        self.assertEqual([response.content for response in responses], [b'Test Shop', b'Other Shop'])
+
+        response = await BusinessContextMiddleware(streaming_view)(self.request_for(self.other.id))
+        self.assertEqual([chunk async for chunk in response.streaming_content], [b'Other Shop'])
+        self.assertIsNone(get_current_business())
@@ -18,6 +18,8 @@ from sales.models import Sale
 from customers.models import Customer
 from purchases.models import PurchaseOrder
 from expenses.models import Expense
+from reports.models import DailySalesRollup
+from utils.dates import date_range_filter, on_day
 from .middleware import set_current_business
 from .forms import BranchForm, BusinessDetailsForm
 import psutil
@@ -302,7 +304,7 @@ class APIMonitoringView(TemplateView):
         # API usage statistics
         context['total_api_requests'] = APIRequestLog.objects.count()
         context['api_requests_today'] = APIRequestLog.objects.filter(
-            timestamp__date=timezone.now().date()
+            **on_day('timestamp', timezone.localdate())
         ).count()
         
         # API clients statistics
@@ -389,7 +391,7 @@ class SystemMonitoringView(TemplateView):
         context['api_summary'] = {
             'total_requests': APIRequestLog.objects.count(),
             'requests_today': APIRequestLog.objects.filter(
-                timestamp__date=timezone.now().date()
+                **on_day('timestamp', timezone.localdate())
             ).count(),
             'avg_response_time': APIRequestLog.objects.aggregate(
                 avg_time=Avg('response_time')
@@ -407,7 +409,7 @@ class FinancialDashboardView(TemplateView):
         context = super().get_context_data(**kwargs)
         
         # Get current date and calculate date ranges
-        today = timezone.now().date()
+        today = timezone.localdate()
         first_day_current_month = today.replace(day=1)
         first_day_last_month = (first_day_current_month - timedelta(days=1)).replace(day=1)
         last_day_last_month = first_day_current_month - timedelta(days=1)
@@ -420,7 +422,7 @@ class FinancialDashboardView(TemplateView):
         # Revenue this month
         context['revenue_this_month'] = Payment.objects.filter(
             status='completed',
-            created_at__date__gte=first_day_current_month
+            **date_range_filter('created_at', first_day_current_month)
         ).aggregate(
             total=Sum('amount')
         )['total'] or 0
@@ -428,8 +430,7 @@ class FinancialDashboardView(TemplateView):
         # Revenue last month
         context['revenue_last_month'] = Payment.objects.filter(
             status='completed',
-            created_at__date__gte=first_day_last_month,
-            created_at__date__lte=last_day_last_month
+            **date_range_filter('created_at', first_day_last_month, last_day_last_month)
         ).aggregate(
             total=Sum('amount')
         )['total'] or 0
@@ -842,62 +843,40 @@ def branch_reports_view(request):
     # Get all branches for the current business
     branches = Branch.objects.filter(business=current_business, is_active=True)
     
-    # Calculate branch-specific metrics
-    # NOTE: Since branch fields were removed from models, we can't filter data by branch
-    # We'll show overall business metrics for each branch (same data for all branches)
-    branch_metrics = []
-    for branch in branches:
-        # Get business-specific data (no branch filtering available)
-        branch_products = Product.objects.business_specific()
-        branch_sales = Sale.objects.business_specific()
-        branch_customers = Customer.objects.business_specific()
-        branch_purchases = PurchaseOrder.objects.business_specific()
-        branch_expenses = Expense.objects.business_specific()
-        
-        # Calculate metrics
-        total_products = branch_products.count()
-        total_sales = branch_sales.count()
-        total_customers = branch_customers.count()
-        total_purchases = branch_purchases.count()
-        total_expenses = branch_expenses.count()
-        
-        # Calculate total sales value
-        total_sales_value = branch_sales.aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0
-        
-        # Calculate total expenses value
-        total_expenses_value = branch_expenses.aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        branch_metrics.append({
-            'branch': branch,
-            'total_products': total_products,
-            'total_sales': total_sales,
-            'total_customers': total_customers,
-            'total_purchases': total_purchases,
-            'total_expenses': total_expenses,
-            'total_sales_value': total_sales_value,
-            'total_expenses_value': total_expenses_value,
-        })
-    
-    # Calculate overall business metrics
+    # Record counts are business-wide (products, customers and purchases aren't tracked per branch)
     overall_products = Product.objects.business_specific().count()
-    overall_sales = Sale.objects.business_specific().count()
     overall_customers = Customer.objects.business_specific().count()
     overall_purchases = PurchaseOrder.objects.business_specific().count()
     overall_expenses = Expense.objects.business_specific().count()
     
-    # Calculate overall sales value
-    overall_sales_value = Sale.objects.business_specific().aggregate(
-        total=Sum('total_amount')
-    )['total'] or 0
+    # Sales and expense values per branch come from the daily rollup in one grouped query
+    branch_totals = {
+        row['branch_id']: row
+        for row in DailySalesRollup.objects.business_specific().values('branch_id').annotate(
+            orders=Sum('orders'),
+            revenue=Sum('revenue'),
+            expenses=Sum('expenses')
+        ).order_by()
+    }
+    
+    branch_metrics = []
+    for branch in branches:
+        totals = branch_totals.get(branch.id, {})
+        branch_metrics.append({
+            'branch': branch,
+            'total_products': overall_products,
+            'total_sales': totals.get('orders') or 0,
+            'total_customers': overall_customers,
+            'total_purchases': overall_purchases,
+            'total_expenses': overall_expenses,
+            'total_sales_value': totals.get('revenue') or 0,
+            'total_expenses_value': totals.get('expenses') or 0,
+        })
     
-    # Calculate overall expenses value
-    overall_expenses_value = Expense.objects.business_specific().aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+    # Calculate overall sales count and sales/expenses value
+    overall_sales = sum(row['orders'] or 0 for row in branch_totals.values())
+    overall_sales_value = sum((row['revenue'] or 0 for row in branch_totals.values()), 0)
+    overall_expenses_value = sum((row['expenses'] or 0 for row in branch_totals.values()), 0)
     
     context = {
         'business': current_business,
@@ -4,11 +4,13 @@ from django.contrib import messages
 from .models import Supplier
 from .forms import SupplierForm
 from superadmin.middleware import get_current_business
+from utils.pagination import paginate_request
 
 @login_required
 def supplier_list(request):
     suppliers = Supplier.objects.business_specific().filter(is_active=True)
-    return render(request, 'suppliers/list.html', {'suppliers': suppliers})
+    page = paginate_request(request, suppliers)
+    return render(request, 'suppliers/list.html', {'suppliers': page, 'page': page})
 
 @login_required
 def supplier_create(request):
@@ -0,0 +1,104 @@
+// Service worker of the modern POS: keeps the POS page and the assets it
+// loaded available offline. The catalog and the sales go through the page's
+// own IndexedDB storage, so other requests are left to the network.
+const CACHE = 'pos-shell-v1';
+const SHELL_URL = '{{ shell_url|escapejs }}';
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => name.startsWith('pos-shell-') && name !== CACHE).map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+// The page posts the assets it loaded; cache the missing ones and drop the
+// ones it no longer uses, such as the old hashed names after a deploy
+self.addEventListener('message', (event) => {
+    if (event.data && event.data.type === 'cache-shell') {
+        event.waitUntil(cacheShell(event.data.page, event.data.assets));
+    }
+});
+
+async function cacheShell(page, assets) {
+    const cache = await caches.open(CACHE);
+    const wanted = new Set([new URL(page, self.location.origin).href, ...assets]);
+    const cached = await cache.keys();
+    await Promise.all(cached.filter(request => !wanted.has(request.url)).map(request => cache.delete(request)));
+
+    const present = new Set(cached.map(request => request.url));
+    await Promise.all([...wanted].filter(url => !present.has(url)).map(async (url) => {
+        const sameOrigin = new URL(url).origin === self.location.origin;
+        try {
+            const response = await fetch(url, {
+                mode: sameOrigin ? 'same-origin' : 'no-cors',
+                credentials: 'same-origin'
+            });
+            if (isCacheable(response)) {
+                await cache.put(url, response);
+            }
+        } catch (e) {
+            // Cached on the next visit
+        }
+    }));
+}
+
+function isCacheable(response) {
+    // Opaque responses of CDN assets cannot be inspected; a redirect is the login page
+    return response.type === 'opaque' || (response.ok && !response.redirected);
+}
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+    const url = new URL(request.url);
+    if (request.mode === 'navigate') {
+        if (url.origin === self.location.origin && url.pathname === SHELL_URL) {
+            event.respondWith(shellPage(request));
+        }
+        return;
+    }
+    event.respondWith(asset(event, request));
+});
+
+// The page from the network when it can be reached, so it is never stale online
+async function shellPage(request) {
+    const cache = await caches.open(CACHE);
+    try {
+        const response = await fetch(request);
+        if (isCacheable(response)) {
+            await cache.put(SHELL_URL, response.clone());
+        } else if (response.redirected) {
+            // Logged out: do not keep serving the page offline
+            await cache.delete(SHELL_URL);
+        }
+        return response;
+    } catch (e) {
+        const cached = await cache.match(SHELL_URL);
+        if (cached) {
+            return cached;
+        }
+        throw e;
+    }
+}
+
+// Cached assets are served at once and refreshed in the background
+async function asset(event, request) {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(request);
+    if (!cached) {
+        return fetch(request);
+    }
+    event.waitUntil(
+        fetch(request)
+            .then(response => isCacheable(response) ? cache.put(request, response) : null)
+            .catch(() => null)
+    );
+    return cached;
+}
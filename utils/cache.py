@@ -0,0 +1,22 @@
+"""
+What the configured caches can be trusted with.
+
+Without a CACHES setting Django uses a local-memory cache, which lives in
+each worker process: a write through one worker is invisible to the others.
+Data that other workers change (prices, stock, carts) may only be kept in a
+cache every worker shares, such as Redis or the database cache.
+"""
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+
+# Backends whose entries are private to one process
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared_cache(alias=DEFAULT_CACHE_ALIAS):
+    """Whether every worker process reads and writes the same entries of the ``alias`` cache"""
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    return backend is not None and backend not in PROCESS_LOCAL_BACKENDS
@@ -0,0 +1,41 @@
+"""
+Index-friendly date range filtering.
+
+Filtering a timestamp with ``field__date=...`` or ``field__date__gte=...``
+wraps the column in a cast, which prevents the database from using an index
+on it. These helpers turn business-local calendar days into half-open
+timestamp ranges (``start <= field < end``) that compare the raw column.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def day_start(day):
+    """Return the first instant of a business-local calendar day"""
+    start = datetime.combine(day, time.min)
+    if settings.USE_TZ:
+        return timezone.make_aware(start, timezone.get_current_timezone())
+    return start
+
+
+def date_range_filter(field, start_date=None, end_date=None):
+    """
+    Return lookup kwargs selecting rows whose ``field`` timestamp falls on a
+    business-local day between ``start_date`` and ``end_date`` (inclusive).
+    Either bound may be None to leave that side open.
+
+        Sale.objects.filter(**date_range_filter('sale_date', start_date, end_date))
+    """
+    lookups = {}
+    if start_date is not None:
+        lookups[f'{field}__gte'] = day_start(start_date)
+    if end_date is not None:
+        lookups[f'{field}__lt'] = day_start(end_date + timedelta(days=1))
+    return lookups
+
+
+def on_day(field, day):
+    """Return lookup kwargs selecting rows whose ``field`` timestamp falls on ``day``"""
+    return date_range_filter(field, day, day)
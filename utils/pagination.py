@@ -0,0 +1,178 @@
+"""
+Keyset (cursor) pagination.
+
+OFFSET pagination makes the database walk past every earlier row, so deep
+pages get slower as a table grows. Keyset pagination instead remembers the
+sort key of the last row shown and asks for the rows after it
+(``WHERE (sort_key, id) > (last_key, last_id)``), which an index on the sort
+key serves at the same cost on every page.
+
+The ordering of the queryset (or the model's Meta ordering) is made unique
+by appending the primary key, and pages are addressed by opaque cursors
+encoding the sort key values of a boundary row.
+"""
+import base64
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from decimal import Decimal
+import json
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Rows per page of the paginated list views and REST endpoints
+LIST_PAGE_SIZE = getattr(settings, 'LIST_PAGE_SIZE', 50)
+
+
+class InvalidCursor(ValueError):
+    """The cursor is malformed or does not fit the ordering of the list"""
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    next_cursor: Optional[str] = None
+    previous_cursor: Optional[str] = None
+    next_url: Optional[str] = None
+    previous_url: Optional[str] = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date, time)):
+        # Full precision: truncated timestamps would skip or repeat rows
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values, backwards=False):
+    payload = json.dumps({'v': [_encode_value(value) for value in values], 'b': backwards})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Return ``(values, backwards)`` of a cursor made for an ordering of ``size`` fields"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values, backwards = payload['v'], bool(payload['b'])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+    return values, backwards
+
+
+def keyset_ordering(queryset):
+    """
+    The ordering of ``queryset`` as ``[(field, descending)]``, made unique
+    by appending the primary key in the direction of the last field.
+    """
+    ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+    fields = []
+    for name in ordering:
+        if not isinstance(name, str) or name == '?':
+            raise ValueError(f'Keyset pagination needs field orderings, got {name!r}')
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        fields.append(('pk' if name == queryset.model._meta.pk.name else name, descending))
+    if not any(name == 'pk' for name, _ in fields):
+        fields.append(('pk', fields[-1][1] if fields else False))
+    return fields
+
+
+def _boundary(fields, values, backwards):
+    """Rows after (or before, going backwards) the row with these sort key values"""
+    condition = Q()
+    for index, (name, descending) in enumerate(fields):
+        lookup = 'lt' if descending != backwards else 'gt'
+        equal = {earlier: value for (earlier, _), value in zip(fields[:index], values)}
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[index]})
+    return condition
+
+
+def _sort_values(obj, fields):
+    values = []
+    for name, _ in fields:
+        value = obj
+        for part in name.split('__'):
+            value = getattr(value, part)
+        values.append(value)
+    return values
+
+
+def keyset_paginate(queryset, cursor=None, per_page=LIST_PAGE_SIZE):
+    """
+    Return the KeysetPage of ``queryset`` addressed by ``cursor`` (the first
+    page when None). Raises InvalidCursor for a cursor that does not fit.
+    """
+    fields = keyset_ordering(queryset)
+    backwards = False
+    if cursor:
+        values, backwards = decode_cursor(cursor, len(fields))
+        try:
+            queryset = queryset.filter(_boundary(fields, values, backwards))
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(f'Invalid cursor: {cursor}')
+
+    order_by = [
+        ('-' if descending != backwards else '') + name
+        for name, descending in fields
+    ]
+    try:
+        rows = list(queryset.order_by(*order_by)[:per_page + 1])
+    except ValidationError:
+        # A cursor value the sort field cannot parse
+        raise InvalidCursor(f'Invalid cursor: {cursor}')
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    has_next = more if not backwards else True
+    has_previous = more if backwards else bool(cursor)
+    page = KeysetPage(rows)
+    if rows and has_next:
+        page.next_cursor = encode_cursor(_sort_values(rows[-1], fields))
+    if rows and has_previous:
+        page.previous_cursor = encode_cursor(_sort_values(rows[0], fields), backwards=True)
+    return page
+
+
+def paginate_request(request, queryset, per_page=LIST_PAGE_SIZE, cursor_param='cursor'):
+    """
+    Keyset-paginate ``queryset`` for a list view, reading the cursor from the
+    query string and building next/previous URLs that keep the other filters.
+    An invalid cursor shows the first page.
+    """
+    try:
+        page = keyset_paginate(queryset, request.GET.get(cursor_param), per_page)
+    except InvalidCursor:
+        page = keyset_paginate(queryset, None, per_page)
+
+    for cursor, attribute in [(page.next_cursor, 'next_url'), (page.previous_cursor, 'previous_url')]:
+        if cursor:
+            params = request.GET.copy()
+            params[cursor_param] = cursor
+            setattr(page, attribute, f'?{params.urlencode()}')
+    return page